@@ -0,0 +1,27 @@
+"""
+Python script serving the dashboard (main.py) with a fast start: the
+dashboard is warmed up (see warmup.py) as the server starts, before it
+accepts any connection, so its health check only passes once the first
+session can render from warm caches.
+
+To serve it, input `python3 -m streamlit run app.py` into the command-line
+interface (this needs a Streamlit version with st.App).
+"""
+
+from contextlib import asynccontextmanager
+
+import streamlit as st
+
+from warmup import warm_up
+
+
+@asynccontextmanager
+async def lifespan(app: st.App):
+    """Warms up the dashboard before the server starts serving it."""
+
+    warm_up()
+
+    yield
+
+
+app = st.App("main.py", lifespan=lifespan)
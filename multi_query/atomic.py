@@ -0,0 +1,73 @@
+"""
+Python script providing atomic file writes, shared by every module which
+writes files that other processes read (eg. published snapshots, their
+manifest, the query ledger, the books database and store, and cached API
+responses).
+
+A file is written to a uniquely named temporary file in the same directory
+('.tmp-<random>-<name>', so it keeps its extension), which is synced to
+disk, then renamed over the file; so readers only ever see the old file or
+the complete new one, and concurrent writers never write into the same
+temporary file.
+"""
+
+from contextlib import contextmanager
+from os import O_RDONLY, close, fsync, open as open_fd, path, remove, replace
+from tempfile import mkstemp
+from typing import Iterator
+
+
+def sync_path(filename: str) -> None:
+    """Flushes a file (or directory) to disk."""
+
+    fd = open_fd(filename, O_RDONLY)
+
+    try:
+        fsync(fd)
+    finally:
+        close(fd)
+
+
+@contextmanager
+def atomic_path(filename: str, sync: bool = True) -> Iterator[str]:
+    """
+    Yields the name of a new, empty temporary file next to filename, to be
+    written within the context; it is then renamed over filename (after
+    being synced to disk, unless sync is False). If the context raises, or
+    removes the temporary file, filename is left as it was.
+    """
+
+    directory = path.dirname(filename) or "."
+
+    fd, temp_filename = mkstemp(dir=directory, prefix=".tmp-",
+                                suffix=f"-{path.basename(filename)}")
+    close(fd)
+
+    try:
+        yield temp_filename
+
+    except BaseException:
+
+        if path.exists(temp_filename):
+            remove(temp_filename)
+
+        raise
+
+    if not path.exists(temp_filename):
+        return
+
+    if sync:
+        sync_path(temp_filename)
+
+    replace(temp_filename, filename)
+
+    if sync:
+        sync_path(directory)
+
+
+def write_atomically(filename: str, content: bytes, sync: bool = True) -> None:
+    """Writes content to filename atomically (see atomic_path)."""
+
+    with atomic_path(filename, sync) as temp_filename:
+        with open(temp_filename, "wb") as f:
+            f.write(content)
@@ -0,0 +1,581 @@
+"""
+Python script to benchmark the wrangling and chart aggregation stages of
+the pipeline against synthetic Open Library search responses.
+
+The synthetic responses mimic '/search.json', with each optional field
+missing from a share of the docs so that every fallback in create_pd_df
+is exercised.
+
+To run the benchmark with 500,000 docs, input
+`python3 benchmark.py --docs 500000` into the command-line interface.
+
+To run the suite, which times and memory-profiles every stage of the
+pipeline at 1,000 to 1,000,000 docs and writes the results as JSON (so runs
+can be compared for regressions), input
+`python3 benchmark.py --suite --output results.json`; use `--missing-rate
+<field>=<rate>` to change how often a field is left out of the docs.
+
+To time the dashboard's start (until its health check passes, and until its
+first session has rendered), with and without warming it up first, input
+`python3 benchmark.py --startup` into the command-line interface.
+"""
+
+from argparse import ArgumentParser
+from datetime import datetime
+import json
+from os import chdir, cpu_count, environ as ENV, getcwd, makedirs, path
+import platform
+import random
+import socket
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+from time import perf_counter, sleep
+import tracemalloc
+from urllib.request import urlopen
+
+import pandas as pd
+
+from refresh import write_manifest
+from cube import build_aggregate_cube
+from wrangle import (load_json_data, create_pd_df, create_pd_df_parallel,
+                     remove_duplicate_nan_values_format_cols_df,
+                     apply_df_schema, save_df_cache)
+from diagrams import (create_yearly_count_books_100yrs,
+                      create_books_released_per_year,
+                      create_rating_languages_scatter,
+                      create_books_languages_bar_chart,
+                      create_books_authors_pie_chart,
+                      create_books_rating_line_chart)
+
+SUITE_SCALES = [1_000, 10_000, 100_000, 1_000_000]
+STARTUP_TIMEOUT_SECONDS = 300
+STARTUP_SCRIPT = """
+import json, sys
+from time import perf_counter
+start = perf_counter()
+from streamlit.testing.v1 import AppTest
+if sys.argv[1] == "warm":
+    from warmup import warm_up
+    warm_up()
+ready = perf_counter() - start
+app_test = AppTest.from_file(sys.argv[2], default_timeout=float(sys.argv[3]))
+app_test.run()
+print(json.dumps({"ready_seconds": ready,
+                  "first_render_seconds": perf_counter() - start - ready,
+                  "exceptions": len(app_test.exception)}))
+"""
+MISSING_FIELD_RATES = {"title": 0.05, "subtitle": 0.7,
+                       "author_name": 0.1, "author_alternative_name": 0.5,
+                       "ratings_average": 0.6, "language": 0.3,
+                       "first_publish_year": 0.05}
+
+
+def generate_search_responses(n_docs: int, n_responses: int = 13,
+                              missing_rates: dict = None,
+                              seed: int = 0) -> list[dict]:
+    """
+    Returns n_docs synthetic docs split across n_responses search responses,
+    in the same list[dict] shape as get_all_queries_responses. Each optional
+    field is left out of a doc with the probability given in missing_rates.
+    """
+
+    if missing_rates is None:
+        missing_rates = MISSING_FIELD_RATES
+
+    rng = random.Random(seed)
+
+    def present(field: str) -> bool:
+        return rng.random() >= missing_rates.get(field, 0)
+
+    docs = []
+
+    for i in range(n_docs):
+
+        doc = {"key": f"/works/OL{rng.randint(1, max(n_docs // 2, 1))}W",
+               "title_suggest": f"Book {i}"}
+
+        if present("title"):
+            doc["title"] = f"Book {i}"
+        if present("subtitle"):
+            doc["subtitle"] = f"Volume {rng.randint(1, 5)}"
+        if present("author_name"):
+            doc["author_name"] = [f"Author {rng.randint(1, 5000)}"]
+        if present("author_alternative_name"):
+            doc["author_alternative_name"] = [f"A. {rng.randint(1, 5000)}"]
+        if present("ratings_average"):
+            doc["ratings_average"] = round(rng.uniform(1, 5), 2)
+        if present("language"):
+            doc["language"] = ["eng", "fre", "ger", "spa"][:rng.randint(1, 4)]
+        if present("first_publish_year"):
+            doc["first_publish_year"] = rng.randint(1850, 2024)
+
+        docs.append(doc)
+
+    chunk_size = -(-n_docs // n_responses)
+
+    return [{"numFound": n_docs, "start": 0,
+             "docs": docs[i:i + chunk_size]}
+            for i in range(0, max(n_docs, 1), chunk_size)]
+
+
+def create_pd_df_per_doc(api_response: list[dict]) -> pd.DataFrame:
+    """
+    Reference implementation of create_pd_df which walks every doc with a
+    try/except per field; used as the baseline for the benchmark, and to
+    check the outputs of both match.
+    """
+
+    rows = {"unique_key": [], "book_title": [], "author_name": [],
+            "average_rating": [], "no_of_languages": [], "first_published": []}
+
+    for response_dict in api_response:
+
+        for doc in response_dict["docs"]:
+
+            rows["unique_key"].append(doc["key"])
+
+            try:
+                rows["book_title"].append(f"{doc['title']}: {doc['subtitle']}")
+            except KeyError:
+                rows["book_title"].append(doc["title_suggest"])
+
+            try:
+                rows["author_name"].append(doc["author_name"][0])
+            except KeyError:
+                try:
+                    rows["author_name"].append(doc["author_alternative_name"][0])
+                except KeyError:
+                    rows["author_name"].append(None)
+
+            try:
+                rows["average_rating"].append(doc["ratings_average"])
+            except KeyError:
+                rows["average_rating"].append(None)
+
+            try:
+                rows["no_of_languages"].append(len(doc["language"]))
+            except KeyError:
+                rows["no_of_languages"].append(None)
+
+            try:
+                rows["first_published"].append(doc["first_publish_year"])
+            except KeyError:
+                rows["first_published"].append(None)
+
+    return pd.DataFrame(rows)
+
+
+def create_yearly_count_books_per_row(input_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Reference implementation of create_yearly_count_books_100yrs which checks
+    each year with .apply, and appends missing years to the frame one at a
+    time; used as the baseline for the benchmark.
+    """
+    this_year = int(datetime.today().year)
+
+    years_df = input_df["first_published"].value_counts().reset_index()
+
+    years_df = years_df.rename(columns={'first_published': 'Year Published',
+                                        'count': 'Number of Books Published'})
+
+    years_df["last_100_years"] = years_df["Year Published"].apply(
+        lambda year: int(datetime.today().year) - year <= 100)
+
+    years_df = years_df[years_df["last_100_years"]].reset_index()
+
+    years_df.drop(columns=['last_100_years', 'index'], inplace=True)
+
+    existing_years = {years_df.loc[i]["Year Published"]
+                      for i in range(len(years_df))}
+
+    for year in set(range(this_year - 100, this_year + 1)) - existing_years:
+        years_df.loc[len(years_df)] = [year, 0]
+
+    return years_df
+
+
+def time_function(func, *args, repeats: int = 3) -> float:
+    """Returns the best wall time, in seconds, of repeated calls of func."""
+
+    timings = []
+
+    for _ in range(repeats):
+        start = perf_counter()
+        func(*args)
+        timings.append(perf_counter() - start)
+
+    return min(timings)
+
+
+def profile_function(func, *args, repeats: int = 3) -> dict:
+    """
+    Returns the best wall time, in seconds, of repeated calls of func, and the
+    peak memory, in MB, Python allocated during one further (traced) call.
+    """
+
+    seconds = time_function(func, *args, repeats=repeats)
+
+    tracemalloc.start()
+
+    try:
+        func(*args)
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {"seconds": round(seconds, 4),
+            "peak_memory_mb": round(peak_bytes / 1024 ** 2, 2)}
+
+
+def benchmark_cached_read(input_df: pd.DataFrame, repeats: int = 3) -> dict:
+    """
+    Profiles main.extract_wrangle_pd_df reading today's published snapshot
+    (in each DF_CACHE_FORMAT), from a temporary directory.
+    """
+
+    import main
+
+    results = {}
+    original_dir = getcwd()
+
+    with TemporaryDirectory() as temp_dir:
+
+        chdir(temp_dir)
+
+        try:
+            for cache_format in ["parquet", "feather", "csv"]:
+
+                books_filename = f"{main.get_data_version()}_multi.{cache_format}"
+
+                save_df_cache(input_df, books_filename)
+
+                write_manifest({"version": main.get_data_version(),
+                                "books": books_filename,
+                                "cube": f"{main.get_data_version()}_multi_cube.{cache_format}"})
+
+                results[cache_format] = profile_function(main.extract_wrangle_pd_df,
+                                                         repeats=repeats)
+        finally:
+            chdir(original_dir)
+
+    return results
+
+
+def benchmark_pipeline_stages(n_docs: int, missing_rates: dict = None,
+                              repeats: int = 3) -> dict:
+    """
+    Returns the wall time and peak memory of each stage of the pipeline on
+    n_docs synthetic docs: loading the extracted JSON file, create_pd_df,
+    cleaning, building (and serialising) each chart in diagrams.py, and
+    reading the cached pd.DataFrame object in extract_wrangle_pd_df.
+    """
+
+    api_response = generate_search_responses(n_docs, missing_rates=missing_rates)
+
+    stages = {}
+
+    with TemporaryDirectory() as temp_dir:
+
+        json_filename = path.join(temp_dir, "extract.json")
+
+        with open(json_filename, "w", encoding="utf-8") as f:
+            json.dump(api_response, f, separators=(",", ":"))
+
+        stages["load_json_data"] = profile_function(load_json_data, json_filename,
+                                                    repeats=repeats)
+
+    stages["create_pd_df"] = profile_function(create_pd_df, api_response,
+                                              repeats=repeats)
+
+    raw_df = create_pd_df(api_response)
+
+    stages["remove_duplicate_nan_values_format_cols_df"] = profile_function(
+        remove_duplicate_nan_values_format_cols_df, raw_df, repeats=repeats)
+
+    input_df = apply_df_schema(remove_duplicate_nan_values_format_cols_df(raw_df))
+
+    years_df = create_yearly_count_books_100yrs(input_df)
+
+    chart_builders = {
+        "create_yearly_count_books_100yrs": lambda: create_yearly_count_books_100yrs(input_df),
+        "create_books_released_per_year": lambda: create_books_released_per_year(years_df).to_dict(),
+        "create_rating_languages_scatter": lambda: create_rating_languages_scatter(input_df).to_dict(),
+        "create_books_languages_bar_chart": lambda: create_books_languages_bar_chart(input_df).to_dict(),
+        "create_books_authors_pie_chart": lambda: create_books_authors_pie_chart(input_df).to_dict(),
+        "create_books_rating_line_chart": lambda: create_books_rating_line_chart(input_df).to_dict()}
+
+    for name, builder in chart_builders.items():
+        stages[name] = profile_function(builder, repeats=repeats)
+
+    stages["extract_wrangle_pd_df_cached"] = benchmark_cached_read(input_df, repeats)
+
+    return {"n_docs": n_docs, "n_rows": len(input_df), "stages": stages}
+
+
+def run_benchmark_suite(scales: list[int] = None, missing_rates: dict = None,
+                        repeats: int = 3) -> dict:
+    """Returns the results of benchmark_pipeline_stages at each scale, with
+    details of the run (so results can be compared between runs)."""
+
+    if scales is None:
+        scales = SUITE_SCALES
+
+    if missing_rates is None:
+        missing_rates = MISSING_FIELD_RATES
+
+    return {"run_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "cpu_count": cpu_count(),
+            "repeats": repeats,
+            "missing_rates": missing_rates,
+            "results": [benchmark_pipeline_stages(n_docs, missing_rates, repeats)
+                        for n_docs in scales]}
+
+
+def benchmark_create_pd_df(n_docs: int, repeats: int = 3) -> dict:
+    """Times create_pd_df against the per-doc reference implementation
+    on n_docs synthetic docs, checking both give the same pd.DataFrame."""
+
+    api_response = generate_search_responses(n_docs)
+
+    pd.testing.assert_frame_equal(create_pd_df_per_doc(api_response),
+                                  create_pd_df(api_response))
+
+    per_doc = time_function(create_pd_df_per_doc, api_response, repeats=repeats)
+    columnar = time_function(create_pd_df, api_response, repeats=repeats)
+
+    return {"n_docs": n_docs,
+            "per_doc_seconds": round(per_doc, 4),
+            "columnar_seconds": round(columnar, 4),
+            "speed_up": round(per_doc / columnar, 2)}
+
+
+def benchmark_yearly_counts(n_docs: int, repeats: int = 3) -> dict:
+    """Times create_yearly_count_books_100yrs against the per-row reference
+    implementation on n_docs synthetic docs, checking both give the same
+    counts for each year."""
+
+    input_df = remove_duplicate_nan_values_format_cols_df(
+        create_pd_df(generate_search_responses(n_docs)))
+
+    expected = create_yearly_count_books_per_row(input_df).sort_values(
+        "Year Published", ignore_index=True)
+
+    pd.testing.assert_frame_equal(expected,
+                                  create_yearly_count_books_100yrs(input_df),
+                                  check_dtype=False)
+
+    per_row = time_function(create_yearly_count_books_per_row, input_df,
+                            repeats=repeats)
+    vectorised = time_function(create_yearly_count_books_100yrs, input_df,
+                               repeats=repeats)
+
+    return {"n_rows": len(input_df),
+            "per_row_seconds": round(per_row, 4),
+            "vectorised_seconds": round(vectorised, 4),
+            "speed_up": round(per_row / vectorised, 2)}
+
+
+def benchmark_parallel_wrangle(n_docs: int, n_files: int = 4,
+                               max_workers: int | None = None,
+                               repeats: int = 3) -> dict:
+    """
+    Times create_pd_df_parallel on n_docs synthetic docs, split across
+    n_files newline-delimited JSON files, with 1, 2, 4, ... up to max_workers
+    worker processes (by default, the number of CPU cores); checking every
+    worker count gives the same pd.DataFrame as wrangling serially.
+    """
+
+    max_workers = max_workers or cpu_count() or 1
+
+    worker_counts = sorted({min(2 ** i, max_workers)
+                            for i in range(max_workers.bit_length() + 1)})
+
+    api_response = generate_search_responses(n_docs, n_responses=n_files)
+
+    with TemporaryDirectory() as temp_dir:
+
+        filenames = []
+
+        for i, response_dict in enumerate(api_response):
+            filename = path.join(temp_dir, f"extract_{i}.ndjson")
+            with open(filename, "w", encoding="utf-8") as f:
+                for doc in response_dict["docs"]:
+                    f.write(json.dumps(doc, separators=(",", ":")) + "\n")
+            filenames.append(filename)
+
+        chunk_bytes = max(sum(path.getsize(filename) for filename in filenames)
+                          // (max_workers * 4), 1)
+
+        expected = create_pd_df(api_response)
+
+        timings = {}
+
+        for workers in worker_counts:
+
+            pd.testing.assert_frame_equal(
+                expected, create_pd_df_parallel(filenames, workers, chunk_bytes))
+
+            timings[workers] = time_function(create_pd_df_parallel, filenames,
+                                             workers, chunk_bytes,
+                                             repeats=repeats)
+
+    return {"n_docs": n_docs,
+            "n_files": n_files,
+            "seconds_by_workers": {workers: round(seconds, 4)
+                                   for workers, seconds in timings.items()},
+            "speed_up_by_workers": {workers: round(timings[1] / seconds, 2)
+                                    for workers, seconds in timings.items()}}
+
+
+def get_free_port() -> int:
+    """Returns a TCP port on localhost that is free to listen on."""
+
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def time_server_health(script: str, env: dict, cwd: str) -> float:
+    """Returns the seconds from running `streamlit run <script>` until its
+    health check passes."""
+
+    port = get_free_port()
+
+    start = perf_counter()
+
+    server = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", script,
+         "--server.headless", "true", "--server.port", str(port)],
+        env=env, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    try:
+        while perf_counter() - start < STARTUP_TIMEOUT_SECONDS:
+            try:
+                with urlopen(f"http://localhost:{port}/_stcore/health", timeout=1):
+                    return perf_counter() - start
+            except OSError:
+                sleep(0.05)
+
+        raise TimeoutError(f"{script} did not become healthy in time")
+
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def benchmark_startup(n_docs: int, repeats: int = 3) -> dict:
+    """
+    Times the dashboard's start against a published snapshot of n_docs
+    synthetic docs, each time in a new process (so with nothing imported or
+    cached): 'cold', serving main.py; and 'warm', serving app.py, which warms
+    it up first (see warmup.py). For each, returns the best seconds until the
+    server's health check passes, until the process could serve a session,
+    and for that first session to render, and their total (the time to
+    first render).
+    """
+
+    module_dir = path.dirname(path.abspath(__file__))
+
+    input_df = apply_df_schema(remove_duplicate_nan_values_format_cols_df(
+        create_pd_df(generate_search_responses(n_docs))))
+
+    results = {}
+
+    with TemporaryDirectory() as temp_dir:
+
+        snapshot_dir = path.join(temp_dir, "snapshot")
+        makedirs(snapshot_dir)
+
+        env = dict(ENV, REFRESH_MODE="published", SNAPSHOT_DIR=snapshot_dir,
+                   PYTHONPATH=module_dir)
+
+        save_df_cache(input_df, path.join(snapshot_dir, "books.parquet"))
+        save_df_cache(build_aggregate_cube(input_df),
+                      path.join(snapshot_dir, "books_cube.parquet"))
+
+        write_manifest({"version": "startup-benchmark",
+                        "books": "books.parquet",
+                        "cube": "books_cube.parquet"},
+                       path.join(snapshot_dir, "manifest.json"))
+
+        for mode, script in [("cold", "main.py"), ("warm", "app.py")]:
+
+            runs = []
+
+            for _ in range(repeats):
+
+                run = subprocess.run(
+                    [sys.executable, "-c", STARTUP_SCRIPT, mode,
+                     path.join(module_dir, "main.py"), str(STARTUP_TIMEOUT_SECONDS)],
+                    env=env, cwd=temp_dir, check=True, capture_output=True,
+                    text=True)
+
+                run_result = json.loads(run.stdout.strip().splitlines()[-1])
+
+                if run_result["exceptions"]:
+                    raise RuntimeError(f"The dashboard raised an exception ({mode})")
+
+                run_result["healthy_seconds"] = time_server_health(
+                    path.join(module_dir, script), env, temp_dir)
+
+                runs.append(run_result)
+
+            results[mode] = {
+                key: round(min(run[key] for run in runs), 4)
+                for key in ["healthy_seconds", "ready_seconds", "first_render_seconds"]}
+
+            results[mode]["time_to_first_render_seconds"] = round(
+                min(run["ready_seconds"] + run["first_render_seconds"] for run in runs), 4)
+
+    return {"n_docs": n_docs, "n_books": len(input_df), **results}
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Benchmark the pipeline stages.")
+    parser.add_argument("--docs", type=int, default=500_000)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--suite", action="store_true")
+    parser.add_argument("--startup", action="store_true")
+    parser.add_argument("--scales", type=int, nargs="+", default=SUITE_SCALES)
+    parser.add_argument("--missing-rate", action="append", default=[],
+                        metavar="FIELD=RATE")
+    parser.add_argument("--output", default=None)
+
+    args = parser.parse_args()
+
+    if args.suite:
+
+        suite_missing_rates = dict(MISSING_FIELD_RATES)
+
+        for field_rate in args.missing_rate:
+            field, rate = field_rate.split("=")
+            suite_missing_rates[field] = float(rate)
+
+        suite_results = json.dumps(run_benchmark_suite(args.scales,
+                                                       suite_missing_rates,
+                                                       args.repeats), indent=2)
+
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                f.write(suite_results)
+        else:
+            print(suite_results)
+
+    elif args.startup:
+
+        print(json.dumps(benchmark_startup(args.docs, args.repeats), indent=2))
+
+    else:
+
+        print(benchmark_create_pd_df(args.docs, args.repeats))
+
+        print(benchmark_yearly_counts(args.docs, args.repeats))
+
+        print(benchmark_parallel_wrangle(args.docs, max_workers=args.workers,
+                                         repeats=args.repeats))
@@ -0,0 +1,257 @@
+"""
+Python script providing a persistent, on-disk cache for API responses.
+
+Each request URL (and so each search query/page) is cached as its own entry:
+a '.body' file holding the raw response, and a '.meta.json' file holding the
+URL, the time it was fetched, and its 'ETag'/'Last-Modified' headers.
+
+• Entries younger than the TTL are served straight from disk.
+• Stale entries are revalidated with 'If-None-Match'/'If-Modified-Since',
+  so an unchanged response costs a '304 Not Modified' rather than a download.
+• Once the cache grows past its size limit, the least recently used entries
+  are evicted, until it is down to CACHE_EVICTION_RATIO of the limit. The
+  cache's size is kept as a running total of the entries written (scanned
+  from disk once per process, and again whenever entries are evicted), so
+  writing an entry does not scan the cache.
+
+The cache can be configured with the environment variables
+OPEN_LIBRARY_CACHE_DIR, OPEN_LIBRARY_CACHE_TTL (seconds) and
+OPEN_LIBRARY_CACHE_MAX_BYTES.
+"""
+
+from hashlib import sha256
+import json
+from os import environ as ENV, makedirs, path, remove, scandir, utime
+from threading import Lock
+from time import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from atomic import write_atomically
+
+CACHE_DIR = ENV.get("OPEN_LIBRARY_CACHE_DIR", ".cache")
+CACHE_TTL_SECONDS = int(ENV.get("OPEN_LIBRARY_CACHE_TTL", 24 * 60 * 60))
+CACHE_MAX_BYTES = int(ENV.get("OPEN_LIBRARY_CACHE_MAX_BYTES", 500 * 1024 ** 2))
+
+CACHE_EVICTION_RATIO = 0.9
+
+_eviction_lock = Lock()
+_cache_sizes = {}
+
+
+def get_cache_paths(url: str, cache_dir: str) -> tuple[str, str]:
+    """Returns the body and metadata file paths of the cache entry for a URL."""
+
+    key = sha256(url.encode("utf-8")).hexdigest()
+
+    return (path.join(cache_dir, f"{key}.body"),
+            path.join(cache_dir, f"{key}.meta.json"))
+
+
+def read_cache_entry(url: str, cache_dir: str) -> tuple[dict, bytes] | None:
+    """Returns the metadata and body of the cache entry for a URL,
+    or None if there is no (complete) entry."""
+
+    body_path, meta_path = get_cache_paths(url, cache_dir)
+
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+
+        with open(body_path, "rb") as f:
+            body = f.read()
+
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    return meta, body
+
+
+def write_cache_entry(url: str, response: requests.Response, cache_dir: str,
+                      max_bytes: int = CACHE_MAX_BYTES) -> None:
+    """Stores a successful response in the cache, evicting the least recently
+    used entries if the cache is now larger than max_bytes (see
+    update_cache_size)."""
+
+    makedirs(cache_dir, exist_ok=True)
+
+    body_path, meta_path = get_cache_paths(url, cache_dir)
+
+    meta = {"url": url,
+            "fetched_at": time(),
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "content_type": response.headers.get("Content-Type")}
+
+    old_size = get_entry_size(body_path, meta_path)
+
+    # Entries are not synced to disk, as a lost entry is just fetched again.
+    write_atomically(body_path, response.content, sync=False)
+    write_atomically(meta_path, json.dumps(meta).encode("utf-8"), sync=False)
+
+    update_cache_size(cache_dir, get_entry_size(body_path, meta_path) - old_size,
+                      max_bytes)
+
+
+def touch_cache_entry(url: str, cache_dir: str, revalidated: bool = False) -> None:
+    """Marks the cache entry for a URL as recently used; if it has just been
+    revalidated, its fetched time is also reset so its TTL starts again."""
+
+    body_path, meta_path = get_cache_paths(url, cache_dir)
+
+    try:
+        if revalidated:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+
+            meta["fetched_at"] = time()
+
+            write_atomically(meta_path, json.dumps(meta).encode("utf-8"), sync=False)
+
+        utime(body_path)
+
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+
+
+def get_entry_size(body_path: str, meta_path: str) -> int:
+    """Returns the size of a cache entry's files, or 0 if it has none."""
+
+    size = 0
+
+    for filename in (body_path, meta_path):
+        try:
+            size += path.getsize(filename)
+        except FileNotFoundError:
+            pass
+
+    return size
+
+
+def scan_cache_entries(cache_dir: str) -> list[tuple[float, int, str, str]]:
+    """Returns the last used time, size, and body and metadata file paths of
+    each entry in the cache."""
+
+    entries = []
+
+    with scandir(cache_dir) as it:
+        for entry in it:
+            if entry.name.endswith(".body"):
+                meta_path = entry.path[:-len(".body")] + ".meta.json"
+                stat = entry.stat()
+
+                entries.append((stat.st_mtime,
+                                get_entry_size(entry.path, meta_path),
+                                entry.path, meta_path))
+
+    return entries
+
+
+def evict_lru_entries(cache_dir: str, max_bytes: int = CACHE_MAX_BYTES) -> int:
+    """Removes the least recently used cache entries until the total size
+    of the cache is at most max_bytes, returning its total size."""
+
+    entries = scan_cache_entries(cache_dir)
+
+    total_bytes = sum(size for _, size, _, _ in entries)
+
+    for _, size, body_path, meta_path in sorted(entries):
+
+        if total_bytes <= max_bytes:
+            break
+
+        for filename in (body_path, meta_path):
+            try:
+                remove(filename)
+            except FileNotFoundError:
+                pass
+
+        total_bytes -= size
+
+    return total_bytes
+
+
+def update_cache_size(cache_dir: str, n_bytes: int,
+                      max_bytes: int = CACHE_MAX_BYTES) -> None:
+    """
+    Adds n_bytes to the running total size of the cache (scanning it the
+    first time), and once that is larger than max_bytes, evicts the least
+    recently used entries down to CACHE_EVICTION_RATIO of max_bytes, so
+    the cache is only scanned again after many more writes. The total also
+    picks up entries written by other processes whenever the cache is
+    scanned.
+    """
+
+    key = path.abspath(cache_dir)
+
+    with _eviction_lock:
+
+        if key in _cache_sizes:
+            _cache_sizes[key] += n_bytes
+        else:
+            _cache_sizes[key] = sum(size for _, size, _, _ in scan_cache_entries(cache_dir))
+
+        if _cache_sizes[key] > max_bytes:
+            _cache_sizes[key] = evict_lru_entries(
+                cache_dir, int(max_bytes * CACHE_EVICTION_RATIO))
+
+
+def build_cached_response(url: str, meta: dict, body: bytes) -> requests.Response:
+    """Returns a requests.Response object built from a cache entry."""
+
+    response = requests.Response()
+
+    response.status_code = 200
+    response.url = url
+    response._content = body
+    response.encoding = "utf-8"
+    response.headers = CaseInsensitiveDict(
+        {"Content-Type": meta.get("content_type") or "application/json",
+         "X-Cache": "HIT"})
+
+    return response
+
+
+def cached_get(session: requests.Session, url: str, timeout: float,
+               cache_dir: str | None = CACHE_DIR,
+               ttl: float = CACHE_TTL_SECONDS,
+               max_bytes: int = CACHE_MAX_BYTES) -> requests.Response:
+    """
+    Sends a GET request for a URL through the on-disk cache. Fresh entries
+    are returned without a request; stale ones are revalidated, and a
+    '304 Not Modified' is answered from the cache. Pass cache_dir=None to
+    bypass the cache entirely.
+    """
+
+    if cache_dir is None:
+        return session.get(url, timeout=timeout)
+
+    cached = read_cache_entry(url, cache_dir)
+
+    headers = {}
+
+    if cached is not None:
+
+        meta, body = cached
+
+        if time() - meta["fetched_at"] < ttl:
+            touch_cache_entry(url, cache_dir)
+            return build_cached_response(url, meta, body)
+
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    response = session.get(url, headers=headers, timeout=timeout)
+
+    if response.status_code == 304 and cached is not None:
+        touch_cache_entry(url, cache_dir, revalidated=True)
+        return build_cached_response(url, *cached)
+
+    if response.status_code == 200:
+        write_cache_entry(url, response, cache_dir, max_bytes)
+
+    return response
@@ -0,0 +1,124 @@
+"""
+Python script to build a small aggregate cube of the wrangled books, so that
+the dashboard's metrics and charts can read pre-aggregated counts and sums
+rather than re-aggregating every row on each render.
+
+The cube holds the number of books, and the sums of their average ratings
+and numbers of languages, for every combination of:
+• The year the book was first published;
+• The book's average rating, rounded down into buckets of RATING_BUCKET_WIDTH;
+• The number of languages the book was published in.
+
+Authors are left out of the cube, as nearly every book combines its author
+with the other dimensions into a combination of its own (so the cube would
+hold about one row per book); the number of books of each author is a
+separate rollup instead (see build_author_counts).
+
+Ratings are bucketed on whole hundredths (the API gives them to 2 decimal
+places), as the wrangled ratings are float32 values (eg. 4.1 is stored as
+4.0999999), which would otherwise be rounded down into the bucket below.
+"""
+
+import numpy as np
+import pandas as pd
+
+RATING_BUCKET_WIDTH = 0.1
+CUBE_DIMENSIONS = ["first_published", "rating_bucket", "no_of_languages"]
+EXACT_RANGE_DIMENSIONS = ["first_published", "no_of_languages"]
+
+
+def get_rating_bucket(rating: float, width: float = RATING_BUCKET_WIDTH) -> float:
+    """Returns the bucket of an average rating: its value rounded down to a
+    multiple of width, on whole hundredths of a rating."""
+
+    width_hundredths = round(width * 100)
+
+    return round(round(rating * 100) // width_hundredths * width_hundredths / 100, 2)
+
+
+def get_rating_hundredths(ratings: pd.Series | np.ndarray) -> np.ndarray:
+    """Returns each average rating as a whole number of hundredths (eg. 410
+    for a float32 4.0999999), as int64 values."""
+
+    return np.rint(np.asarray(ratings, dtype=np.float64) * 100).astype(np.int64)
+
+
+def get_rating_buckets(ratings: pd.Series | np.ndarray,
+                       width: float = RATING_BUCKET_WIDTH) -> np.ndarray:
+    """Returns the bucket of each average rating (as get_rating_bucket), as
+    float64 values."""
+
+    width_hundredths = round(width * 100)
+
+    hundredths = get_rating_hundredths(ratings)
+
+    return (hundredths // width_hundredths * width_hundredths / 100).round(2)
+
+
+def build_aggregate_cube(input_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Given the wrangled pd.DataFrame object, returns its aggregate cube,
+    with one row per combination of CUBE_DIMENSIONS that has any books.
+    """
+
+    ratings = input_df["average_rating"].astype("float64")
+
+    cube_df = input_df.assign(rating_bucket=get_rating_buckets(ratings),
+                              average_rating=ratings)
+
+    cube = cube_df.groupby(CUBE_DIMENSIONS, observed=True, sort=False).agg(
+        book_count=("average_rating", "size"),
+        rating_sum=("average_rating", "sum"),
+        languages_sum=("no_of_languages", "sum")).reset_index()
+
+    return cube.astype({"book_count": "int32", "languages_sum": "int64"})
+
+
+def slice_aggregate_cube(cube: pd.DataFrame, ranges: dict) -> pd.DataFrame | None:
+    """
+    Returns the slice of the cube matching a set of range filters, mapping
+    columns to (low, high) bounds; or None if a range is on a column the
+    cube only holds in buckets, so cannot be answered exactly.
+    """
+
+    if any(col not in EXACT_RANGE_DIMENSIONS for col in ranges):
+        return None
+
+    mask = np.ones(len(cube), dtype=bool)
+
+    for col, (low, high) in ranges.items():
+        mask &= cube[col].between(low, high).to_numpy()
+
+    return cube[mask]
+
+
+def build_author_counts(input_df: pd.DataFrame) -> pd.Series:
+    """Given the wrangled pd.DataFrame object (or its 'author_name' column),
+    returns the number of books of each author, most books first (ties in
+    order of name)."""
+
+    author_counts = input_df["author_name"].value_counts(sort=False)
+
+    author_counts = author_counts[author_counts > 0].astype("int64")
+
+    return author_counts.sort_index().sort_values(ascending=False, kind="stable")
+
+
+def get_cube_counts(cube: pd.DataFrame, dimension: str) -> pd.Series:
+    """Returns the number of books for each value of a cube dimension."""
+
+    return cube.groupby(dimension, observed=True)["book_count"].sum()
+
+
+def get_cube_totals(cube: pd.DataFrame) -> dict:
+    """Returns the total number of books in the cube, and their aggregated
+    average rating and number of languages published."""
+
+    total_books = int(cube["book_count"].sum())
+
+    if total_books == 0:
+        return {"total_books": 0, "avg_rating": 0, "avg_languages": 0}
+
+    return {"total_books": total_books,
+            "avg_rating": round(cube["rating_sum"].sum()/total_books, 2),
+            "avg_languages": round(cube["languages_sum"].sum()/total_books, 2)}
@@ -0,0 +1,320 @@
+"""
+Python script to load the wrangled books into an embedded SQLite database,
+and to answer the dashboard's filters and charts with SQL aggregations, so
+only small aggregated results (rather than every book) are held in memory.
+
+The 'books' table has one row per book, with indexes on the year first
+published, the author's name and the Open Library work key. Each database
+records the version of the data (ie. the day's snapshot) it was loaded from,
+and is replaced atomically when a new version is loaded.
+
+Every query takes a filter state, in the same shape as filters.py: a dict
+with the 'search' text, the 'selected_keys' picked from its results, and
+'ranges', mapping columns in RANGE_COLUMNS to (low, high) bounds.
+"""
+
+from contextlib import closing
+from os import environ as ENV, path
+import sqlite3
+
+import pandas as pd
+
+from atomic import atomic_path
+from cube import RATING_BUCKET_WIDTH
+from filters import RANGE_COLUMNS, get_range_values, normalise_text
+from wrangle import DF_SCHEMA, apply_df_schema
+
+DATABASE_FILENAME = ENV.get("BOOKS_DATABASE", "books.sqlite")
+BOOKS_TABLE_SQL = """
+CREATE TABLE books (
+    unique_key TEXT PRIMARY KEY,
+    book_title TEXT,
+    author_name TEXT,
+    average_rating REAL,
+    no_of_languages INTEGER,
+    first_published INTEGER,
+    search_text TEXT
+)
+"""
+BOOKS_INDEXES_SQL = [
+    "CREATE INDEX books_first_published ON books (first_published)",
+    "CREATE INDEX books_author_name ON books (author_name)"]
+# The bucket of an average rating, on whole hundredths of a rating (as
+# cube.get_rating_buckets), given the bucket width in hundredths.
+RATING_BUCKET_SQL = ("ROUND(CAST(ROUND(average_rating * 100) AS INTEGER)"
+                     " / {width} * {width} / 100.0, 2)")
+QUERY_EXPRESSIONS = {
+    "first_published": "first_published",
+    "author_name": "author_name",
+    "no_of_languages": "no_of_languages",
+    "rating_bucket": RATING_BUCKET_SQL.format(width=round(RATING_BUCKET_WIDTH * 100))}
+# Range filters compare average ratings on whole hundredths (as
+# filters.get_range_values), as they are stored as float32 values.
+RANGE_EXPRESSIONS = {"average_rating": "ROUND(average_rating * 100)"}
+INSERT_CHUNK_SIZE = 10_000
+
+
+def connect_database(database_filename: str = DATABASE_FILENAME,
+                     read_only: bool = True) -> sqlite3.Connection:
+    """Returns a connection to the database; read-only by default, so the
+    dashboard can never change it."""
+
+    if read_only:
+        return sqlite3.connect(f"file:{path.abspath(database_filename)}?mode=ro",
+                               uri=True, check_same_thread=False)
+
+    return sqlite3.connect(database_filename)
+
+
+def get_database_version(database_filename: str = DATABASE_FILENAME) -> str | None:
+    """Returns the version of the data the database was loaded from, or None
+    if there is no database yet."""
+
+    if not path.isfile(database_filename):
+        return None
+
+    with closing(connect_database(database_filename)) as connection:
+        row = connection.execute(
+            "SELECT value FROM metadata WHERE name = 'data_version'").fetchone()
+
+    return row[0] if row else None
+
+
+def load_books_into_database(input_df: pd.DataFrame, data_version: str,
+                             database_filename: str = DATABASE_FILENAME) -> None:
+    """
+    Writes the wrangled pd.DataFrame object into a new database, indexed on
+    the year first published, author name and work key, then swaps it in
+    place of the old database, so readers never see a half-loaded one.
+    """
+
+    books_df = input_df[list(DF_SCHEMA)].astype({"author_name": "str"})
+
+    books_df = books_df.assign(search_text=[
+        normalise_text(f"{title} {author}")
+        for title, author in zip(books_df["book_title"], books_df["author_name"])])
+
+    with atomic_path(database_filename) as temp_filename:
+
+        with closing(connect_database(temp_filename, read_only=False)) as connection:
+
+            connection.execute(BOOKS_TABLE_SQL)
+            connection.execute("CREATE TABLE metadata (name TEXT PRIMARY KEY, value TEXT)")
+
+            books_df.to_sql("books", connection, if_exists="append", index=False,
+                            chunksize=INSERT_CHUNK_SIZE)
+
+            for index_sql in BOOKS_INDEXES_SQL:
+                connection.execute(index_sql)
+
+            connection.execute("INSERT INTO metadata VALUES ('data_version', ?)",
+                               (data_version,))
+            connection.commit()
+
+
+def escape_like(text: str) -> str:
+    """Returns text with the wildcards of a SQL LIKE pattern escaped."""
+
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def build_where_clause(filter_state: dict) -> tuple[str, list]:
+    """
+    Returns the SQL WHERE clause (empty if nothing is filtered) and its
+    parameters for a filter state. As with filters.search_books, searches
+    under 3 characters match the start of words in the title or author.
+    """
+
+    conditions, params = [], []
+
+    search_text = normalise_text(filter_state.get("search", ""))
+
+    if filter_state.get("selected_keys"):
+        conditions.append(
+            f"unique_key IN ({', '.join('?' * len(filter_state['selected_keys']))})")
+        params.extend(filter_state["selected_keys"])
+
+    elif len(search_text) >= 3:
+        conditions.append("search_text LIKE ? ESCAPE '\\'")
+        params.append(f"%{escape_like(search_text)}%")
+
+    elif search_text:
+        conditions.append("(' ' || search_text) LIKE ? ESCAPE '\\'")
+        params.append(f"% {escape_like(search_text)}%")
+
+    for col, (low, high) in filter_state.get("ranges", {}).items():
+
+        if col not in RANGE_COLUMNS:
+            raise ValueError(f"Cannot filter on column '{col}'")
+
+        conditions.append(f"{RANGE_EXPRESSIONS.get(col, col)} BETWEEN ? AND ?")
+        params.extend([get_range_values(low, col), get_range_values(high, col)])
+
+    if not conditions:
+        return "", params
+
+    return " WHERE " + " AND ".join(conditions), params
+
+
+def query_database(database_filename: str, sql: str, params: list) -> pd.DataFrame:
+    """Returns the result of a SQL query on the database."""
+
+    with closing(connect_database(database_filename)) as connection:
+        return pd.read_sql_query(sql, connection, params=params)
+
+
+def query_totals(database_filename: str, filter_state: dict) -> dict:
+    """Returns the total number of books matching the filter state, and their
+    aggregated average rating and number of languages published (as
+    cube.get_cube_totals)."""
+
+    where, params = build_where_clause(filter_state)
+
+    totals = query_database(
+        database_filename,
+        "SELECT COUNT(*) AS total_books, SUM(average_rating) AS rating_sum,"
+        f" SUM(no_of_languages) AS languages_sum FROM books{where}",
+        params).iloc[0]
+
+    total_books = int(totals["total_books"])
+
+    if total_books == 0:
+        return {"total_books": 0, "avg_rating": 0, "avg_languages": 0}
+
+    return {"total_books": total_books,
+            "avg_rating": round(totals["rating_sum"]/total_books, 2),
+            "avg_languages": round(totals["languages_sum"]/total_books, 2)}
+
+
+def query_counts(database_filename: str, dimension: str,
+                 filter_state: dict) -> pd.Series:
+    """Returns the number of books matching the filter state for each value
+    of a dimension in QUERY_EXPRESSIONS (as cube.get_cube_counts)."""
+
+    where, params = build_where_clause(filter_state)
+
+    counts_df = query_database(
+        database_filename,
+        f"SELECT {QUERY_EXPRESSIONS[dimension]} AS {dimension},"
+        f" COUNT(*) AS book_count FROM books{where}"
+        f" GROUP BY {dimension} ORDER BY {dimension}",
+        params)
+
+    return counts_df.set_index(dimension)["book_count"].astype("int64")
+
+
+def query_top_k_counts(database_filename: str, dimension: str, k: int,
+                       filter_state: dict) -> pd.Series:
+    """Returns the k values of a dimension with the most books matching the
+    filter state, most books first (ties in order of value)."""
+
+    where, params = build_where_clause(filter_state)
+
+    counts_df = query_database(
+        database_filename,
+        f"SELECT {QUERY_EXPRESSIONS[dimension]} AS {dimension},"
+        f" COUNT(*) AS book_count FROM books{where}"
+        f" GROUP BY {dimension} ORDER BY book_count DESC, {dimension} LIMIT ?",
+        params + [k])
+
+    return counts_df.set_index(dimension)["book_count"].astype("int64")
+
+
+def query_top_k_books(database_filename: str, col: str, k: int,
+                      filter_state: dict) -> pd.DataFrame:
+    """Returns the k books matching the filter state with the largest values
+    in col, largest first (ties in the order the books were loaded, as
+    diagrams.get_top_k_books)."""
+
+    if col not in RANGE_COLUMNS:
+        raise ValueError(f"Cannot rank books on column '{col}'")
+
+    where, params = build_where_clause(filter_state)
+
+    return apply_df_schema(query_database(
+        database_filename,
+        "SELECT book_title, no_of_languages, author_name FROM books"
+        f"{where} ORDER BY {col} DESC, rowid LIMIT ?",
+        params + [k]))
+
+
+def query_books(database_filename: str, filter_state: dict,
+                columns: list[str] | None = None,
+                limit: int | None = None) -> pd.DataFrame:
+    """Returns the given columns (all of them if columns is None) of the
+    books matching the filter state, in the order they were loaded, and at
+    most limit books (all of them if limit is None). With no columns, only
+    the books are counted, and a pd.DataFrame object of as many rows (and
+    no columns) is returned."""
+
+    if columns is None:
+        columns = list(DF_SCHEMA)
+
+    where, params = build_where_clause(filter_state)
+
+    if not columns:
+
+        n_books = int(query_database(database_filename,
+                                     f"SELECT COUNT(*) AS n_books FROM books{where}",
+                                     params).iloc[0]["n_books"])
+
+        return pd.DataFrame(index=pd.RangeIndex(
+            n_books if limit is None else min(n_books, limit)))
+
+    sql = f"SELECT {', '.join(columns)} FROM books{where} ORDER BY rowid"
+
+    if limit is not None:
+        sql += " LIMIT ?"
+        params = params + [limit]
+
+    return apply_df_schema(query_database(database_filename, sql, params))
+
+
+def query_scatter_bins(database_filename: str, filter_state: dict,
+                       rating_bin_width: float) -> pd.DataFrame:
+    """Returns the number of books matching the filter state for each number
+    of languages published and bin of average rating (as
+    diagrams.get_scatter_bins)."""
+
+    where, params = build_where_clause(filter_state)
+
+    bins_df = query_database(
+        database_filename,
+        "SELECT no_of_languages,"
+        f" {RATING_BUCKET_SQL.format(width=round(rating_bin_width * 100))}"
+        " AS rating_bin,"
+        f" COUNT(*) AS \"Number of Books\" FROM books{where}"
+        " GROUP BY no_of_languages, rating_bin"
+        " ORDER BY no_of_languages, rating_bin",
+        params)
+
+    bins_df["rating_bin_end"] = (bins_df["rating_bin"] + rating_bin_width).round(2)
+
+    return bins_df
+
+
+def query_suggestions(database_filename: str, search_text: str,
+                      limit: int) -> dict[str, str]:
+    """Returns the work keys and display labels of the first limit books
+    whose title or author matches the search text."""
+
+    suggestions_df = query_books(database_filename, {"search": search_text},
+                                 ["unique_key", "book_title", "author_name"],
+                                 limit)
+
+    return dict(zip(suggestions_df["unique_key"],
+                    suggestions_df["book_title"].astype(str) + " — "
+                    + suggestions_df["author_name"].astype(str)))
+
+
+def query_range_bounds(database_filename: str) -> dict:
+    """Returns the (lowest, highest) value of each column in RANGE_COLUMNS."""
+
+    bounds = query_database(
+        database_filename,
+        "SELECT " + ", ".join(f"MIN({col}) AS min_{col}, MAX({col}) AS max_{col}"
+                              for col in RANGE_COLUMNS) + " FROM books",
+        []).iloc[0]
+
+    return {col: (bounds[f"min_{col}"], bounds[f"max_{col}"])
+            for col in RANGE_COLUMNS}
@@ -0,0 +1,142 @@
+"""
+Python script to hold a single, shared copy of the dashboard's dataset per
+process, for every browser session to read, rather than one copy each.
+
+The dataset is a dict of its data version, the wrangled pd.DataFrame object,
+its search index (see filters.py) and its aggregate cube (see cube.py). It is
+never changed once published (pandas' copy-on-write stops any session's
+changes reaching it); a newer version is built alongside it, then swapped
+in by a single assignment, so a session sees either the old or the new
+dataset, never a mix. A background thread can publish the new version as
+soon as it is available, instead of the first session to ask building it.
+
+A session's filtered books are a view of the dataset: the dataset and the
+row positions matching the filter, rather than a new pd.DataFrame object.
+Only the columns a chart needs are copied out of a view, when it is built.
+"""
+
+from threading import Lock, Thread
+from time import sleep
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+DATASET_REFRESH_SECONDS = 300
+
+_dataset = None
+_publish_lock = Lock()
+_refresher = None
+
+
+def get_shared_dataset() -> dict | None:
+    """Returns the dataset currently shared by every session (None if none
+    has been published yet)."""
+
+    return _dataset
+
+
+def publish_dataset(dataset: dict) -> dict:
+    """Makes dataset the one shared by every session, in place of the last."""
+
+    global _dataset
+
+    _dataset = dataset
+
+    return dataset
+
+
+def load_shared_dataset(data_version: str,
+                        builder: Callable[[str], dict]) -> dict:
+    """
+    Returns the shared dataset for a data version, building and publishing it
+    with builder(data_version) if the shared dataset is of another version.
+    Only one thread builds it; any others asking at the same time wait for,
+    then share, its result.
+    """
+
+    dataset = get_shared_dataset()
+
+    if dataset is not None and dataset["version"] == data_version:
+        return dataset
+
+    with _publish_lock:
+
+        dataset = get_shared_dataset()
+
+        if dataset is not None and dataset["version"] == data_version:
+            return dataset
+
+        return publish_dataset(builder(data_version))
+
+
+def refresh_dataset_forever(get_version: Callable[[], str],
+                            builder: Callable[[str], dict],
+                            interval: float = DATASET_REFRESH_SECONDS) -> None:
+    """Every interval seconds, publishes the dataset of the latest data
+    version (per get_version), if there is one and it is not already
+    shared."""
+
+    while True:
+
+        sleep(interval)
+
+        try:
+            data_version = get_version()
+            if data_version is not None:
+                load_shared_dataset(data_version, builder)
+        except Exception as e:
+            print(f"Failed to refresh the shared dataset: {e}")
+
+
+def start_background_refresh(get_version: Callable[[], str],
+                             builder: Callable[[str], dict],
+                             interval: float = DATASET_REFRESH_SECONDS) -> None:
+    """Starts refresh_dataset_forever in a daemon thread, once per process."""
+
+    global _refresher
+
+    with _publish_lock:
+
+        if _refresher is not None:
+            return
+
+        _refresher = Thread(target=refresh_dataset_forever,
+                            args=(get_version, builder, interval),
+                            name="dataset-refresher", daemon=True)
+        _refresher.start()
+
+
+def create_view(input_df: pd.DataFrame, positions: np.ndarray | None) -> dict:
+    """Returns a view of the rows of input_df at the given positions (every
+    row if positions is None), without copying any of them."""
+
+    return {"df": input_df, "positions": positions}
+
+
+def get_view_rows(view: dict, columns: list[str]) -> pd.DataFrame:
+    """Returns the given columns of the rows in a view, as a new (and only
+    as large as needed) pd.DataFrame object."""
+
+    if view["positions"] is None:
+        return view["df"][columns]
+
+    return view["df"][columns].take(view["positions"])
+
+
+def get_view_top_k(view: dict, col: str, k: int,
+                   columns: list[str]) -> pd.DataFrame:
+    """
+    Returns the given columns of the k rows in a view with the largest
+    values in col, largest first (ties in row order, as
+    diagrams.get_top_k_books), copying only col and the k rows.
+    """
+
+    values = get_view_rows(view, [col])[col]
+
+    top_positions = values.reset_index(drop=True).nlargest(k, keep="first").index
+
+    if view["positions"] is not None:
+        top_positions = view["positions"][top_positions]
+
+    return view["df"][columns].take(top_positions)
@@ -1,58 +1,76 @@
-"""Python script to produce diagrams for the final dashboard."""
+"""
+Python script to produce diagrams for the final dashboard.
+
+Every chart is built from data already aggregated in Python (eg. from the
+aggregate cube), holding only the columns it encodes; its reference rules
+are drawn from a single-row dataset of their own, rather than once for each
+row of the chart's data. get_chart_spec compiles a chart into its Vega-Lite
+spec, with each dataset named by a hash of its content, so the dashboard can
+compile each chart once and share identical specs between reruns.
+"""
 
 from datetime import datetime
+from hashlib import sha256
+import json
 
+import numpy as np
 import pandas as pd
 import altair as alt
 
+from cube import get_rating_buckets
 from wrangle import (load_json_data, create_pd_df, remove_duplicate_nan_values_format_cols_df)
 
+TOP_K = 10
+OTHER_LABEL = "Other"
+SCATTER_MAX_POINTS = 5000
+SCATTER_RATING_BIN_WIDTH = 0.1
+SCATTER_MODES = ["auto", "points", "binned", "sampled"]
+RULE_DATA = alt.Data(values=[{}])
 
-def last_100_years(year: int):
-    """Returns True if a given year is 100 years less than/equal to
-    the current year, and False otherwise"""
-    this_year = int(datetime.today().year)
-
-    if this_year - year <= 100:
-        return True
-
-    return False
 
-
-def create_yearly_count_books_100yrs(input_df: pd.DataFrame) -> pd.DataFrame:
+def create_yearly_count_books_100yrs(input_df: pd.DataFrame, window: int = 100,
+                                     reference_year: int = None) -> pd.DataFrame:
     """
-    Edits the pd.DataFrame object to only show books released within
-    the last 100 years, adding in years that are missing in the input 
-    pd.DataFrame object.
+    Returns the number of books released in each year within the last
+    100 years (or the given window of years, up to the given reference year;
+    by default the current year), including years with no books.
     """
-    this_year = int(datetime.today().year)
-
-    years_df = input_df["first_published"].value_counts().reset_index()
 
-    years_df = years_df.rename(columns={'first_published': 'Year Published',
-                                        'count': 'Number of Books Published'})
+    if reference_year is None:
+        reference_year = int(datetime.today().year)
 
-    years_df["last_100_years"] = years_df["Year Published"].apply(last_100_years)
+    first_year = reference_year - window
 
-    years_df = years_df[years_df["last_100_years"] == True].reset_index()
+    years = input_df["first_published"].to_numpy(dtype=np.int64)
 
-    years_df.drop(columns=['last_100_years', 'index'], inplace=True)
+    years = years[(years >= first_year) & (years <= reference_year)]
 
-    n = len(years_df)
+    counts = np.bincount(years - first_year, minlength=window + 1)
 
-    existing_years = {years_df.loc[i]["Year Published"] for i in range(n)}
+    return pd.DataFrame({"Year Published": np.arange(first_year, reference_year + 1),
+                         "Number of Books Published": counts})
 
-    valid_years = set(range(this_year - 100, this_year + 1))
 
-    missing_years = list(valid_years - existing_years)
+def create_yearly_count_books_100yrs_from_counts(year_counts: pd.Series,
+                                                 window: int = 100,
+                                                 reference_year: int = None) -> pd.DataFrame:
+    """
+    Given the number of books first published in each year (eg. from the
+    aggregate cube), returns them for the last 100 years only (or the given
+    window of years, up to the given reference year), including years
+    with no books.
+    """
 
-    for year in missing_years:
+    if reference_year is None:
+        reference_year = int(datetime.today().year)
 
-        m = len(years_df)
+    years = np.arange(reference_year - window, reference_year + 1)
 
-        years_df.loc[m] = [year, 0]
+    counts = year_counts.set_axis(year_counts.index.astype(np.int64))
 
-    return years_df
+    return pd.DataFrame({"Year Published": years,
+                         "Number of Books Published":
+                             counts.reindex(years, fill_value=0).to_numpy(dtype=np.int64)})
 
 
 def create_books_released_per_year(input_df: pd.DataFrame) -> alt.Chart:
@@ -65,26 +83,149 @@ def create_books_released_per_year(input_df: pd.DataFrame) -> alt.Chart:
         y='Number of Books Published:Q'
     ).interactive()
 
-    xrule = base.mark_rule(color="red").encode(
+    xrule = alt.Chart(RULE_DATA, title='Book Releases by Year').mark_rule(
+        color="red").encode(
         x=alt.datum(1969)
     )
 
     return chart + xrule
 
 
-def create_rating_languages_scatter(input_df: pd.DataFrame) -> alt.Chart:
+def get_scatter_bins(input_df: pd.DataFrame,
+                     rating_bin_width: float = SCATTER_RATING_BIN_WIDTH) -> pd.DataFrame:
+    """
+    Returns a 2D histogram of the books, with the number of books for each
+    number of languages published and bin of average rating (rounded down
+    into bins of rating_bin_width, as cube.get_rating_buckets).
+    """
+
+    rating_bins = get_rating_buckets(input_df["average_rating"], rating_bin_width)
+
+    bins_df = pd.DataFrame({"no_of_languages": input_df["no_of_languages"].to_numpy(),
+                            "rating_bin": rating_bins})
+
+    bins_df = bins_df.groupby(["no_of_languages", "rating_bin"]).size().reset_index(
+        name="Number of Books")
+
+    bins_df["rating_bin_end"] = (bins_df["rating_bin"] + rating_bin_width).round(2)
+
+    return bins_df
+
+
+def downsample_scatter_points(input_df: pd.DataFrame,
+                              max_points: int = SCATTER_MAX_POINTS,
+                              rating_bin_width: float = SCATTER_RATING_BIN_WIDTH,
+                              seed: int = 0) -> pd.DataFrame:
+    """
+    Returns at most max_points rows of input_df, sampled with a weight of
+    one over the number of books in the same bin (of languages published and
+    average rating), so sparse areas and outliers are kept while dense areas
+    are thinned out. The sample is the same for the same input_df.
+    """
+
+    if len(input_df) <= max_points:
+        return input_df
+
+    rating_bins = get_rating_buckets(input_df["average_rating"], rating_bin_width)
+
+    bin_sizes = pd.DataFrame({"languages": input_df["no_of_languages"].to_numpy(),
+                              "rating_bin": rating_bins}).groupby(
+        ["languages", "rating_bin"])["languages"].transform("size").to_numpy(
+            dtype=np.float64)
+
+    weights = (1 / bin_sizes) / (1 / bin_sizes).sum()
+
+    positions = np.random.default_rng(seed).choice(len(input_df), size=max_points,
+                                                   replace=False, p=weights)
+
+    return input_df.iloc[np.sort(positions)]
+
+
+def create_rating_languages_scatter_from_bins(bins_df: pd.DataFrame,
+                                              agg_avg_rating: float,
+                                              agg_avg_languages: float) -> alt.Chart:
+    """Returns the rating-vs-languages scatter graph as a 2D histogram, given
+    the number of books in each bin (as returned by get_scatter_bins), with
+    the averages shown as rules."""
+
+    title = "Book Rating over Number of Languages Published"
+
+    bins_df = bins_df.rename(columns={
+        "no_of_languages": "Number of Languages Published",
+        "rating_bin": "Average Rating",
+        "rating_bin_end": "Average Rating (to)"})
+
+    bins_df["languages_start"] = bins_df["Number of Languages Published"] - 0.5
+    bins_df["languages_end"] = bins_df["Number of Languages Published"] + 0.5
+
+    base = alt.Chart(bins_df, title=title)
+
+    chart = base.mark_rect().encode(
+        x=alt.X('languages_start:Q', title="Number of Languages Published"),
+        x2='languages_end:Q',
+        y=alt.Y('Average Rating:Q'),
+        y2='Average Rating (to):Q',
+        color=alt.Color('Number of Books:Q', scale=alt.Scale(type="log")),
+        tooltip=["Number of Languages Published",
+                 "Average Rating",
+                 "Average Rating (to)",
+                 "Number of Books"]
+    ).interactive()
+
+    xrule = alt.Chart(RULE_DATA, title=title).mark_rule(
+        color="cyan", strokeDash=[2, 2]).encode(
+        x=alt.datum(agg_avg_languages)
+    )
+
+    yrule = alt.Chart(RULE_DATA, title=title).mark_rule(
+        color="magenta", strokeDash=[2, 2]).encode(
+        y=alt.datum(agg_avg_rating)
+    )
+
+    return chart + yrule + xrule
+
+
+def create_rating_languages_scatter(input_df: pd.DataFrame,
+                                    agg_avg_rating: float = None,
+                                    agg_avg_languages: float = None,
+                                    mode: str = "auto",
+                                    max_points: int = SCATTER_MAX_POINTS) -> alt.Chart:
     """Returns a scatter graph with number of languages on the x-axis,
-    and average rating on the y-axis."""
+    and average rating on the y-axis. The averages shown as rules are
+    calculated from input_df, unless they are given (eg. from the
+    aggregate cube).
+
+    With more than max_points books, rather than plotting every book, the
+    'auto' mode (or 'binned') shows a 2D histogram of the books; 'sampled'
+    plots a density-aware sample of max_points books, each with its own
+    tooltip; and 'points' plots every book regardless."""
+
+    if mode not in SCATTER_MODES:
+        raise ValueError(f"Unknown scatter mode '{mode}', expected one of {SCATTER_MODES}")
+
+    if agg_avg_rating is None or agg_avg_languages is None:
+        total_books = len(input_df)
+        total_rating = input_df['average_rating'].sum()
+        total_languages = input_df['no_of_languages'].sum()
+
+        agg_avg_rating = round(total_rating/total_books, 2)
+        agg_avg_languages = round(total_languages/total_books, 2)
+
+    if mode == "auto":
+        mode = "points" if len(input_df) <= max_points else "binned"
+
+    title = "Book Rating over Number of Languages Published"
+
+    if mode == "binned":
+        return create_rating_languages_scatter_from_bins(
+            get_scatter_bins(input_df), agg_avg_rating, agg_avg_languages)
+
+    if mode == "sampled":
+        input_df = downsample_scatter_points(input_df, max_points)
+        title = f"{title} (sample of {len(input_df)} books)"
 
     scatter_df = input_df[["book_title", "author_name",
                            "average_rating", "no_of_languages"]]
-    
-    total_books = len(input_df)
-    total_rating = input_df['average_rating'].sum()
-    total_languages = input_df['no_of_languages'].sum()
-
-    agg_avg_rating = round(total_rating/total_books, 2)
-    agg_avg_languages = round(total_languages/total_books, 2)
 
     scatter_df = scatter_df.rename(columns={"average_rating": "Average Rating",
                                "no_of_languages": "Number of Languages Published",
@@ -92,47 +233,86 @@ def create_rating_languages_scatter(input_df: pd.DataFrame) -> alt.Chart:
                                "author_name": "Author"
                                })
 
-    base = alt.Chart(scatter_df,
-                      title="Book Rating over Number of Languages Published")
+    # The books are inlined as they are, as Altair refuses to inline more than
+    # 5,000 rows of a pd.DataFrame object (see alt.data_transformers), and
+    # the 'points' mode plots every book by design.
+    base = alt.Chart(alt.InlineData(values=alt.utils.sanitize_pandas_dataframe(
+        scatter_df).to_dict("records")), title=title)
 
     chart = base.mark_circle(size=200).encode(x='Number of Languages Published:Q',
                                         y='Average Rating:Q',
-                                        tooltip=["Book Title",
-                                                "Author",
-                                                "Average Rating",
-                                        "Number of Languages Published"]
+                                        tooltip=["Book Title:N",
+                                                "Author:N",
+                                                "Average Rating:Q",
+                                        "Number of Languages Published:Q"]
                                     ).interactive()
 
-    xrule = base.mark_rule(color="cyan", strokeDash=[2, 2]).encode(
+    xrule = alt.Chart(RULE_DATA, title=title).mark_rule(
+        color="cyan", strokeDash=[2, 2]).encode(
         x=alt.datum(agg_avg_languages)
     )
 
-    yrule = base.mark_rule(color="magenta", strokeDash=[2, 2]).encode(
+    yrule = alt.Chart(RULE_DATA, title=title).mark_rule(
+        color="magenta", strokeDash=[2, 2]).encode(
         y=alt.datum(agg_avg_rating)
     )
 
     return chart + yrule + xrule
 
 
-def create_books_languages_bar_chart(input_df: pd.DataFrame) -> alt.Chart:
-    """Creates a bar chart showcasing how many languages a given book has
-    been published in."""
+def get_top_k_books(input_df: pd.DataFrame, col: str, k: int = TOP_K) -> pd.DataFrame:
+    """
+    Returns the k rows of input_df with the largest values in col, largest
+    first. Only the top k are selected rather than sorting every row, and
+    ties keep the order of input_df, so the result is the same on each run.
+    """
+
+    return input_df.nlargest(k, col, keep="first")
+
+
+def get_top_k_counts(counts: pd.Series, k: int = TOP_K,
+                     other_label: str = OTHER_LABEL,
+                     total: int | None = None) -> pd.Series:
+    """
+    Given a number of books for each value (eg. each author), returns the k
+    largest counts, largest first, plus the total of every other value under
+    other_label (if there are any). If counts only holds the largest values,
+    the total number of books must be given.
+    """
+
+    top_counts = counts.nlargest(k, keep="first")
+
+    top_counts.index = top_counts.index.astype(str)
+
+    if total is None:
+        total = counts.sum()
 
-    language_df = input_df[['book_title', 'no_of_languages', 'author_name']]
+    other_count = total - top_counts.sum()
 
-    language_df.sort_values(by=['no_of_languages'], inplace=True, ascending=False)
+    if other_count > 0:
+        top_counts = pd.concat([top_counts, pd.Series({other_label: other_count})])
 
-    language_df = language_df.iloc[[str(i) for i in range(10)]]
+    return top_counts
+
+
+def create_books_languages_bar_chart(input_df: pd.DataFrame,
+                                     k: int = TOP_K) -> alt.Chart:
+    """Creates a bar chart showcasing how many languages a given book has
+    been published in, for the k books published in the most languages."""
+
+    language_df = get_top_k_books(
+        input_df[['book_title', 'no_of_languages', 'author_name']],
+        'no_of_languages', k)
 
     language_df = language_df.rename(columns={'book_title': 'Book Title',
                                 'no_of_languages': 'Number of Languages',
                                 'author_name': 'Author'})
 
     chart = alt.Chart(language_df,
-        title="Top 10 books published in the most languages"
+        title=f"Top {k} books published in the most languages"
         ).mark_bar().encode(
             x=alt.X('Number of Languages:Q'),
-            y='Book Title:N',
+            y=alt.Y('Book Title:N', sort='-x'),
             tooltip=["Book Title",
                      "Author",
                      "Number of Languages"]
@@ -141,24 +321,31 @@ def create_books_languages_bar_chart(input_df: pd.DataFrame) -> alt.Chart:
     return chart
 
 
-def create_books_authors_pie_chart(input_df: pd.DataFrame) -> alt.Chart:
+def create_books_authors_pie_chart(input_df: pd.DataFrame,
+                                   k: int = TOP_K) -> alt.Chart:
     """Creates a pie chart showcasing how many books each author has published."""
 
     author_df = input_df[['book_title', 'author_name']]
 
-    author_data = author_df['author_name'].value_counts().reset_index()
+    return create_books_authors_pie_chart_from_counts(
+        author_df['author_name'].value_counts(), k)
 
-    author_data = author_data.sort_values(by=['count'], ascending=False)
 
-    author_data = author_data.iloc[[str(i) for i in range(10)]]
+def create_books_authors_pie_chart_from_counts(author_counts: pd.Series,
+                                               k: int = TOP_K,
+                                               total_books: int | None = None) -> alt.Chart:
+    """Creates a pie chart showcasing how many books each of the top k
+    authors has published, with every other author's books counted
+    together as 'Other', given the number of books of each author (or
+    of only the top authors, with the total number of books)."""
 
-    author_data = author_data.rename(columns={'author_name': 'Author',
-                                              'count': 'Number of Books'})
+    author_data = get_top_k_counts(author_counts, k, total=total_books).rename_axis(
+        'Author').rename('Number of Books').reset_index()
 
     base = alt.Chart(author_data,
-        title="Top 10 authors with the most books published"
+        title=f"Top {k} authors with the most books published"
         ).encode(alt.Theta('Number of Books:Q').stack(True),
-            color='Author:N'
+            color=alt.Color('Author:N', sort=author_data['Author'].tolist())
         )
     
     pie = base.mark_arc(outerRadius=200)
@@ -177,15 +364,26 @@ def create_books_rating_line_chart(input_df: pd.DataFrame) -> alt.Chart:
 
     agg_average_rating = total_average_rating/total_no_of_ratings
 
-    count_df = input_df['average_rating'].value_counts().reset_index()
+    return create_books_rating_line_chart_from_counts(
+        input_df['average_rating'].value_counts(), agg_average_rating)
+
+
+def create_books_rating_line_chart_from_counts(rating_counts: pd.Series,
+                                               agg_average_rating: float) -> alt.Chart:
+    """Creates a line chart showcasing the distribution of average ratings,
+    given the number of books with each (possibly bucketed) rating."""
+
+    count_df = rating_counts.rename_axis('average_rating').rename('count').reset_index()
 
     count_df.sort_values(by=['average_rating'], inplace=True, ascending=False)
 
     rating_df = count_df.rename(columns={'count': 'Number of Books',
                                           'average_rating': 'Average Rating'})
 
+    title = "Distribution of Ratings Across Books"
+
     base = alt.Chart(rating_df,
-            title="Distribution of Ratings Across Books"
+            title=title
             ).encode(
                 x='Average Rating:Q',
                 y='Number of Books:Q'
@@ -193,13 +391,29 @@ def create_books_rating_line_chart(input_df: pd.DataFrame) -> alt.Chart:
 
     chart = base.mark_line(interpolate="monotone").interactive()
 
-    xrule = base.mark_rule(color="red", strokeDash=[2, 2]).encode(
+    xrule = alt.Chart(RULE_DATA, title=title).mark_rule(
+        color="red", strokeDash=[2, 2]).encode(
         x=alt.datum(agg_average_rating)
     )
 
     return chart + xrule
 
 
+def get_chart_spec(chart: alt.TopLevelMixin) -> dict:
+    """Returns the Vega-Lite spec of a chart, with its data inlined as
+    datasets named by a hash of their content (so a dataset shared by
+    several layers is only held once)."""
+
+    return chart.to_dict()
+
+
+def get_spec_hash(spec: dict) -> str:
+    """Returns a hash of a Vega-Lite spec's content (including its data),
+    the same for every spec of an unchanged chart."""
+
+    return sha256(json.dumps(spec, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
 if __name__ == "__main__":
 
     space_data = load_json_data("2024-09-16_multi.json")
@@ -0,0 +1,231 @@
+"""
+Python script to render the dashboard's charts to static PNG/SVG files,
+without a browser or Streamlit (eg. for nightly reports).
+
+For each snapshot of wrangled books, every chart in diagrams.py is built as
+on the dashboard (unfiltered), compiled into its Vega-Lite spec, and
+rendered with vl-convert in parallel worker processes. Each file is named
+after a hash of its chart's spec (which holds its data) and format, so
+charts that have not changed since the last export are skipped. Once every
+chart is rendered, an 'index.json' in each snapshot's directory is written
+atomically, naming its current files, then older files of its charts are
+removed; so the index never names a file which is missing or half-written.
+
+To export the charts of the published snapshot (see refresh.py), input
+`python3 export.py` into the command-line interface; or give one or more
+wrangled books files (eg. `python3 export.py 2024-09-16_multi.parquet`),
+each exported into its own directory under EXPORT_DIR (or `--output-dir`).
+"""
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from hashlib import sha256
+import json
+from os import environ as ENV, makedirs, path, remove
+
+import altair as alt
+import pandas as pd
+import vl_convert as vlc
+
+from atomic import write_atomically
+from wrangle import load_df_cache
+from refresh import load_manifest
+from cube import (build_aggregate_cube, build_author_counts, get_cube_counts,
+                  get_cube_totals)
+from instrument import instrument_stage
+from diagrams import (TOP_K, SCATTER_MAX_POINTS, get_chart_spec, get_spec_hash,
+                      create_books_released_per_year,
+                      create_yearly_count_books_100yrs_from_counts,
+                      create_rating_languages_scatter,
+                      create_books_languages_bar_chart,
+                      create_books_authors_pie_chart_from_counts,
+                      create_books_rating_line_chart_from_counts)
+
+EXPORT_DIR = ENV.get("EXPORT_DIR", "exports")
+EXPORT_FORMATS = ["png", "svg"]
+EXPORT_SCALE = 2
+INDEX_FILENAME = "index.json"
+
+
+def create_snapshot_charts(books_df: pd.DataFrame, cube: pd.DataFrame,
+                           top_k: int = TOP_K,
+                           scatter_mode: str = "auto",
+                           scatter_max_points: int = SCATTER_MAX_POINTS) -> dict[str, alt.Chart]:
+    """Returns each of the dashboard's charts for a snapshot's books (and
+    their aggregate cube), by name."""
+
+    totals = get_cube_totals(cube)
+
+    return {
+        "books_per_year": create_books_released_per_year(
+            create_yearly_count_books_100yrs_from_counts(
+                get_cube_counts(cube, "first_published"))),
+        "rating_over_languages": create_rating_languages_scatter(
+            books_df, totals["avg_rating"], totals["avg_languages"],
+            scatter_mode, scatter_max_points),
+        "books_most_languages": create_books_languages_bar_chart(books_df, top_k),
+        "author_most_books": create_books_authors_pie_chart_from_counts(
+            build_author_counts(books_df), top_k),
+        "book_avg_rating": create_books_rating_line_chart_from_counts(
+            get_cube_counts(cube, "rating_bucket"), totals["avg_rating"])}
+
+
+def get_export_filename(chart_name: str, spec: dict, export_format: str,
+                        scale: float = EXPORT_SCALE) -> str:
+    """Returns the filename of a chart's export, named after a hash of its
+    spec, format and scale (so any change to the chart or its data changes
+    the filename)."""
+
+    export_hash = sha256(f"{get_spec_hash(spec)}:{export_format}:{scale}".encode(
+        "utf-8")).hexdigest()
+
+    return f"{chart_name}_{export_hash[:16]}.{export_format}"
+
+
+def render_chart_file(task: tuple[dict, str, str, float]) -> str:
+    """Renders a chart's spec into a file of the given format ('png' or
+    'svg'), returning the file's name. Run in worker processes."""
+
+    spec, filename, export_format, scale = task
+
+    if export_format == "png":
+        content = vlc.vegalite_to_png(spec, scale=scale)
+    elif export_format == "svg":
+        content = vlc.vegalite_to_svg(spec).encode("utf-8")
+    else:
+        raise ValueError(f"Unknown export format '{export_format}', "
+                         f"expected one of {EXPORT_FORMATS}")
+
+    write_atomically(filename, content)
+
+    return filename
+
+
+def get_snapshot_export_dir(books_filename: str, output_dir: str) -> str:
+    """Returns the directory a snapshot's charts are exported into:
+    output_dir/<snapshot name>."""
+
+    return path.join(output_dir, path.splitext(path.basename(books_filename))[0])
+
+
+def plan_snapshot_export(books_filename: str, output_dir: str,
+                         export_formats: list[str], top_k: int = TOP_K,
+                         scale: float = EXPORT_SCALE) -> tuple[list, dict]:
+    """
+    Returns the render tasks of a snapshot's charts which have changed since
+    their last export, and the snapshot's index: the file of each chart in
+    each format, under get_snapshot_export_dir.
+    """
+
+    books_df = load_df_cache(books_filename)
+
+    snapshot_dir = get_snapshot_export_dir(books_filename, output_dir)
+
+    makedirs(snapshot_dir, exist_ok=True)
+
+    tasks, index = [], {}
+
+    charts = create_snapshot_charts(books_df, build_aggregate_cube(books_df), top_k)
+
+    for chart_name, chart in charts.items():
+
+        spec = get_chart_spec(chart)
+
+        index[chart_name] = {}
+
+        for export_format in export_formats:
+
+            filename = path.join(snapshot_dir, get_export_filename(
+                chart_name, spec, export_format, scale))
+
+            index[chart_name][export_format] = path.basename(filename)
+
+            if not path.isfile(filename):
+                tasks.append((spec, filename, export_format, scale))
+
+    return tasks, index
+
+
+def publish_snapshot_index(books_filename: str, output_dir: str, index: dict) -> None:
+    """Writes a snapshot's index (see plan_snapshot_export) atomically, once
+    its files are rendered, then removes the older files of its charts."""
+
+    snapshot_dir = get_snapshot_export_dir(books_filename, output_dir)
+
+    write_atomically(path.join(snapshot_dir, INDEX_FILENAME), json.dumps(
+        {"books": books_filename, "charts": index}, indent=2).encode("utf-8"))
+
+    for chart_name, filenames in index.items():
+        for export_format, filename in filenames.items():
+            for old_filename in glob(path.join(snapshot_dir,
+                                               f"{chart_name}_*.{export_format}")):
+                if path.basename(old_filename) != filename:
+                    remove(old_filename)
+
+
+@instrument_stage(rows=lambda report: report["rendered"])
+def export_charts(books_filenames: list[str], output_dir: str = EXPORT_DIR,
+                  export_formats: list[str] | None = None,
+                  max_workers: int | None = None, top_k: int = TOP_K,
+                  scale: float = EXPORT_SCALE) -> dict:
+    """
+    Exports the charts of each snapshot's books into output_dir, rendering
+    the charts that have changed across max_workers worker processes (one
+    per CPU core, if None). Returns the number of chart files rendered and
+    skipped (as unchanged).
+    """
+
+    export_formats = export_formats or EXPORT_FORMATS
+
+    tasks, skipped, indexes = [], 0, {}
+
+    for books_filename in books_filenames:
+
+        snapshot_tasks, index = plan_snapshot_export(books_filename, output_dir,
+                                                     export_formats, top_k, scale)
+
+        tasks.extend(snapshot_tasks)
+        skipped += len(index) * len(export_formats) - len(snapshot_tasks)
+        indexes[books_filename] = index
+
+    if max_workers == 1 or len(tasks) <= 1:
+        rendered = [render_chart_file(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            rendered = list(executor.map(render_chart_file, tasks))
+
+    for books_filename, index in indexes.items():
+        publish_snapshot_index(books_filename, output_dir, index)
+
+    return {"rendered": len(rendered), "skipped": skipped}
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Render the dashboard's charts to files.")
+    parser.add_argument("books", nargs="*",
+                        help="wrangled books files (default: the published snapshot)")
+    parser.add_argument("--output-dir", default=EXPORT_DIR)
+    parser.add_argument("--formats", nargs="+", choices=EXPORT_FORMATS,
+                        default=EXPORT_FORMATS)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    parser.add_argument("--scale", type=float, default=EXPORT_SCALE)
+
+    args = parser.parse_args()
+
+    books_filenames = args.books
+
+    if not books_filenames:
+
+        manifest = load_manifest()
+
+        if manifest is None:
+            print("No data has been published yet; run `python3 refresh.py` first.")
+            raise SystemExit(1)
+
+        books_filenames = [manifest["books"]]
+
+    print(json.dumps(export_charts(books_filenames, args.output_dir, args.formats,
+                                   args.workers, args.top_k, args.scale)))
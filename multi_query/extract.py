@@ -7,61 +7,298 @@ the books satisfy at least one search query.
 every book in the response will have a title containing one or more of the 
 phrases 'green apple', 'banana cake', 'pear').
 
-Each response will be written into a JSON file, and this file will be named after
-the date the response was extracted, as well as the search query.
+The docs of each response will be written into a newline-delimited JSON file
+(one doc per line), and this file will be named after the date the response
+was extracted.
+
+Every request is sent through a rate-limit-aware scheduler (see
+scheduler.py), which also reports the pages of each query that could not be
+retrieved.
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from itertools import islice
 import json
-from os import path
+from math import ceil
+from os import path, remove
+from time import sleep
+from typing import Callable, Iterable, Iterator
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from atomic import atomic_path
+from cache import CACHE_DIR, cached_get
+from instrument import instrument_stage
+from scheduler import (ScheduledAdapter, create_scheduler, get_retry_delay,
+                       record_query_page, get_scheduler_report,
+                       get_failed_queries)
 
 API_BASE_URL = "https://openlibrary.org/search"
 SEARCH_QUERIES_LIST = ['space', 'space+flight', 'space+station',
                        'outer+space', 'space+exploration', 'space+and+time',
                        'space+vehicles', 'space+warfare', 'space+shuttles',
                        'space+stations', 'space+ships', 'moon', 'mars']
+REQUEST_TIMEOUT = 120
+MAX_CONCURRENT_REQUESTS = 4
+MAX_RETRIES = 3
+BACKOFF_SECONDS = 1.0
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+PAGE_SIZE = 100
+SEARCH_FIELDS = ['key', 'title', 'subtitle', 'title_suggest', 'author_name',
+                 'author_alternative_name', 'ratings_average', 'language',
+                 'first_publish_year']
+
+
+def create_session(pool_size: int = MAX_CONCURRENT_REQUESTS,
+                   scheduler: dict | None = None) -> requests.Session:
+    """Returns a requests.Session whose connection pool is large enough to
+    be shared by pool_size concurrent requests, sending every request through
+    the scheduler (see scheduler.py), if one is given."""
+
+    session = requests.Session()
+
+    if scheduler is not None:
+        adapter = ScheduledAdapter(scheduler, pool_connections=pool_size,
+                                   pool_maxsize=pool_size)
+    else:
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
 
+    return session
 
-def get_all_queries_responses() -> list[dict]:
-    """Returns all of the API responses for each of the search queries
-    in SPACE_SEARCH_QUERIES."""
 
-    result = []
+def get_search_page(session: requests.Session, query: str, page: int = 1,
+                    page_size: int = PAGE_SIZE,
+                    fields: list[str] | None = SEARCH_FIELDS,
+                    base_url: str = API_BASE_URL,
+                    max_retries: int = MAX_RETRIES,
+                    backoff: float = BACKOFF_SECONDS,
+                    cache_dir: str | None = CACHE_DIR,
+                    scheduler: dict | None = None) -> dict | None:
+    """
+    Returns one page of the API response for a single search query, or None
+    if every attempt failed. Only the given fields are requested (all of them
+    if fields is None). Responses go through the on-disk cache in cache_dir
+    (see cache.py), unless it is None. Connection errors and retryable status
+    codes are retried up to max_retries times, waiting for the response's
+    'Retry-After', or else up to backoff * 2^attempt seconds (at random), in
+    between. Whether the page was retrieved is added to the scheduler's
+    report, if one is given.
+    """
 
-    for query in SEARCH_QUERIES_LIST:
+    url = f"{base_url}.json?q={query}&page={page}&limit={page_size}"
 
-        response = requests.get(f"{API_BASE_URL}.json?q={query}",
-                                timeout=120)
+    if fields is not None:
+        url += f"&fields={','.join(fields)}"
 
-        if response.status_code == 200:
+    for attempt in range(max_retries + 1):
 
-            result.append(response.json())
+        response = None
+
+        try:
+            response = cached_get(session, url, REQUEST_TIMEOUT, cache_dir)
+
+        except requests.RequestException as e:
+            print(f"Failed to retrieve page {page} of '{query}' from the API:", e)
 
         else:
-            print("Failed to retrieve data from the API. Status code:",
+            if response.status_code == 200:
+
+                if scheduler is not None:
+                    record_query_page(scheduler, query, page, True, attempt + 1)
+
+                return response.json()
+
+            print(f"Failed to retrieve page {page} of '{query}' from the API. Status code:",
                   response.status_code)
 
-    return result
+            if response.status_code not in RETRY_STATUS_CODES:
+                break
+
+        if attempt < max_retries:
+            sleep(get_retry_delay(response, attempt, backoff))
+
+    if scheduler is not None:
+        record_query_page(scheduler, query, page, False, attempt + 1)
+
+    return None
+
+
+def map_in_windows(executor: ThreadPoolExecutor, func: Callable,
+                   items: Iterable, window: int) -> Iterator:
+    """
+    Yields func(item) for each item in order, running up to window calls at
+    once on the executor; unlike executor.map, items are only submitted a
+    window at a time, so at most window results are held in memory at once.
+    """
+
+    items = iter(items)
+
+    while batch := list(islice(items, window)):
+        yield from executor.map(func, batch)
+
+
+def iter_query_pages(queries: list[str] = None,
+                     base_url: str = API_BASE_URL,
+                     max_workers: int = MAX_CONCURRENT_REQUESTS,
+                     max_retries: int = MAX_RETRIES,
+                     backoff: float = BACKOFF_SECONDS,
+                     max_pages: int | None = None,
+                     fields: list[str] | None = SEARCH_FIELDS,
+                     cache_dir: str | None = CACHE_DIR,
+                     scheduler: dict | None = None) -> Iterator[tuple[str, dict]]:
+    """
+    Yields each page of the API responses for the search queries in
+    SEARCH_QUERIES_LIST (or the given queries), with the query it answers:
+    first the first page of every query, then their remaining pages (all of
+    them, or up to max_pages per query, warning of any query with more). Up to
+    max_workers pages are fetched at once, sharing one connection pool, and
+    at most max_workers pages are held in memory at once. Each page is cached
+    on disk (see cache.py), so only new or stale queries cost a full request.
+    Requests go through the given scheduler (or a new one; see scheduler.py),
+    and failed pages are left out, but recorded in its report.
+    """
+
+    if queries is None:
+        queries = SEARCH_QUERIES_LIST
+
+    if scheduler is None:
+        scheduler = create_scheduler(max_workers)
+
+    with create_session(max_workers, scheduler) as session, \
+            ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        def fetch(query_page: tuple[str, int]) -> dict | None:
+            query, page = query_page
+            return get_search_page(session, query, page, PAGE_SIZE, fields,
+                                   base_url, max_retries, backoff, cache_dir,
+                                   scheduler)
+
+        last_pages = []
 
+        first_pages = map_in_windows(executor, fetch,
+                                     [(query, 1) for query in queries],
+                                     max_workers)
 
-def api_data_into_json(json_data: list[dict], json_file: str) -> None:
-    """Given a JSON dict object, it writes it into a JSON file of a given name."""
+        for query, response in zip(queries, first_pages):
 
-    if len(json_data) != 0:
+            if response is None:
+                continue
 
-        with open(json_file, "w", encoding="utf-8") as g:
-            json.dump(json_data, g, indent=4)
+            yield query, response
+
+            last_page = ceil(response.get("numFound", 0) / PAGE_SIZE)
+
+            if max_pages is not None and last_page > max_pages:
+                print(f"Only harvesting {max_pages} of the {last_page} pages of "
+                      f"'{query}' ({response['numFound']} books found).")
+                last_page = max_pages
+
+            last_pages.append((query, last_page))
+
+        remaining_pages = [(query, page) for query, last_page in last_pages
+                           for page in range(2, last_page + 1)]
+
+        for (query, _), response in zip(remaining_pages,
+                                        map_in_windows(executor, fetch,
+                                                       remaining_pages,
+                                                       max_workers)):
+
+            if response is not None:
+                yield query, response
+
+
+def iter_all_queries_pages(queries: list[str] = None,
+                           base_url: str = API_BASE_URL,
+                           max_workers: int = MAX_CONCURRENT_REQUESTS,
+                           max_retries: int = MAX_RETRIES,
+                           backoff: float = BACKOFF_SECONDS,
+                           max_pages: int | None = None,
+                           fields: list[str] | None = SEARCH_FIELDS,
+                           cache_dir: str | None = CACHE_DIR,
+                           scheduler: dict | None = None) -> Iterator[dict]:
+    """Yields each page of the API responses for the search queries in
+    SEARCH_QUERIES_LIST (or the given queries), one at a time; see
+    iter_query_pages, which also yields the query of each page."""
+
+    for _, response in iter_query_pages(queries, base_url, max_workers,
+                                        max_retries, backoff, max_pages,
+                                        fields, cache_dir, scheduler):
+        yield response
+
+
+@instrument_stage(rows=lambda pages: sum(len(page["docs"]) for page in pages))
+def get_all_queries_responses(queries: list[str] = None,
+                              base_url: str = API_BASE_URL,
+                              max_workers: int = MAX_CONCURRENT_REQUESTS,
+                              max_retries: int = MAX_RETRIES,
+                              backoff: float = BACKOFF_SECONDS,
+                              max_pages: int | None = None,
+                              fields: list[str] | None = SEARCH_FIELDS,
+                              cache_dir: str | None = CACHE_DIR,
+                              scheduler: dict | None = None) -> list[dict]:
+    """
+    Returns all of the API responses for each of the search queries
+    in SEARCH_QUERIES_LIST (or the given queries), one dict per page.
+    Every page of each query is harvested, unless max_pages is given. See
+    iter_all_queries_pages, which yields the same pages one at a time.
+    """
+
+    return list(iter_all_queries_pages(queries, base_url, max_workers,
+                                       max_retries, backoff, max_pages,
+                                       fields, cache_dir, scheduler))
+
+
+@instrument_stage(rows=lambda n_docs: n_docs)
+def api_data_into_ndjson(pages: Iterable[dict], ndjson_file: str) -> int:
+    """
+    Given API responses (eg. streamed from iter_all_queries_pages), writes
+    each of their docs as one line of a newline-delimited JSON file of a
+    given name, one page at a time. The file is only created if there are
+    any docs; returns the number of docs written.
+    """
+
+    n_docs = 0
+
+    with atomic_path(ndjson_file) as temp_file:
+
+        with open(temp_file, "w", encoding="utf-8") as g:
+
+            for response in pages:
+
+                for doc in response["docs"]:
+                    g.write(json.dumps(doc, separators=(",", ":")))
+                    g.write("\n")
+
+                n_docs += len(response["docs"])
+
+        if n_docs == 0:
+            remove(temp_file)
+
+    return n_docs
 
 
 if __name__ == "__main__":
 
     today_date = datetime.today().strftime('%Y-%m-%d')
 
-    json_filename = f"{today_date}_multi.json"
+    ndjson_filename = f"{today_date}_multi.ndjson"
+
+    if not path.isfile(f"./{ndjson_filename}"):
+
+        request_scheduler = create_scheduler(MAX_CONCURRENT_REQUESTS)
+
+        api_data_into_ndjson(iter_all_queries_pages(scheduler=request_scheduler),
+                             ndjson_filename)
+
+        scheduler_report = get_scheduler_report(request_scheduler)
 
-    multi_query_data = get_all_queries_responses()
+        print(json.dumps(scheduler_report, indent=2))
 
-    if multi_query_data is not None and not path.isfile(f"./{json_filename}"):
-        api_data_into_json(multi_query_data, json_filename)
+        if get_failed_queries(scheduler_report):
+            print("Failed to retrieve every page of:",
+                  ", ".join(get_failed_queries(scheduler_report)))
@@ -0,0 +1,214 @@
+"""
+Python script to build a search index over the wrangled books, so that the
+dashboard's book filter can be answered without rescanning every row.
+
+The index is built once per version of the data, and holds:
+• A trigram index over each book's title and author name, for
+  search-as-you-type (1-2 character searches match the start of words);
+• The position of each book's row, keyed by its Open Library work key,
+  so books with the same title are kept apart;
+• A sorted order of each numeric column, so a range filter (eg. on the year
+  first published) is resolved by binary search rather than a full scan.
+
+Average ratings are sorted and compared on whole hundredths (as the cube
+buckets them), since the wrangled ratings are float32 values (eg. 4.1 is
+stored as 4.0999999), which would otherwise fall below a bound of 4.1.
+"""
+
+from hashlib import sha256
+import json
+
+import numpy as np
+import pandas as pd
+
+from cube import get_rating_hundredths
+
+MAX_SUGGESTIONS = 50
+RANGE_COLUMNS = ["first_published", "average_rating", "no_of_languages"]
+
+
+def normalise_text(text: str) -> str:
+    """Returns text in lower case, with runs of whitespace made single spaces."""
+
+    return " ".join(str(text).lower().split())
+
+
+def get_text_trigrams(text: str) -> set[str]:
+    """
+    Returns every trigram in a normalised text. Each word is preceded by two
+    spaces, so that trigrams such as '  s' and ' sp' mark the start of words.
+    """
+
+    padded = "  " + text.replace(" ", "  ")
+
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def get_query_trigrams(query: str) -> set[str]:
+    """Returns the trigrams every matching text must contain for a normalised
+    search query; queries under 3 characters match the start of words."""
+
+    if len(query) == 1:
+        return {"  " + query}
+
+    if len(query) == 2:
+        return {" " + query}
+
+    spaced = query.replace(" ", "  ")
+
+    return {spaced[i:i + 3] for i in range(len(spaced) - 2)}
+
+
+def build_book_index(input_df: pd.DataFrame) -> dict:
+    """
+    Given the wrangled pd.DataFrame object, returns the search index for its
+    books, as a dict of the work keys, display labels and searchable text of
+    each row, the trigram postings, and a sorted order for each range column.
+    """
+
+    keys = input_df["unique_key"].to_numpy(dtype=object)
+
+    titles = input_df["book_title"].astype(str)
+    authors = input_df["author_name"].astype(str)
+
+    texts = [normalise_text(f"{title} {author}")
+             for title, author in zip(titles, authors)]
+
+    postings = {}
+
+    for position, text in enumerate(texts):
+        for trigram in get_text_trigrams(text):
+            postings.setdefault(trigram, []).append(position)
+
+    range_orders = {}
+
+    for col in RANGE_COLUMNS:
+        values = get_range_values(input_df[col].to_numpy(), col)
+        order = np.argsort(values, kind="stable")
+        range_orders[col] = (order, values[order])
+
+    return {"keys": keys,
+            "key_positions": {key: position for position, key in enumerate(keys)},
+            "labels": (titles + " — " + authors).to_numpy(dtype=object),
+            "texts": np.array(texts, dtype=object),
+            "postings": {trigram: np.array(positions, dtype=np.int64)
+                         for trigram, positions in postings.items()},
+            "range_orders": range_orders,
+            "n_rows": len(input_df)}
+
+
+def search_books(book_index: dict, query: str) -> np.ndarray:
+    """
+    Returns the sorted row positions of the books whose title or author
+    contains a search query (all rows if the query is empty).
+    """
+
+    query = normalise_text(query)
+
+    if not query:
+        return np.arange(book_index["n_rows"])
+
+    postings = []
+
+    for trigram in get_query_trigrams(query):
+
+        if trigram not in book_index["postings"]:
+            return np.array([], dtype=np.int64)
+
+        postings.append(book_index["postings"][trigram])
+
+    postings.sort(key=len)
+
+    positions = postings[0]
+
+    for other in postings[1:]:
+        positions = np.intersect1d(positions, other, assume_unique=True)
+
+    if len(query) < 3:
+        return positions
+
+    texts = book_index["texts"][positions]
+
+    return positions[[query in text for text in texts]]
+
+
+def suggest_books(book_index: dict, query: str,
+                  limit: int = MAX_SUGGESTIONS) -> dict[str, str]:
+    """Returns the work keys and display labels of the first limit books
+    whose title or author contains a search query."""
+
+    positions = search_books(book_index, query)[:limit]
+
+    return dict(zip(book_index["keys"][positions].tolist(),
+                    book_index["labels"][positions].tolist()))
+
+
+def get_range_bounds(input_df: pd.DataFrame) -> dict:
+    """Returns the (lowest, highest) value of each column in RANGE_COLUMNS."""
+
+    return {col: (input_df[col].min(), input_df[col].max())
+            for col in RANGE_COLUMNS}
+
+
+def get_range_values(values, col: str):
+    """Returns the values (or a single bound) of a numeric column as they are
+    compared by range filters: whole hundredths for average ratings."""
+
+    if col != "average_rating":
+        return values
+
+    if np.ndim(values) == 0:
+        return round(float(values) * 100)
+
+    return get_rating_hundredths(values)
+
+
+def get_range_mask(book_index: dict, col: str, low, high) -> np.ndarray:
+    """Returns a boolean row mask of the books whose value in a numeric
+    column lies between low and high (inclusive)."""
+
+    order, sorted_values = book_index["range_orders"][col]
+
+    start = np.searchsorted(sorted_values, get_range_values(low, col), side="left")
+    end = np.searchsorted(sorted_values, get_range_values(high, col), side="right")
+
+    mask = np.zeros(book_index["n_rows"], dtype=bool)
+    mask[order[start:end]] = True
+
+    return mask
+
+
+def filter_book_positions(book_index: dict, filter_state: dict) -> np.ndarray:
+    """
+    Returns the sorted row positions of the books matching a filter state:
+    a dict with the 'search' text, the 'selected_keys' picked from the
+    search results (if any, only those books are kept), and 'ranges',
+    mapping columns in RANGE_COLUMNS to (low, high) bounds.
+    """
+
+    if filter_state.get("selected_keys"):
+        positions = np.sort(np.array(
+            [book_index["key_positions"][key]
+             for key in filter_state["selected_keys"]
+             if key in book_index["key_positions"]], dtype=np.int64))
+    else:
+        positions = search_books(book_index, filter_state.get("search", ""))
+
+    ranges = filter_state.get("ranges", {})
+
+    if not ranges:
+        return positions
+
+    mask = np.ones(book_index["n_rows"], dtype=bool)
+
+    for col, (low, high) in ranges.items():
+        mask &= get_range_mask(book_index, col, low, high)
+
+    return positions[mask[positions]]
+
+
+def get_filter_key(filter_state: dict) -> str:
+    """Returns a short key identifying a filter state, for use in cache keys."""
+
+    return sha256(json.dumps(filter_state, sort_keys=True,
+                             default=str).encode("utf-8")).hexdigest()
@@ -0,0 +1,164 @@
+"""
+Python script with a lightweight instrumentation layer, to find which stage
+of the pipeline (fetching, JSON parsing, wrangling, cache reads, aggregation
+or building charts) a slow dashboard spends its time in.
+
+Each instrumented stage records:
+• Its wall time, in seconds;
+• How much it changed the process's RSS (resident memory), and how much
+  it raised the process's peak RSS, in MB (a stage which stays under an
+  earlier stage's peak raises it by 0, however much it allocates);
+• The number of rows (or docs/pages) it returned, where that makes sense;
+• Whether it was served from a cache ('hit') or computed ('miss').
+
+Records are collected per thread by start_stage_collection (for the
+dashboard's "Diagnostics" panel), and logged as one JSON object per line to
+the 'instrument' logger.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+import json
+import logging
+from os import sysconf
+from sys import platform
+from threading import local
+from time import perf_counter
+from typing import Callable, Iterator
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger("instrument")
+
+_thread_state = local()
+
+
+def get_peak_rss_bytes() -> int:
+    """Returns the peak resident memory of this process so far, in bytes
+    (0 where it cannot be measured, eg. on Windows)."""
+
+    if resource is None:
+        return 0
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in bytes on macOS, and in kilobytes elsewhere.
+    return peak_rss if platform == "darwin" else peak_rss * 1024
+
+
+def get_rss_bytes() -> int:
+    """Returns the current resident memory of this process, in bytes (0
+    where it cannot be measured, ie. without /proc/self/statm)."""
+
+    try:
+        with open("/proc/self/statm", 'r', encoding='utf-8') as f:
+            return int(f.read().split()[1]) * sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def get_open_stages() -> list[dict]:
+    """Returns the stages currently being recorded on this thread,
+    innermost last."""
+
+    if not hasattr(_thread_state, "stages"):
+        _thread_state.stages = []
+
+    return _thread_state.stages
+
+
+def mark_cache(status: str) -> None:
+    """Marks the innermost stage being recorded on this thread as served
+    from a cache ('hit') or computed ('miss')."""
+
+    open_stages = get_open_stages()
+
+    if open_stages:
+        open_stages[-1]["cache"] = status
+
+
+def start_stage_collection() -> list[dict]:
+    """Returns a list which every stage recorded on this thread from now on
+    is added to (eg. the stages of one run of the dashboard)."""
+
+    _thread_state.collected = []
+
+    return _thread_state.collected
+
+
+@contextmanager
+def record_stage(name: str, cache: str | None = None) -> Iterator[dict]:
+    """
+    Records the wall time, RSS change and peak RSS increase of the code run
+    inside the context, as the stage name. Yields the stage's record, so the
+    code can set its 'rows' (and its 'cache' status, also set by mark_cache).
+    """
+
+    stage = {"stage": name, "started_at": datetime.now().isoformat(),
+             "rows": None, "cache": cache}
+
+    open_stages = get_open_stages()
+    open_stages.append(stage)
+
+    rss_before = get_rss_bytes()
+    peak_rss_before = get_peak_rss_bytes()
+    start = perf_counter()
+
+    try:
+        yield stage
+    finally:
+        stage["seconds"] = round(perf_counter() - start, 4)
+        stage["rss_delta_mb"] = round((get_rss_bytes() - rss_before) / 1024 ** 2, 2)
+        stage["peak_rss_delta_mb"] = round(
+            (get_peak_rss_bytes() - peak_rss_before) / 1024 ** 2, 2)
+        stage["depth"] = len(open_stages) - 1
+
+        open_stages.pop()
+
+        if getattr(_thread_state, "collected", None) is not None:
+            _thread_state.collected.append(stage)
+
+        logger.info(json.dumps(stage, default=str))
+
+
+def count_rows(result) -> int | None:
+    """Returns the number of rows in a stage's result (eg. a pd.DataFrame
+    object or a list of docs), or None if it has no length."""
+
+    try:
+        return len(result)
+    except TypeError:
+        return None
+
+
+def instrument_stage(name: str | None = None, rows: Callable = count_rows,
+                     cache: str | None = None) -> Callable:
+    """
+    Decorator recording each call of a function as a stage (named after the
+    function, unless a name is given), with its rows counted from the
+    function's result by rows. Pass cache='hit' for functions whose body only
+    does work on a cache miss, and which mark_cache('miss') when it does.
+    """
+
+    def decorator(func: Callable) -> Callable:
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+
+            with record_stage(name or func.__name__, cache) as stage:
+                result = func(*args, **kwargs)
+                stage["rows"] = rows(result)
+
+            return result
+
+        # Keep st.cache_resource's .clear() reachable through the wrapper.
+        if hasattr(func, "clear"):
+            wrapper.clear = func.clear
+
+        return wrapper
+
+    return decorator
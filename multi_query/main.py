@@ -1,162 +1,801 @@
 """
 Python script to be run to produce Streamlit dashboard showcasing
 data insights.
+
+The chart modules (diagrams.py, and so Altair) are only imported once the
+first chart is built, so the metrics and sidebar render without waiting for
+them; extraction modules are only imported by refresh.py when it extracts.
+For a fast start, serve app.py instead, which warms up the dashboard before
+its health check passes (see warmup.py). With AGGREGATION_MODE set to
+'streaming', a session which has to extract the day's books shows their
+metrics and charts as they arrive (see streaming.py), rather than waiting for
+the whole extract and wrangle to finish.
 """
 
-from datetime import datetime
-from os import path
+from __future__ import annotations
+
+import logging
+from os import environ as ENV, path
+from time import perf_counter
+from typing import Callable, TYPE_CHECKING
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 
-from extract import get_all_queries_responses, api_data_into_json
-from wrangle import (load_json_data, create_pd_df,
-                     remove_duplicate_nan_values_format_cols_df)
-from diagrams import (create_books_released_per_year,
-                      create_yearly_count_books_100yrs,
-                      create_rating_languages_scatter,
-                      create_books_languages_bar_chart,
-                      create_books_authors_pie_chart,
-                      create_books_rating_line_chart)
+from wrangle import load_df_cache
+from refresh import (get_today_version, load_manifest, publish_df,
+                     refresh_snapshot, get_harvest_max_pages)
+from filters import (MAX_SUGGESTIONS, build_book_index, suggest_books,
+                     get_range_bounds, filter_book_positions, get_filter_key)
+from cube import (build_aggregate_cube, build_author_counts,
+                  slice_aggregate_cube, get_cube_counts, get_cube_totals)
+from database import (DATABASE_FILENAME, get_database_version,
+                      load_books_into_database, query_totals, query_counts,
+                      query_top_k_counts, query_top_k_books, query_books,
+                      query_scatter_bins, query_suggestions, query_range_bounds)
+from dataset import (get_shared_dataset, load_shared_dataset, publish_dataset,
+                     start_background_refresh, create_view, get_view_rows,
+                     get_view_top_k)
+from instrument import (instrument_stage, mark_cache, start_stage_collection)
+
+if TYPE_CHECKING:
+    import altair as alt
 
 API_BASE_URL = "https://openlibrary.org/search"
 SPACE_SEARCH_QUERIES = ['space', 'space+flight', 'space+station',
                         'outer+space', 'space+exploration', 'space+and+time',
                         'space+vehicles', 'space+warfare', 'space+shuttles',
                         'space+stations', 'space+ships', 'moon', 'mars']
+REFRESH_MODE = ENV.get("REFRESH_MODE", "inline")
+QUERY_BACKEND = ENV.get("QUERY_BACKEND", "pandas")
+QUERY_BACKENDS = ["pandas", "sqlite"]
+SCATTER_MODE = ENV.get("SCATTER_MODE", "auto")
+SCATTER_MAX_POINTS = int(ENV.get("SCATTER_MAX_POINTS", 5000))
+TOP_K = int(ENV.get("TOP_K", 10))
+CHART_DATA_MODE = ENV.get("CHART_DATA_MODE", "spec")
+AGGREGATION_MODE = ENV.get("AGGREGATION_MODE", "batch")
+STREAM_RENDER_SECONDS = float(ENV.get("STREAM_RENDER_SECONDS", 1))
+MAX_CACHE_ENTRIES = 32
+CUBE_SOURCE_COLUMNS = ["first_published", "average_rating", "no_of_languages"]
+SCATTER_COLUMNS = ["book_title", "author_name", "average_rating", "no_of_languages"]
+LANGUAGES_BAR_COLUMNS = ["book_title", "no_of_languages", "author_name"]
+DIAGNOSTICS_COLUMNS = ["stage", "seconds", "rss_delta_mb", "peak_rss_delta_mb",
+                       "rows", "cache"]
+
+
+def get_data_version() -> str | None:
+    """
+    Returns the version of the data the dashboard shows; a new version
+    (ie. a new day's snapshot) invalidates every cached result.
+
+    With REFRESH_MODE set to 'published', this is the version of the last
+    snapshot published by refresh.py (None if there is none yet), so the
+    dashboard never extracts any books itself; by default ('inline'), it is
+    today's version, which is extracted the first time it is needed (or, if
+    that failed, the version of the snapshot kept for today instead).
+    """
+
+    manifest = load_manifest()
+
+    if REFRESH_MODE == "published":
+        return manifest["version"] if manifest is not None else None
+
+    today_version = get_today_version()
+
+    if manifest is not None and manifest.get("kept_for") == today_version:
+        return manifest["version"]
+
+    return today_version
+
+
+def load_snapshot_manifest(data_version: str) -> dict:
+    """
+    Returns the manifest of the snapshot shown for a data version, first
+    extracting, wrangling and publishing it (see refresh.py) if it has not
+    been published yet. If it could not be, this is the manifest of the last
+    snapshot, kept for the data version, so it is not extracted again.
+    """
+
+    manifest = load_manifest()
+
+    if (manifest is None
+            or data_version not in (manifest["version"], manifest.get("kept_for"))):
+
+        manifest = refresh_snapshot(data_version)
+
+    return manifest
+
+
+def build_dashboard_dataset(data_version: str) -> dict:
+    """Returns the dataset for a data version (see dataset.py): the wrangled
+    pd.DataFrame object, its search index and its aggregate cube."""
+
+    mark_cache("miss")
+
+    data_version = load_snapshot_manifest(data_version)["version"]
+
+    space_df = extract_wrangle_pd_df()
+
+    return {"version": data_version,
+            "df": space_df,
+            "book_index": build_book_index(space_df),
+            "cube": extract_wrangle_cube(space_df)}
+
+
+@instrument_stage(rows=lambda dataset: len(dataset["df"]), cache="hit")
+def load_dashboard_dataset() -> dict:
+    """Returns the dataset shared by every session, only building it if none
+    has been published yet; newer versions are published by the background
+    refresh, so sessions never wait for them."""
+
+    dataset = get_shared_dataset()
+
+    if dataset is None:
+        dataset = load_shared_dataset(get_data_version(), build_dashboard_dataset)
+
+    return dataset
+
+
+@instrument_stage(cache="hit")
+@st.cache_resource(max_entries=MAX_CACHE_ENTRIES, show_spinner=False)
+def filter_dashboard_positions(data_key: str, _book_index: dict,
+                               _filter_state: dict) -> np.ndarray | None:
+    """Returns the row positions of the books matching the filter state (None
+    if every book matches); cached on data_key, which identifies both the
+    data version and the filter."""
+
+    mark_cache("miss")
+
+    positions = filter_book_positions(_book_index, _filter_state)
+
+    if len(positions) == _book_index["n_rows"]:
+        return None
+
+    return positions
+
+
+@instrument_stage(cache="hit")
+@st.cache_resource(max_entries=MAX_CACHE_ENTRIES, show_spinner=False)
+def load_dashboard_database(data_version: str) -> str:
+    """Returns the filename of the books database (see database.py) for a
+    data version, loading the wrangled data into it if it holds an older
+    version."""
+
+    mark_cache("miss")
+
+    if get_database_version() != data_version:
+        # Only loads the database; none of the books are needed here.
+        extract_wrangle_pd_df(columns=[], backend="sqlite")
+
+    return DATABASE_FILENAME
+
+
+def setup_book_filter(range_bounds: dict,
+                      suggest: Callable[[str], dict[str, str]]) -> dict:
+    """Sets up the book filter in the sidebar, returning the filter state:
+    the search text, any books picked from its results (suggested, as a
+    dict of work keys to labels, by suggest), and the bounds of each range
+    filter (between the lowest and highest values in range_bounds)."""
+
+    st.title("Book Filter")
+
+    search_text = st.text_input("Search titles or authors")
+
+    suggestions = suggest(search_text)
+
+    # The books picked so far stay among the options (with their labels), so
+    # changing the search does not drop them.
+    picked_labels = st.session_state.get("picked_book_labels", {})
+
+    labels = {key: picked_labels[key]
+              for key in st.session_state.get("picked_books", [])
+              if key in picked_labels}
+    labels.update(suggestions)
+
+    selected_keys = st.multiselect(
+        f"Pick books (top {MAX_SUGGESTIONS} matches shown)",
+        options=list(labels),
+        format_func=lambda key: labels.get(key, key),
+        key="picked_books")
+
+    st.session_state["picked_book_labels"] = {key: labels[key] for key in selected_keys}
+
+    ranges = {}
+
+    for col, label in [("first_published", "Year First Published"),
+                       ("average_rating", "Average Rating"),
+                       ("no_of_languages", "Number of Languages Published")]:
+
+        low, high = range_bounds[col]
+
+        if low == high:
+            continue
 
+        if col == "average_rating":
+            low, high = float(low), float(high)
+        else:
+            low, high = int(low), int(high)
 
-def setup_metrics(input_df: pd.DataFrame) -> None:
+        chosen = st.slider(label, min_value=low, max_value=high,
+                           value=(low, high))
+
+        if chosen != (low, high):
+            ranges[col] = chosen
+
+    return {"search": search_text,
+            "selected_keys": selected_keys,
+            "ranges": ranges}
+
+
+@instrument_stage(cache="hit")
+@st.cache_resource(max_entries=MAX_CACHE_ENTRIES, show_spinner=False)
+def filter_dashboard_cube(data_key: str, _cube: pd.DataFrame,
+                          _filtered_view: dict,
+                          _filter_state: dict) -> pd.DataFrame:
+    """Returns the aggregate cube of the books matching the filter state.
+    Range filters on exact cube dimensions are answered by slicing the cube;
+    any other filter rebuilds the cube from just the filtered rows."""
+
+    mark_cache("miss")
+
+    if not _filter_state.get("search") and not _filter_state.get("selected_keys"):
+
+        cube_slice = slice_aggregate_cube(_cube, _filter_state.get("ranges", {}))
+
+        if cube_slice is not None:
+            return cube_slice
+
+    return build_aggregate_cube(get_view_rows(_filtered_view, CUBE_SOURCE_COLUMNS))
+
+
+@st.cache_resource(max_entries=MAX_CACHE_ENTRIES * 6, show_spinner=False)
+def get_cached_result(name: str, data_key: str, _builder: Callable,
+                      _inputs: tuple):
+    """Returns the result of _builder(*_inputs), computing it only the
+    first time it is asked for with this name and data_key (which marks the
+    stage asking for it as a cache miss)."""
+
+    mark_cache("miss")
+
+    return _builder(*_inputs)
+
+
+@st.cache_resource(max_entries=MAX_CACHE_ENTRIES * 6, show_spinner=False)
+def share_chart_spec(spec_hash: str, _spec: dict) -> dict:
+    """Returns the first chart spec compiled with this content hash, so
+    identical charts (eg. under different filters, or rebuilt after a
+    refresh) share one spec, sent to the browser unchanged."""
+
+    return _spec
+
+
+def build_chart(create_chart: Callable, *inputs) -> dict | alt.Chart:
+    """
+    Returns the chart made by create_chart(*inputs). With CHART_DATA_MODE
+    set to 'spec' (the default), it is compiled once into its Vega-Lite spec
+    (see diagrams.get_chart_spec), rather than on every rerun; with 'altair',
+    the alt.Chart object is returned as it is.
+    """
+
+    from diagrams import get_chart_spec, get_spec_hash
+
+    chart = create_chart(*inputs)
+
+    if CHART_DATA_MODE == "altair":
+        return chart
+
+    spec = get_chart_spec(chart)
+
+    return share_chart_spec(get_spec_hash(spec), spec)
+
+
+def render_chart(chart: dict | alt.Chart) -> None:
+    """Draws a chart returned by build_chart on the dashboard."""
+
+    if isinstance(chart, dict):
+        st.vega_lite_chart(chart, use_container_width=True)
+    else:
+        st.altair_chart(chart, use_container_width=True)
+
+
+def clear_dashboard_caches() -> None:
+    """Invalidates every cached frame, cube, metric and chart."""
+
+    load_dashboard_database.clear()
+    filter_dashboard_positions.clear()
+    filter_dashboard_cube.clear()
+    get_cached_result.clear()
+    share_chart_spec.clear()
+
+
+def is_database_source(source: pd.DataFrame | dict | tuple) -> bool:
+    """Returns whether a chart's source is a (database filename, filter
+    state) pair, rather than a view of the books (see dataset.py) or their
+    aggregate cube."""
+
+    return isinstance(source, tuple)
+
+
+def get_source_totals(cube: pd.DataFrame | tuple) -> dict:
+    """Returns the total number of books, and their aggregated average rating
+    and number of languages, from the aggregate cube or the database."""
+
+    if is_database_source(cube):
+        return query_totals(*cube)
+
+    return get_cube_totals(cube)
+
+
+def get_source_counts(cube: pd.DataFrame | tuple, dimension: str) -> pd.Series:
+    """Returns the number of books for each value of a dimension, from the
+    aggregate cube or the database."""
+
+    if is_database_source(cube):
+        database_filename, filter_state = cube
+        return query_counts(database_filename, dimension, filter_state)
+
+    return get_cube_counts(cube, dimension)
+
+
+@instrument_stage(cache="hit")
+def setup_metrics(cube: pd.DataFrame | tuple, data_key: str) -> None:
     """Sets up metrics content on dashboard."""
     left, middle, right = st.columns(3)
 
-    total_books = len(input_df)
-    total_rating = input_df['average_rating'].sum()
-    total_languages = input_df['no_of_languages'].sum()
+    metrics = get_cached_result("metrics", data_key,
+                                get_source_totals, (cube,))
 
     with left:
-        st.metric("Total Number of Books", total_books)
+        st.metric("Total Number of Books", metrics["total_books"])
 
     with middle:
         st.metric("Aggregated Average Rating for all Books",
-                  round(total_rating/total_books, 2))
+                  metrics["avg_rating"])
 
     with right:
         st.metric("Aggregated Average Number of Languages Published",
-                  round(total_languages/total_books, 2))
+                  metrics["avg_languages"])
+
+
+def create_yearly_books_line_chart(cube: pd.DataFrame | tuple) -> alt.Chart:
+    """Returns the chart for yearly release book count."""
+
+    from diagrams import (create_books_released_per_year,
+                          create_yearly_count_books_100yrs_from_counts)
+
+    yearly_df = create_yearly_count_books_100yrs_from_counts(
+        get_source_counts(cube, "first_published"))
+
+    return create_books_released_per_year(yearly_df)
+
+
+def create_ratings_languages_scatter_chart(input_df: dict | tuple,
+                                           cube: pd.DataFrame | tuple) -> alt.Chart:
+    """Returns the chart comparing book rating over the number of
+    languages published, with its averages read from the cube; binned or
+    sampled (per SCATTER_MODE) above SCATTER_MAX_POINTS books. From the
+    database, the books are only read if they are plotted one by one;
+    otherwise they are binned by the database."""
+
+    from diagrams import (SCATTER_RATING_BIN_WIDTH, create_rating_languages_scatter,
+                          create_rating_languages_scatter_from_bins)
+
+    totals = get_source_totals(cube)
 
+    if is_database_source(input_df):
 
-def setup_yearly_books_line_chart(input_df: pd.DataFrame) -> None:
+        database_filename, filter_state = input_df
+
+        if (SCATTER_MODE != "points"
+                and totals["total_books"] > SCATTER_MAX_POINTS):
+            return create_rating_languages_scatter_from_bins(
+                query_scatter_bins(database_filename, filter_state,
+                                   SCATTER_RATING_BIN_WIDTH),
+                totals["avg_rating"], totals["avg_languages"])
+
+        input_df = query_books(database_filename, filter_state, SCATTER_COLUMNS)
+
+    else:
+        input_df = get_view_rows(input_df, SCATTER_COLUMNS)
+
+    return create_rating_languages_scatter(input_df, totals["avg_rating"],
+                                           totals["avg_languages"],
+                                           SCATTER_MODE, SCATTER_MAX_POINTS)
+
+
+def create_author_pie_chart(input_df: dict | tuple, top_k: int) -> alt.Chart:
+    """Returns the chart for the number of books released by each of the
+    top_k authors, counted from the filtered books' authors (see
+    cube.build_author_counts) or the database."""
+
+    from diagrams import create_books_authors_pie_chart_from_counts
+
+    if is_database_source(input_df):
+        database_filename, filter_state = input_df
+        return create_books_authors_pie_chart_from_counts(
+            query_top_k_counts(database_filename, "author_name", top_k,
+                               filter_state),
+            top_k, query_totals(*input_df)["total_books"])
+
+    return create_books_authors_pie_chart_from_counts(
+        build_author_counts(get_view_rows(input_df, ["author_name"])), top_k)
+
+
+def create_languages_bar_chart(input_df: dict | tuple, top_k: int) -> alt.Chart:
+    """Returns the chart for the top_k books published in the most languages."""
+
+    from diagrams import create_books_languages_bar_chart
+
+    if is_database_source(input_df):
+        database_filename, filter_state = input_df
+        input_df = query_top_k_books(database_filename, "no_of_languages",
+                                     top_k, filter_state)
+    else:
+        input_df = get_view_top_k(input_df, "no_of_languages", top_k,
+                                  LANGUAGES_BAR_COLUMNS)
+
+    return create_books_languages_bar_chart(input_df, top_k)
+
+
+def create_rating_line_chart(cube: pd.DataFrame | tuple) -> alt.Chart:
+    """Returns the chart for the distribution of average ratings."""
+
+    from diagrams import create_books_rating_line_chart_from_counts
+
+    return create_books_rating_line_chart_from_counts(
+        get_source_counts(cube, "rating_bucket"),
+        get_source_totals(cube)["avg_rating"])
+
+
+@instrument_stage(cache="hit")
+def setup_yearly_books_line_chart(cube: pd.DataFrame | tuple, data_key: str) -> None:
     """Sets up chart for yearly release book count."""
-    yearly_df = create_yearly_count_books_100yrs(input_df)
-    yearly_books_line_chart = create_books_released_per_year(yearly_df)
+    yearly_books_line_chart = get_cached_result(
+        "yearly_books", data_key, build_chart,
+        (create_yearly_books_line_chart, cube))
 
-    st.altair_chart(yearly_books_line_chart, use_container_width=True)
+    render_chart(yearly_books_line_chart)
 
 
-def setup_ratings_languages_scatter_chart(input_df: pd.DataFrame) -> None:
+@instrument_stage(cache="hit")
+def setup_ratings_languages_scatter_chart(input_df: dict | tuple,
+                                          cube: pd.DataFrame | tuple,
+                                          data_key: str) -> None:
     """Sets up chart for comparing book rating over the number 
     of languages published."""
 
-    scatter_chart = create_rating_languages_scatter(input_df)
+    scatter_chart = get_cached_result("ratings_languages", data_key, build_chart,
+                                      (create_ratings_languages_scatter_chart,
+                                       input_df, cube))
 
-    st.altair_chart(scatter_chart, use_container_width=True)
+    render_chart(scatter_chart)
 
 
-def setup_author_pie_chart(input_df: pd.DataFrame) -> None:
+@instrument_stage(cache="hit")
+def setup_author_pie_chart(input_df: dict | tuple, data_key: str,
+                           top_k: int = TOP_K) -> None:
     """Sets up chart for the number of books released by each author."""
 
-    author_pie_chart = create_books_authors_pie_chart(input_df)
+    author_pie_chart = get_cached_result(f"author_pie_top_{top_k}", data_key,
+                                         build_chart,
+                                         (create_author_pie_chart, input_df, top_k))
 
-    st.altair_chart(author_pie_chart, use_container_width=True)
+    render_chart(author_pie_chart)
 
 
-def setup_2_bar_charts(input_df: pd.DataFrame) -> None:
+@instrument_stage(cache="hit")
+def setup_2_bar_charts(input_df: dict | tuple, cube: pd.DataFrame | tuple,
+                       data_key: str, top_k: int = TOP_K) -> None:
     """Sets up chart for counting books by number of languages published,
     and a chart for the average rating per book."""
 
-    language_bar_chart = create_books_languages_bar_chart(input_df)
-    rating_line_chart = create_books_rating_line_chart(input_df)
+    language_bar_chart = get_cached_result(f"languages_bar_top_{top_k}", data_key,
+                                           build_chart,
+                                           (create_languages_bar_chart,
+                                            input_df, top_k))
+    rating_line_chart = get_cached_result("rating_line", data_key, build_chart,
+                                          (create_rating_line_chart, cube))
 
     left, right = st.columns(2)
 
     with left:
-        st.altair_chart(language_bar_chart, use_container_width=True)
+        render_chart(language_bar_chart)
 
     with right:
-        st.altair_chart(rating_line_chart,
-                        use_container_width=True)
+        render_chart(rating_line_chart)
 
 
-def extract_wrangle_pd_df() -> pd.DataFrame:
-    """Contains relevant steps for extraction and wrangling of data."""
+@instrument_stage(cache="miss")
+def extract_wrangle_pd_df(columns: list[str] | None = None,
+                          backend: str = QUERY_BACKEND) -> pd.DataFrame:
+    """
+    Returns the wrangled data of the snapshot for the data version, with
+    only the given columns (all of them if columns is None). If that snapshot
+    has not been published yet, it is extracted, wrangled and published first
+    (see refresh.py), by the first caller only.
 
-    today_date = datetime.today().strftime('%Y-%m-%d')
+    With the 'sqlite' backend, the wrangled data is also loaded into the
+    books database (see database.py), and read back from it once it holds
+    the day's data. Both are of the snapshot's own version, which is older
+    than the data version if the day's books could not be extracted.
+    """
 
-    json_filename = f"2024-10-02_multi.json"
+    if backend not in QUERY_BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {QUERY_BACKENDS}")
 
-    csv_filename = f"2024-10-02_multi.csv"
+    data_version = get_data_version()
 
-    if not path.isfile(f"./{json_filename}"):
+    if data_version is None:
+        raise FileNotFoundError("No snapshot has been published yet; "
+                                "run refresh.py to publish one.")
 
-        multi_query_data = get_all_queries_responses()
+    if backend == "sqlite" and get_database_version() == data_version:
 
-        if multi_query_data is not None:
+        mark_cache("hit")
 
-            api_data_into_json(multi_query_data, json_filename)
+        return query_books(DATABASE_FILENAME, {}, columns)
 
-    else:
+    manifest = load_manifest()
 
-        multi_query_data = load_json_data(json_filename)
+    if manifest is not None and manifest["version"] == data_version:
+        mark_cache("hit")
 
-    if not path.isfile(f"./{csv_filename}"):
+    manifest = load_snapshot_manifest(data_version)
 
-        multi_query_df = create_pd_df(multi_query_data)
+    if manifest["version"] != data_version:
+        print(f"The books for {data_version} could not be extracted; "
+              f"showing the snapshot for {manifest['version']}.")
 
-        formatted_multi_df = remove_duplicate_nan_values_format_cols_df(
-            multi_query_df)
+    formatted_multi_df = load_df_cache(manifest["books"],
+                                       None if backend == "sqlite" else columns)
 
-        formatted_multi_df.to_csv(f"./{csv_filename}", index=False)
+    if backend == "sqlite":
 
-    else:
+        load_books_into_database(formatted_multi_df, manifest["version"])
 
-        formatted_multi_df = pd.read_csv(f"./{csv_filename}")
+    if columns is not None:
+        formatted_multi_df = formatted_multi_df[columns]
 
     return formatted_multi_df
 
 
+@instrument_stage(cache="miss")
+def extract_wrangle_cube(input_df: pd.DataFrame) -> pd.DataFrame:
+    """Returns the aggregate cube of the wrangled data, reading the one
+    published with its snapshot; or else building it from input_df, and
+    publishing it as the snapshot's cube if the snapshot's file is missing."""
+
+    data_version = get_data_version()
+
+    manifest = load_manifest()
+
+    if manifest is None or manifest["version"] != data_version:
+        return build_aggregate_cube(input_df)
+
+    if path.isfile(manifest["cube"]):
+
+        mark_cache("hit")
+
+        return load_df_cache(manifest["cube"])
+
+    cube = build_aggregate_cube(input_df)
+
+    publish_df(cube, manifest["cube"])
+
+    return cube
+
+
+def is_snapshot_published(data_version: str) -> bool:
+    """Returns whether the snapshot of a data version is published."""
+
+    manifest = load_manifest()
+
+    return manifest is not None and manifest["version"] == data_version
+
+
+def render_stream_aggregates(aggregates: dict, top_k: int = TOP_K) -> None:
+    """Draws the progress of a harvest, with the metrics and charts of the
+    books aggregated so far (see streaming.py)."""
+
+    from diagrams import (create_books_released_per_year,
+                          create_yearly_count_books_100yrs_from_counts,
+                          create_books_authors_pie_chart_from_counts,
+                          create_books_rating_line_chart_from_counts)
+    from streaming import get_stream_progress, get_stream_totals, get_stream_counts
+
+    n_docs, n_found = get_stream_progress(aggregates)
+
+    st.progress(min(n_docs / n_found, 1.0) if n_found else 0.0,
+                text=f"Harvested {n_docs:,} of {n_found:,} books found so far...")
+
+    totals = get_stream_totals(aggregates)
+
+    columns = st.columns(4)
+
+    columns[0].metric("Total Number of Books", totals["total_books"])
+    columns[1].metric("Aggregated Average Rating for all Books",
+                      totals["avg_rating"],
+                      help=f"Standard deviation: {totals['rating_std']}")
+    columns[2].metric("Aggregated Average Number of Languages Published",
+                      totals["avg_languages"])
+    columns[3].metric("Distinct Authors (estimated)", totals["distinct_authors"])
+
+    if totals["total_books"] == 0:
+        return
+
+    render_chart(create_books_released_per_year(
+        create_yearly_count_books_100yrs_from_counts(
+            get_stream_counts(aggregates, "first_published"))))
+
+    left, right = st.columns(2)
+
+    with left:
+        render_chart(create_books_rating_line_chart_from_counts(
+            get_stream_counts(aggregates, "rating_bucket"), totals["avg_rating"]))
+
+    with right:
+        render_chart(create_books_authors_pie_chart_from_counts(
+            get_stream_counts(aggregates, "author_name"), top_k,
+            totals["total_books"]))
+
+
+@instrument_stage(rows=lambda aggregates: aggregates["n_books"])
+def stream_dashboard(data_version: str) -> dict:
+    """
+    Extracts and publishes the snapshot of a data version, drawing the
+    metrics and charts of its books as each page arrives (at most every
+    STREAM_RENDER_SECONDS seconds), then clears them, so the dashboard
+    can be drawn from the snapshot. Returns the harvest's aggregates.
+    """
+
+    from streaming import create_stream_aggregates, update_stream_aggregates
+
+    aggregates = create_stream_aggregates(get_harvest_max_pages())
+
+    placeholder = st.empty()
+
+    with placeholder.container():
+        st.info("Extracting today's books; the dashboard updates as they arrive.")
+
+    last_render = perf_counter()
+
+    def observe_page(query: str, response: dict) -> None:
+
+        nonlocal last_render
+
+        update_stream_aggregates(aggregates, query, response)
+
+        if perf_counter() - last_render >= STREAM_RENDER_SECONDS:
+
+            with placeholder.container():
+                render_stream_aggregates(aggregates)
+
+            last_render = perf_counter()
+
+    refresh_snapshot(data_version, observe_page=observe_page)
+
+    placeholder.empty()
+
+    return aggregates
+
+
 if __name__ == "__main__":
 
     st.set_page_config(page_title='Space Books Dashboard',
                        page_icon=":rocket:", layout="wide")
 
-    space_df = extract_wrangle_pd_df()
-    space_df_book_titles = space_df["book_title"].to_list()
+    logging.basicConfig(level=ENV.get("LOG_LEVEL", "WARNING"), format="%(message)s")
+
+    stage_records = start_stage_collection()
+
+    data_version = get_data_version()
+
+    if data_version is None:
+        st.info("No data has been published yet; run `python3 refresh.py` "
+                "to publish a snapshot of the books.")
+        st.stop()
+
+    if AGGREGATION_MODE == "streaming" and not is_snapshot_published(data_version):
+        stream_dashboard(data_version)
+
+    if QUERY_BACKEND == "sqlite":
+
+        database_filename = load_dashboard_database(data_version)
+
+        data_version = get_data_version()
+
+        range_bounds = get_cached_result("range_bounds", data_version,
+                                         query_range_bounds, (database_filename,))
+
+        def suggest(search_text: str) -> dict[str, str]:
+            return get_cached_result("suggestions", f"{data_version}:{search_text}",
+                                     query_suggestions,
+                                     (database_filename, search_text, MAX_SUGGESTIONS))
+
+        space_cube = (database_filename, {})
+
+    else:
+
+        dataset = load_dashboard_dataset()
+
+        start_background_refresh(get_data_version, build_dashboard_dataset)
+
+        data_version = dataset["version"]
+        book_index = dataset["book_index"]
+        space_cube = dataset["cube"]
+
+        range_bounds = get_cached_result("range_bounds", data_version,
+                                         get_range_bounds, (dataset["df"],))
+
+        def suggest(search_text: str) -> dict[str, str]:
+            return suggest_books(book_index, search_text)
 
     st.title("Welcome!")
+
+    if REFRESH_MODE == "inline" and data_version != get_today_version():
+        st.warning(f"Today's books could not be extracted; showing the books "
+                   f"of {data_version}.")
+
     st.write("---")
     st.subheader("Containing all data from your favourite space-themed books!")
 
-    setup_metrics(space_df)
+    setup_metrics(space_cube, data_version)
 
     with st.sidebar:
         st.title("Space-related Books Dashboard")
         st.subheader("Collating information on all texts related to space!")
         st.write("---")
 
-        st.title("Book Filter")
+        filter_state = setup_book_filter(range_bounds, suggest)
+
+        st.write("---")
+
+        top_k = st.slider("Number of top books/authors to show", 3, 50, TOP_K)
+
+        st.write("---")
+
+        if st.button("Refresh data"):
+            clear_dashboard_caches()
+            if QUERY_BACKEND != "sqlite":
+                publish_dataset(build_dashboard_dataset(get_data_version()))
+            st.rerun()
+
+        show_diagnostics = st.checkbox("Show diagnostics")
+
+    filtered_data_key = f"{data_version}:{get_filter_key(filter_state)}"
+
+    if QUERY_BACKEND == "sqlite":
+
+        filtered_space_df = filtered_space_cube = (database_filename, filter_state)
+
+    else:
+
+        filtered_space_df = create_view(
+            dataset["df"],
+            filter_dashboard_positions(filtered_data_key, book_index, filter_state))
 
-        creator_options = space_df_book_titles
-        filtered_input = st.multiselect("Available Books",
-                                        options=creator_options,
-                                        default=creator_options)
+        filtered_space_cube = filter_dashboard_cube(filtered_data_key, space_cube,
+                                                    filtered_space_df, filter_state)
 
-    filtered_space_df = space_df[space_df["book_title"].isin(filtered_input)]
+    setup_yearly_books_line_chart(filtered_space_cube, filtered_data_key)
 
-    setup_yearly_books_line_chart(filtered_space_df)
+    setup_ratings_languages_scatter_chart(filtered_space_df,
+                                          filtered_space_cube,
+                                          filtered_data_key)
 
-    setup_ratings_languages_scatter_chart(filtered_space_df)
+    setup_2_bar_charts(filtered_space_df, filtered_space_cube,
+                       filtered_data_key, top_k)
 
-    setup_2_bar_charts(filtered_space_df)
+    setup_author_pie_chart(filtered_space_df, filtered_data_key, top_k)
 
-    setup_author_pie_chart(filtered_space_df)
+    if show_diagnostics:
+        with st.sidebar.expander("Diagnostics", expanded=True):
+            st.caption("Wall time, RSS change, peak RSS increase, rows and "
+                       "cache status of each stage in this run (nested "
+                       "stages indented).")
+            st.dataframe(pd.DataFrame(
+                [{**record, "stage": "  " * record["depth"] + record["stage"]}
+                 for record in sorted(stage_records,
+                                      key=lambda record: record["started_at"])],
+                columns=DIAGNOSTICS_COLUMNS), hide_index=True)
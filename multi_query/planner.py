@@ -0,0 +1,350 @@
+"""
+Python script to plan the search queries of a harvest, so the same books are
+extracted with as few requests (and bytes) as possible.
+
+The search queries overlap heavily: the API matches books having every term
+of a query, so 'space' matches every book 'space+flight' matches. A plan:
+
+• Prunes each query whose terms include every term of another query which
+  is harvested in full (ie. all of its pages are within max_pages), as its
+  books are all extracted already;
+• Combines queries whose books all fit on one page into OR-queries (eg.
+  'moon+OR+mars'), as long as their books still fit on one page together;
+• Drops each book already extracted by an earlier query of the harvest, so
+  it is only written (and wrangled) once.
+
+How many books each query finds ('numFound') is read from the query ledger
+(QUERY_LEDGER_FILENAME), which records, for each query harvested, its number
+of books, pages and bytes, and the work keys of its books. Where the ledger
+turns out to be stale (ie. a query no longer fits its pages), the queries
+it pruned or combined are harvested as they are instead, so a plan never
+loses any books. With no ledger yet, only queries subsumed by a query
+harvested in full (max_pages=None) are pruned.
+
+To see the plan (and its estimated savings) for the search queries in
+extract.py, input `python3 planner.py` into the command-line interface (with
+`--max-pages <n>` to plan harvesting up to n pages per query, rather than
+every page).
+"""
+
+from argparse import ArgumentParser
+import json
+from math import ceil
+from os import environ as ENV, path
+from typing import Iterator
+
+from atomic import atomic_path
+from extract import PAGE_SIZE, SEARCH_QUERIES_LIST, iter_query_pages
+
+QUERY_LEDGER_FILENAME = ENV.get("QUERY_LEDGER_FILENAME", "query_ledger.json")
+
+
+def get_query_terms(query: str) -> frozenset[str] | None:
+    """Returns the terms of a search query (eg. {'space', 'flight'} for
+    'space+flight'), or None if it is not a plain query of terms (eg. an
+    OR-query), and so can neither prune nor be pruned."""
+
+    terms = query.lower().split("+")
+
+    if "or" in terms or any(char in query for char in '():"'):
+        return None
+
+    return frozenset(terms)
+
+
+def combine_queries(queries: list[str]) -> str:
+    """Returns an OR-query matching the books of any of the given queries."""
+
+    return "+OR+".join(f"({query})" if "+" in query else query
+                       for query in queries)
+
+
+def is_harvested_in_full(num_found: int | None, max_pages: int | None,
+                         page_size: int = PAGE_SIZE) -> bool:
+    """Returns whether every book a query finds is within its first
+    max_pages pages (always True if max_pages is None)."""
+
+    if max_pages is None:
+        return True
+
+    return num_found is not None and num_found <= max_pages * page_size
+
+
+def load_query_ledger(ledger_filename: str = QUERY_LEDGER_FILENAME) -> dict:
+    """Returns the query ledger, or an empty one if there is none yet."""
+
+    if not path.isfile(ledger_filename):
+        return {}
+
+    with open(ledger_filename, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_query_ledger(ledger: dict,
+                      ledger_filename: str = QUERY_LEDGER_FILENAME) -> None:
+    """Writes the query ledger atomically (see atomic.py)."""
+
+    with atomic_path(ledger_filename) as temp_filename:
+        with open(temp_filename, 'w', encoding='utf-8') as f:
+            json.dump(ledger, f, separators=(",", ":"))
+
+
+def get_bytes_per_doc(ledger: dict) -> float | None:
+    """Returns the average size of a book's doc across the ledger's queries,
+    or None if the ledger has no docs."""
+
+    n_docs = sum(entry["docs"] for entry in ledger.values())
+
+    if n_docs == 0:
+        return None
+
+    return sum(entry["bytes"] for entry in ledger.values()) / n_docs
+
+
+def estimate_query_cost(num_found: int | None, max_pages: int | None,
+                        bytes_per_doc: float | None,
+                        page_size: int = PAGE_SIZE) -> dict:
+    """Returns the estimated requests, docs and bytes of harvesting a query
+    which finds num_found books (each None if it cannot be estimated)."""
+
+    if num_found is None:
+        return {"requests": max_pages, "docs": None, "bytes": None}
+
+    n_pages = max(ceil(num_found / page_size), 1)
+
+    if max_pages is not None:
+        n_pages = min(n_pages, max_pages)
+
+    n_docs = min(num_found, n_pages * page_size)
+
+    return {"requests": n_pages, "docs": n_docs,
+            "bytes": round(n_docs * bytes_per_doc) if bytes_per_doc is not None else None}
+
+
+def sum_costs(costs: list[dict]) -> dict:
+    """Returns the total of each cost, or None if any of them is unknown."""
+
+    return {key: None if any(cost[key] is None for cost in costs)
+            else sum(cost[key] for cost in costs)
+            for key in ["requests", "docs", "bytes"]}
+
+
+def plan_queries(queries: list[str] = None, max_pages: int | None = None,
+                 ledger: dict | None = None,
+                 page_size: int = PAGE_SIZE) -> dict:
+    """
+    Returns the plan of a harvest of the search queries in
+    SEARCH_QUERIES_LIST (or the given queries), of every page (or up to
+    max_pages pages) per query: the queries to harvest, the queries pruned (each with the query
+    subsuming it), the OR-queries combined (each with its queries), and the
+    estimated cost of harvesting the queries as they are and as planned.
+    """
+
+    if queries is None:
+        queries = SEARCH_QUERIES_LIST
+
+    queries = list(dict.fromkeys(queries))
+    ledger = ledger if ledger is not None else {}
+
+    num_found = {query: ledger[query]["num_found"] if query in ledger else None
+                 for query in queries}
+    terms = {query: get_query_terms(query) for query in queries}
+
+    pruned = {}
+
+    for i, query in enumerate(queries):
+
+        if terms[query] is None:
+            continue
+
+        subsuming = [other for j, other in enumerate(queries)
+                     if other != query and terms[other] is not None
+                     and (terms[other] < terms[query]
+                          or (terms[other] == terms[query] and j < i))
+                     and is_harvested_in_full(num_found[other], max_pages, page_size)]
+
+        if subsuming:
+            pruned[query] = min(subsuming, key=lambda other: len(terms[other]))
+
+    kept = [query for query in queries if query not in pruned]
+
+    single_page = sorted((query for query in kept if num_found[query] is not None
+                          and num_found[query] <= page_size),
+                         key=lambda query: -num_found[query])
+
+    groups = []
+
+    for query in single_page:
+
+        for group in groups:
+            if sum(num_found[member] for member in group) + num_found[query] <= page_size:
+                group.append(query)
+                break
+        else:
+            groups.append([query])
+
+    combined = {}
+
+    for group in groups:
+        if len(group) > 1:
+            members = sorted(group, key=kept.index)
+            combined[combine_queries(members)] = members
+
+    first_members = {members[0]: or_query for or_query, members in combined.items()}
+    combined_members = {member for members in combined.values() for member in members}
+
+    planned_queries = [first_members.get(query, query) for query in kept
+                       if query not in combined_members or query in first_members]
+
+    bytes_per_doc = get_bytes_per_doc(ledger)
+
+    naive_cost = sum_costs([estimate_query_cost(num_found[query], max_pages,
+                                                bytes_per_doc, page_size)
+                            for query in queries])
+
+    planned_cost = sum_costs([
+        estimate_query_cost(sum(num_found[member] for member in combined[query])
+                            if query in combined else num_found[query],
+                            max_pages, bytes_per_doc, page_size)
+        for query in planned_queries])
+
+    return {"queries": planned_queries, "max_pages": max_pages,
+            "pruned": pruned, "combined": combined,
+            "estimate": {"naive": naive_cost, "planned": planned_cost,
+                         "saved": {key: None if naive_cost[key] is None
+                                   or planned_cost[key] is None
+                                   else naive_cost[key] - planned_cost[key]
+                                   for key in naive_cost}}}
+
+
+def create_query_tracker() -> dict:
+    """Returns a tracker of the work keys extracted so far in a harvest, and
+    of the pages, docs and bytes of each query harvested."""
+
+    return {"keys": set(), "queries": {}}
+
+
+def track_query_page(tracker: dict, query: str, response: dict) -> dict:
+    """Records a page of a query's response in the tracker, returning the
+    page with only the docs of books no earlier page had extracted."""
+
+    stats = tracker["queries"].setdefault(query, {
+        "num_found": response.get("numFound", 0), "pages": 0, "docs": 0,
+        "bytes": 0, "duplicate_docs": 0, "duplicate_bytes": 0, "keys": []})
+
+    stats["pages"] += 1
+
+    new_docs = []
+
+    for doc in response["docs"]:
+
+        n_bytes = len(json.dumps(doc, separators=(",", ":")))
+
+        stats["docs"] += 1
+        stats["bytes"] += n_bytes
+        stats["keys"].append(doc.get("key"))
+
+        if doc.get("key") in tracker["keys"]:
+            stats["duplicate_docs"] += 1
+            stats["duplicate_bytes"] += n_bytes
+        else:
+            tracker["keys"].add(doc.get("key"))
+            new_docs.append(doc)
+
+    return {**response, "docs": new_docs}
+
+
+def get_fallback_queries(plan: dict, tracker: dict,
+                         page_size: int = PAGE_SIZE) -> list[str]:
+    """Returns the queries a plan pruned or combined which must be harvested
+    as they are after all, as the query subsuming them (or their OR-query)
+    was not harvested in full, going by the numbers of books just found."""
+
+    covered_or_queries = {or_query for or_query in plan["combined"]
+                          if or_query in tracker["queries"]
+                          and tracker["queries"][or_query]["num_found"] <= page_size}
+
+    def found_in_full(query: str) -> bool:
+        if query in tracker["queries"]:
+            return is_harvested_in_full(tracker["queries"][query]["num_found"],
+                                        plan["max_pages"], page_size)
+        return any(query in plan["combined"][or_query]
+                   for or_query in covered_or_queries)
+
+    fallback = [members for or_query, members in plan["combined"].items()
+                if or_query not in covered_or_queries]
+
+    fallback = [member for members in fallback for member in members]
+
+    fallback.extend(query for query, subsuming in plan["pruned"].items()
+                    if not found_in_full(subsuming))
+
+    return fallback
+
+
+def iter_planned_pages(plan: dict, tracker: dict,
+                       **harvest_kwargs) -> Iterator[tuple[str, dict]]:
+    """
+    Yields each page of the harvest of a plan's queries, with the query it
+    answers, keeping only the docs of books not extracted already (see
+    track_query_page); then those of the queries the plan pruned or combined
+    which turned out not to be covered (see get_fallback_queries). Keyword
+    arguments are passed through to iter_query_pages.
+    """
+
+    for query, response in iter_query_pages(plan["queries"],
+                                            max_pages=plan["max_pages"],
+                                            **harvest_kwargs):
+        yield query, track_query_page(tracker, query, response)
+
+    fallback_queries = get_fallback_queries(plan, tracker)
+
+    if fallback_queries:
+
+        print("Harvesting queries the plan could not cover:",
+              ", ".join(fallback_queries))
+
+        for query, response in iter_query_pages(fallback_queries,
+                                                max_pages=plan["max_pages"],
+                                                **harvest_kwargs):
+            yield query, track_query_page(tracker, query, response)
+
+
+def update_query_ledger(ledger: dict, tracker: dict, version: str) -> dict:
+    """Records each query harvested in the tracker in the ledger (replacing
+    its last record), returning the ledger."""
+
+    for query, stats in tracker["queries"].items():
+
+        ledger[query] = {"version": version, "num_found": stats["num_found"],
+                         "pages": stats["pages"], "docs": stats["docs"],
+                         "bytes": stats["bytes"],
+                         "keys": sorted(set(stats["keys"]) - {None})}
+
+    return ledger
+
+
+def get_plan_report(plan: dict, tracker: dict) -> dict:
+    """Returns a plan's estimated savings, and the requests, docs and bytes
+    actually harvested, including those of books extracted more than once."""
+
+    queries = tracker["queries"].values()
+
+    return {"queries": plan["queries"], "pruned": plan["pruned"],
+            "combined": plan["combined"], "estimate": plan["estimate"],
+            "harvested": {key: sum(stats[key] for stats in queries)
+                          for key in ["pages", "docs", "bytes",
+                                      "duplicate_docs", "duplicate_bytes"]}}
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Plan the harvest of the search queries.")
+    parser.add_argument("--max-pages", type=int, default=None)
+
+    args = parser.parse_args()
+
+    query_plan = plan_queries(max_pages=args.max_pages, ledger=load_query_ledger())
+
+    print(json.dumps({key: query_plan[key] for key in
+                      ["queries", "pruned", "combined", "estimate"]}, indent=2))
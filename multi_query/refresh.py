@@ -0,0 +1,368 @@
+"""
+Python script to refresh the dashboard's data apart from the dashboard
+itself: extracting the day's books, wrangling them, then publishing them.
+
+Each published snapshot is the wrangled pd.DataFrame object and its aggregate
+cube, both written to temporary files then renamed into place, followed by a
+version manifest (MANIFEST_FILENAME) naming them; so the dashboard only ever
+reads snapshots that are ready. Refreshes hold a file lock (LOCK_FILENAME),
+so only one process extracts the day's books at a time. A refresh which
+fails to retrieve every page of its queries does not replace the last
+snapshot published, but records in its manifest the version it was kept for
+(see refresh_snapshot); the files of a replaced snapshot are removed once
+the new one is published.
+
+Snapshots (and the extracted books they are wrangled from) are written into
+SNAPSHOT_DIR (by default, the current directory), and the manifest names its files relative to its own directory,
+so a snapshot directory can be copied into (or mounted in) another place,
+such as the dashboard's container image.
+
+To publish today's snapshot, input `python3 refresh.py` into the
+command-line interface; add `--daemon` to keep refreshing it every
+REFRESH_INTERVAL_SECONDS (or `--interval <seconds>`), and `--force` to
+extract the books again even if today's snapshot was already published.
+"""
+
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from datetime import datetime
+import fcntl
+import json
+from os import environ as ENV, makedirs, path, remove
+from time import sleep
+from typing import Callable, Iterator
+
+import pandas as pd
+
+from wrangle import (create_pd_df_parallel, create_pd_df_from_docs,
+                     remove_duplicate_nan_values_format_cols_df,
+                     apply_df_schema, save_df_cache, load_df_cache)
+from cube import build_aggregate_cube
+from atomic import atomic_path
+
+DF_CACHE_FORMAT = ENV.get("DF_CACHE_FORMAT", "parquet")
+INGESTION_MODE = ENV.get("INGESTION_MODE", "snapshot")
+QUERY_PLAN_MODE = ENV.get("QUERY_PLAN_MODE", "planned")
+HARVEST_MAX_PAGES = ENV.get("HARVEST_MAX_PAGES", "all")
+WRANGLE_WORKERS = int(ENV.get("WRANGLE_WORKERS", 1))
+SNAPSHOT_DIR = ENV.get("SNAPSHOT_DIR", ".")
+MANIFEST_FILENAME = ENV.get("MANIFEST_FILENAME",
+                            path.join(SNAPSHOT_DIR, "manifest.json"))
+LOCK_FILENAME = ENV.get("REFRESH_LOCK_FILENAME",
+                        path.join(SNAPSHOT_DIR, "refresh.lock"))
+REFRESH_INTERVAL_SECONDS = int(ENV.get("REFRESH_INTERVAL_SECONDS", 3600))
+
+
+def get_today_version() -> str:
+    """Returns the version of today's snapshot."""
+
+    return datetime.today().strftime('%Y-%m-%d')
+
+
+def load_manifest(manifest_filename: str = MANIFEST_FILENAME) -> dict | None:
+    """Returns the manifest of the last published snapshot, with the paths
+    of its files, or None if no snapshot has been published yet."""
+
+    if not path.isfile(manifest_filename):
+        return None
+
+    with open(manifest_filename, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    snapshot_dir = path.dirname(manifest_filename)
+
+    for key in ["books", "cube"]:
+        manifest[key] = path.join(snapshot_dir, manifest[key])
+
+    return manifest
+
+
+def write_manifest(manifest: dict,
+                   manifest_filename: str = MANIFEST_FILENAME) -> None:
+    """Writes a snapshot's manifest atomically (see atomic.py), publishing
+    the snapshot in a single rename."""
+
+    with atomic_path(manifest_filename) as temp_filename:
+        with open(temp_filename, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+
+
+def keep_manifest(manifest: dict, version: str) -> dict:
+    """Records in the last snapshot's manifest that it was kept for a
+    version which could not be published, and returns the manifest."""
+
+    kept_manifest = {**manifest, "kept_for": version}
+
+    write_manifest({**kept_manifest, "books": path.basename(manifest["books"]),
+                    "cube": path.basename(manifest["cube"])})
+
+    return kept_manifest
+
+
+def get_ndjson_filename(version: str) -> str:
+    """Returns the filename of a version's extracted books, in SNAPSHOT_DIR."""
+
+    return path.join(SNAPSHOT_DIR, f"{version}_multi.ndjson")
+
+
+def remove_snapshot_files(manifest: dict, keep: list[str]) -> None:
+    """Removes the books, cube and extracted books files of a replaced
+    snapshot's manifest, other than any of the filenames in keep."""
+
+    keep = [path.abspath(filename) for filename in keep]
+
+    for filename in [manifest["books"], manifest["cube"],
+                     get_ndjson_filename(manifest["version"])]:
+        if path.abspath(filename) not in keep and path.isfile(filename):
+            remove(filename)
+
+
+def publish_df(input_df: pd.DataFrame, filename: str) -> None:
+    """Writes a pd.DataFrame object with save_df_cache atomically (see
+    atomic.py), in the format of filename's extension."""
+
+    with atomic_path(filename) as temp_filename:
+        save_df_cache(input_df, temp_filename)
+
+
+@contextmanager
+def refresh_lock(lock_filename: str = LOCK_FILENAME,
+                 wait: bool = True) -> Iterator[bool]:
+    """
+    Holds the refresh lock for the duration of the context, yielding whether
+    it was acquired: if wait is False and another refresh holds the lock,
+    yields False at once rather than waiting for it.
+    """
+
+    with open(lock_filename, 'a', encoding='utf-8') as lock_file:
+
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if wait
+                        else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def get_harvest_max_pages() -> int | None:
+    """Returns the number of pages harvested per query, as set by
+    HARVEST_MAX_PAGES (None if it is 'all', the default)."""
+
+    return None if HARVEST_MAX_PAGES == "all" else int(HARVEST_MAX_PAGES)
+
+
+def extract_books(ndjson_filename: str, version: str,
+                  observe_page: Callable[[str, dict], None] | None = None) -> list[str]:
+    """
+    Extracts the books of the search queries into ndjson_filename, passing
+    each page (with its query) to observe_page as it arrives, if given, and
+    returns the queries with pages which could not be retrieved. With
+    QUERY_PLAN_MODE set to 'planned' (the default), the queries are planned
+    first (see planner.py), so overlapping queries are harvested once, and
+    the plan's savings are printed; with 'naive', every query is harvested
+    as it is.
+    """
+
+    from extract import (MAX_CONCURRENT_REQUESTS, iter_query_pages,
+                         api_data_into_ndjson)
+    from scheduler import create_scheduler, get_scheduler_report, get_failed_queries
+
+    request_scheduler = create_scheduler(MAX_CONCURRENT_REQUESTS)
+
+    if QUERY_PLAN_MODE == "planned":
+
+        from planner import (plan_queries, create_query_tracker,
+                             iter_planned_pages, load_query_ledger,
+                             update_query_ledger, save_query_ledger,
+                             get_plan_report)
+
+        ledger = load_query_ledger()
+        query_plan = plan_queries(max_pages=get_harvest_max_pages(), ledger=ledger)
+        query_tracker = create_query_tracker()
+
+        query_pages = iter_planned_pages(query_plan, query_tracker,
+                                         scheduler=request_scheduler)
+
+    else:
+
+        query_pages = iter_query_pages(max_pages=get_harvest_max_pages(),
+                                       scheduler=request_scheduler)
+
+    def observe_pages() -> Iterator[dict]:
+        for query, response in query_pages:
+            if observe_page is not None:
+                observe_page(query, response)
+            yield response
+
+    api_data_into_ndjson(observe_pages(), ndjson_filename)
+
+    if QUERY_PLAN_MODE == "planned":
+
+        save_query_ledger(update_query_ledger(ledger, query_tracker, version))
+
+        print(json.dumps(get_plan_report(query_plan, query_tracker)))
+
+    failed_queries = get_failed_queries(get_scheduler_report(request_scheduler))
+
+    if failed_queries:
+        print("Failed to retrieve every page of:", ", ".join(failed_queries))
+
+    return failed_queries
+
+
+def extract_wrangle_books(version: str, refetch: bool = False,
+                          observe_page: Callable[[str, dict], None] | None = None
+                          ) -> tuple[pd.DataFrame, list[str]]:
+    """
+    Returns the wrangled pd.DataFrame object of a version's books, extracting
+    them into SNAPSHOT_DIR first (unless they already were, and
+    refetch is False), passing each page to observe_page (see
+    extract_books), and the queries which could not be extracted in full.
+    With INGESTION_MODE set to 'incremental', the books are upserted into
+    the persistent store (see store.py), and every book in the store is
+    returned. The books of an incomplete extraction are neither kept for
+    the next refresh, nor upserted.
+    """
+
+    ndjson_filename = get_ndjson_filename(version)
+
+    failed_queries = []
+
+    if refetch or not path.isfile(ndjson_filename):
+        failed_queries = extract_books(ndjson_filename, version, observe_page)
+
+    if path.isfile(ndjson_filename):
+
+        multi_query_df = create_pd_df_parallel([ndjson_filename], WRANGLE_WORKERS)
+
+    else:
+
+        multi_query_df = create_pd_df_from_docs([])
+
+    formatted_multi_df = apply_df_schema(
+        remove_duplicate_nan_values_format_cols_df(multi_query_df))
+
+    if failed_queries:
+
+        if path.isfile(ndjson_filename):
+            remove(ndjson_filename)
+
+        return formatted_multi_df, failed_queries
+
+    if INGESTION_MODE == "incremental":
+
+        from store import upsert_books, materialise_books
+
+        upsert_books(formatted_multi_df)
+
+        formatted_multi_df = materialise_books()
+
+    return formatted_multi_df, failed_queries
+
+
+def refresh_snapshot(version: str | None = None, wait: bool = True,
+                     force: bool = False,
+                     observe_page: Callable[[str, dict], None] | None = None
+                     ) -> dict | None:
+    """
+    Publishes the snapshot of a version (by default, today's), unless it is
+    already published (or force is True), and returns its manifest; each
+    page extracted is passed to observe_page (see extract_books), if given. Returns
+    None if wait is False and another refresh is running. A refresh which
+    finds no books, or fails to extract any query in full, keeps the last
+    snapshot published, if there is one, marking it 'kept_for' the version;
+    with none, an incomplete snapshot is published marked 'partial' (with
+    its failed queries), and is extracted again by the next refresh.
+    """
+
+    version = version or get_today_version()
+
+    makedirs(SNAPSHOT_DIR, exist_ok=True)
+
+    with refresh_lock(wait=wait) as acquired:
+
+        if not acquired:
+            print("Another refresh is already running.")
+            return None
+
+        manifest = load_manifest()
+
+        partial = manifest is not None and manifest.get("partial", False)
+
+        if (manifest is not None and manifest["version"] == version
+                and not partial and not force):
+            return manifest
+
+        books_filename = path.join(SNAPSHOT_DIR, f"{version}_multi.{DF_CACHE_FORMAT}")
+        cube_filename = path.join(SNAPSHOT_DIR, f"{version}_multi_cube.{DF_CACHE_FORMAT}")
+
+        failed_queries = []
+
+        if force or partial or not path.isfile(books_filename):
+            books_df, failed_queries = extract_wrangle_books(
+                version, refetch=force or partial, observe_page=observe_page)
+        else:
+            books_df = load_df_cache(books_filename)
+
+        if books_df.empty and manifest is not None:
+            print(f"No books were extracted for {version}; "
+                  f"keeping the snapshot for {manifest['version']}.")
+            return keep_manifest(manifest, version)
+
+        if failed_queries and manifest is not None and not partial:
+            print(f"Not every query was extracted for {version}; "
+                  f"keeping the snapshot for {manifest['version']}.")
+            return keep_manifest(manifest, version)
+
+        publish_df(books_df, books_filename)
+        publish_df(build_aggregate_cube(books_df), cube_filename)
+
+        write_manifest({"version": version,
+                        "books": path.basename(books_filename),
+                        "cube": path.basename(cube_filename),
+                        "n_books": len(books_df),
+                        "published_at": datetime.now().isoformat(timespec="seconds"),
+                        **({"partial": True, "failed_queries": failed_queries}
+                           if failed_queries else {})})
+
+        if manifest is not None:
+            remove_snapshot_files(manifest, [books_filename, cube_filename,
+                                             get_ndjson_filename(version)])
+
+        return load_manifest()
+
+
+def refresh_forever(interval: float = REFRESH_INTERVAL_SECONDS) -> None:
+    """Refreshes the snapshot every interval seconds (publishing each day's
+    snapshot once), skipping a refresh if another is still running."""
+
+    while True:
+
+        try:
+            manifest = refresh_snapshot(wait=False)
+            if manifest is not None:
+                print(json.dumps(manifest))
+        except Exception as e:
+            print(f"Failed to refresh the snapshot: {e}")
+
+        sleep(interval)
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Extract, wrangle and publish the books.")
+    parser.add_argument("--daemon", action="store_true")
+    parser.add_argument("--interval", type=float, default=REFRESH_INTERVAL_SECONDS)
+    parser.add_argument("--force", action="store_true")
+
+    args = parser.parse_args()
+
+    if args.daemon:
+        refresh_forever(args.interval)
+    else:
+        print(json.dumps(refresh_snapshot(force=args.force)))
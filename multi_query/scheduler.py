@@ -0,0 +1,345 @@
+"""
+Python script providing a rate-limit-aware scheduler for API requests, shared
+by every request of a harvest, so large harvests run as fast as the API
+allows without being throttled:
+
+• A token bucket spaces requests out to RATE_LIMIT_PER_SECOND on average,
+  with bursts of up to RATE_LIMIT_BURST requests;
+• A '429 Too Many Requests' (or '503 Service Unavailable') pauses every
+  request for its 'Retry-After' header, or else for an exponential backoff
+  with jitter;
+• A circuit breaker fails requests at once for CIRCUIT_RESET_SECONDS after
+  CIRCUIT_FAILURE_THRESHOLD failures in a row, then lets one probe through,
+  closing again if it succeeds;
+• The number of requests in flight adapts: it grows by one after a full
+  window of fast responses, and halves when throttled, or when latency rises
+  past LATENCY_TOLERANCE times the fastest recent latency.
+
+Requests are scheduled by mounting a ScheduledAdapter on a requests.Session,
+so responses served from the on-disk cache (see cache.py) never wait for
+it. The scheduler also reports each query's pages retrieved and failed, so
+no query's data is lost silently.
+
+The scheduler can be configured with the environment variables
+OPEN_LIBRARY_RATE_LIMIT (requests per second) and OPEN_LIBRARY_RATE_BURST.
+"""
+
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from os import environ as ENV
+from random import uniform
+from threading import Condition
+from time import monotonic, perf_counter
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RATE_LIMIT_PER_SECOND = float(ENV.get("OPEN_LIBRARY_RATE_LIMIT", 3))
+RATE_LIMIT_BURST = int(ENV.get("OPEN_LIBRARY_RATE_BURST", 5))
+MAX_BACKOFF_SECONDS = 60
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_SECONDS = 30
+LATENCY_TOLERANCE = 2.0
+LATENCY_SMOOTHING = 0.2
+BASELINE_DRIFT = 0.01
+THROTTLE_STATUS_CODES = {429, 503}
+
+
+def create_scheduler(max_concurrency: int,
+                     rate: float = RATE_LIMIT_PER_SECOND,
+                     burst: int = RATE_LIMIT_BURST,
+                     failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                     reset_seconds: float = CIRCUIT_RESET_SECONDS,
+                     latency_tolerance: float = LATENCY_TOLERANCE) -> dict:
+    """Returns a new scheduler, allowing up to max_concurrency requests in
+    flight at once and rate requests per second (in bursts of up to
+    burst)."""
+
+    return {"rate": rate,
+            "burst": burst,
+            "tokens": float(burst),
+            "refilled_at": monotonic(),
+            "paused_until": 0.0,
+            "max_concurrency": max_concurrency,
+            "concurrency_limit": max_concurrency,
+            "in_flight": 0,
+            "window_successes": 0,
+            "decreased_at": 0.0,
+            "baseline_latency": None,
+            "latency": None,
+            "latency_tolerance": latency_tolerance,
+            "failure_threshold": failure_threshold,
+            "reset_seconds": reset_seconds,
+            "circuit": "closed",
+            "opened_at": 0.0,
+            "probing": False,
+            "consecutive_failures": 0,
+            "consecutive_throttles": 0,
+            "requests": 0,
+            "throttled": 0,
+            "failures": 0,
+            "queries": {},
+            "condition": Condition()}
+
+
+def get_backoff_delay(attempt: int, backoff: float,
+                      max_backoff: float = MAX_BACKOFF_SECONDS) -> float:
+    """Returns a random wait of up to backoff * 2^attempt seconds (capped at
+    max_backoff), so clients retrying at once do not retry in lockstep."""
+
+    return uniform(0, min(max_backoff, backoff * 2 ** attempt))
+
+
+def get_retry_after(response: requests.Response) -> float | None:
+    """Returns the seconds to wait given by a response's 'Retry-After' header
+    (as a number of seconds or a date), or None if it has none."""
+
+    retry_after = response.headers.get("Retry-After")
+
+    if retry_after is None:
+        return None
+
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def get_retry_delay(response: requests.Response | None, attempt: int,
+                    backoff: float) -> float:
+    """Returns how long to wait before retrying a request: the response's
+    'Retry-After' (capped at MAX_BACKOFF_SECONDS) if it has one, or else an
+    exponential backoff with jitter."""
+
+    retry_after = get_retry_after(response) if response is not None else None
+
+    if retry_after is not None:
+        return min(MAX_BACKOFF_SECONDS, retry_after)
+
+    return get_backoff_delay(attempt, backoff)
+
+
+def decrease_concurrency(scheduler: dict, now: float) -> None:
+    """Halves the scheduler's concurrency limit, at most once per round trip,
+    so the responses to one overloaded window only count once."""
+
+    if now - scheduler["decreased_at"] < (scheduler["latency"] or 0):
+        return
+
+    scheduler["concurrency_limit"] = max(1, scheduler["concurrency_limit"] // 2)
+    scheduler["window_successes"] = 0
+    scheduler["decreased_at"] = now
+
+
+def record_latency(scheduler: dict, latency: float, now: float) -> None:
+    """Updates the scheduler's smoothed and baseline latency with a
+    successful response's, then grows or shrinks its concurrency limit."""
+
+    baseline = scheduler["baseline_latency"]
+
+    if baseline is None or latency < baseline:
+        baseline = latency
+    else:
+        baseline += BASELINE_DRIFT * (latency - baseline)
+
+    scheduler["baseline_latency"] = baseline
+
+    if scheduler["latency"] is None:
+        scheduler["latency"] = latency
+    else:
+        scheduler["latency"] += LATENCY_SMOOTHING * (latency - scheduler["latency"])
+
+    if scheduler["latency"] > baseline * scheduler["latency_tolerance"]:
+        decrease_concurrency(scheduler, now)
+        return
+
+    scheduler["window_successes"] += 1
+
+    if scheduler["window_successes"] >= scheduler["concurrency_limit"]:
+        scheduler["concurrency_limit"] = min(scheduler["max_concurrency"],
+                                             scheduler["concurrency_limit"] + 1)
+        scheduler["window_successes"] = 0
+
+
+def wait_for_turn(scheduler: dict) -> None:
+    """
+    Blocks until the scheduler lets another request be sent: once the API
+    is no longer pausing requests, a request slot is free and a token is in
+    the bucket. Raises requests.ConnectionError at once if the circuit
+    breaker is open (or its probe is still in flight).
+    """
+
+    with scheduler["condition"]:
+
+        while True:
+
+            now = monotonic()
+
+            if scheduler["circuit"] == "open":
+
+                reopens_in = scheduler["reset_seconds"] - (now - scheduler["opened_at"])
+
+                if reopens_in > 0:
+                    raise requests.ConnectionError(
+                        f"The circuit breaker is open for another {reopens_in:.0f}s")
+
+                scheduler["circuit"] = "half-open"
+
+            if scheduler["circuit"] == "half-open" and scheduler["probing"]:
+                raise requests.ConnectionError(
+                    "The circuit breaker is waiting for its probe request")
+
+            if scheduler["paused_until"] > now:
+                timeout = scheduler["paused_until"] - now
+
+            elif scheduler["in_flight"] >= scheduler["concurrency_limit"]:
+                timeout = None
+
+            else:
+                scheduler["tokens"] = min(
+                    scheduler["burst"],
+                    scheduler["tokens"]
+                    + (now - scheduler["refilled_at"]) * scheduler["rate"])
+                scheduler["refilled_at"] = now
+
+                if scheduler["tokens"] >= 1:
+                    scheduler["tokens"] -= 1
+                    scheduler["in_flight"] += 1
+                    scheduler["probing"] = scheduler["circuit"] == "half-open"
+                    return
+
+                timeout = (1 - scheduler["tokens"]) / scheduler["rate"]
+
+            scheduler["condition"].wait(timeout)
+
+
+def finish_request(scheduler: dict, latency: float,
+                   response: requests.Response | None) -> None:
+    """Records the outcome of a request let through by wait_for_turn (its
+    response, or None if it raised an error), freeing its slot."""
+
+    with scheduler["condition"]:
+
+        now = monotonic()
+
+        scheduler["in_flight"] -= 1
+        scheduler["requests"] += 1
+        scheduler["probing"] = False
+
+        status_code = response.status_code if response is not None else None
+
+        if status_code in THROTTLE_STATUS_CODES:
+
+            pause = get_retry_after(response)
+
+            if pause is None:
+                pause = get_backoff_delay(scheduler["consecutive_throttles"], 1.0)
+
+            scheduler["throttled"] += 1
+            scheduler["consecutive_throttles"] += 1
+            scheduler["paused_until"] = max(scheduler["paused_until"],
+                                            now + min(MAX_BACKOFF_SECONDS, pause))
+            decrease_concurrency(scheduler, now)
+
+        elif status_code is None or status_code >= 500:
+
+            scheduler["failures"] += 1
+            scheduler["consecutive_failures"] += 1
+
+            if (scheduler["circuit"] == "half-open" or
+                    scheduler["consecutive_failures"] >= scheduler["failure_threshold"]):
+                scheduler["circuit"] = "open"
+                scheduler["opened_at"] = now
+
+            decrease_concurrency(scheduler, now)
+
+        else:
+
+            scheduler["consecutive_failures"] = 0
+            scheduler["consecutive_throttles"] = 0
+            scheduler["circuit"] = "closed"
+
+            if status_code == 200:
+                record_latency(scheduler, latency, now)
+
+        scheduler["condition"].notify_all()
+
+
+class ScheduledAdapter(HTTPAdapter):
+    """A requests HTTPAdapter sending every request through a scheduler
+    (see create_scheduler)."""
+
+    def __init__(self, scheduler: dict, **kwargs):
+
+        self.scheduler = scheduler
+
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+
+        wait_for_turn(self.scheduler)
+
+        start = perf_counter()
+
+        try:
+            response = super().send(request, **kwargs)
+        except Exception:
+            finish_request(self.scheduler, perf_counter() - start, None)
+            raise
+
+        finish_request(self.scheduler, perf_counter() - start, response)
+
+        return response
+
+
+def record_query_page(scheduler: dict, query: str, page: int,
+                      retrieved: bool, attempts: int) -> None:
+    """Adds whether a page of a query was retrieved (and in how many
+    attempts) to the scheduler's report."""
+
+    with scheduler["condition"]:
+
+        report = scheduler["queries"].setdefault(
+            query, {"pages_retrieved": 0, "pages_failed": 0,
+                    "failed_pages": [], "retries": 0})
+
+        report["retries"] += attempts - 1
+
+        if retrieved:
+            report["pages_retrieved"] += 1
+        else:
+            report["pages_failed"] += 1
+            report["failed_pages"].append(page)
+
+
+def get_scheduler_report(scheduler: dict) -> dict:
+    """Returns the scheduler's requests sent, throttled and failed, its
+    current concurrency limit and circuit state, and each query's pages
+    retrieved and failed."""
+
+    with scheduler["condition"]:
+
+        return {"requests": scheduler["requests"],
+                "throttled": scheduler["throttled"],
+                "failures": scheduler["failures"],
+                "concurrency_limit": scheduler["concurrency_limit"],
+                "circuit": scheduler["circuit"],
+                "queries": {query: dict(report, failed_pages=list(report["failed_pages"]))
+                            for query, report in scheduler["queries"].items()}}
+
+
+def get_failed_queries(report: dict) -> list[str]:
+    """Returns the queries in a scheduler report with any failed pages."""
+
+    return [query for query, query_report in report["queries"].items()
+            if query_report["pages_failed"]]
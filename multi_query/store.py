@@ -0,0 +1,226 @@
+"""
+Python script to keep a persistent, append-only store of the wrangled books,
+keyed on each book's Open Library work key ('unique_key').
+
+Each ingestion hashes the content of every wrangled row, and compares it with
+the hashes already in the store, so only books that are new or have changed
+are written, as a new segment file, numbered after the last one (numbers are
+never reused). The dashboard's pd.DataFrame object is then materialised from
+the segments, with the latest version of each book winning: the last
+materialised books are kept in the store, named after the last segment they
+include, so each materialisation only applies the segments written since.
+Once there are more than MAX_SEGMENTS segments, they are compacted into one,
+under the number of the last.
+
+To ingest one or more extracted JSON or newline-delimited JSON files into the
+store, input `python3 store.py <filename> [<filename> ...]` into the
+command-line interface; the files are wrangled in parallel, with one worker
+process per CPU core (or WRANGLE_WORKERS, if set).
+"""
+
+from datetime import datetime
+from glob import glob
+import json
+from os import environ as ENV, makedirs, path, remove
+from sys import argv
+
+import numpy as np
+import pandas as pd
+
+from atomic import atomic_path
+from wrangle import (create_pd_df_parallel,
+                     remove_duplicate_nan_values_format_cols_df,
+                     apply_df_schema, DF_SCHEMA)
+
+STORE_DIR = ENV.get("BOOKS_STORE_DIR", "books_store")
+MAX_SEGMENTS = 30
+BOOK_COLUMNS = list(DF_SCHEMA)
+HASHED_COLUMNS = [col for col in BOOK_COLUMNS if col != "unique_key"]
+
+
+def get_key_hashes_filename(store_dir: str) -> str:
+    """Returns the filename of the store's work key -> content hash index."""
+
+    return path.join(store_dir, "key_hashes.parquet")
+
+
+def get_segment_filenames(store_dir: str) -> list[str]:
+    """Returns the filenames of the store's segments, oldest first."""
+
+    return sorted(glob(path.join(store_dir, "segment_*.parquet")))
+
+
+def get_materialised_filenames(store_dir: str) -> list[str]:
+    """Returns the filenames of the store's materialised books, oldest
+    first."""
+
+    return sorted(glob(path.join(store_dir, "materialised_*.parquet")))
+
+
+def get_file_number(filename: str) -> int:
+    """Returns the number of a segment (or of the last segment included in
+    materialised books) from its filename."""
+
+    return int(path.splitext(path.basename(filename))[0].rsplit("_", 1)[1])
+
+
+def hash_book_rows(input_df: pd.DataFrame) -> pd.Series:
+    """Returns a 64-bit hash of the content of each wrangled row (every
+    column other than the work key)."""
+
+    return pd.util.hash_pandas_object(input_df[HASHED_COLUMNS].astype(str),
+                                      index=False)
+
+
+def load_key_hashes(store_dir: str = STORE_DIR) -> pd.Series:
+    """Returns the content hash of every book in the store, indexed by
+    work key (empty if there is no store yet)."""
+
+    filename = get_key_hashes_filename(store_dir)
+
+    if not path.isfile(filename):
+        return pd.Series(dtype="uint64", index=pd.Index([], name="unique_key"),
+                         name="content_hash")
+
+    return pd.read_parquet(filename).set_index("unique_key")["content_hash"]
+
+
+def write_parquet_atomically(input_df: pd.DataFrame, filename: str) -> None:
+    """Writes a pd.DataFrame object to a Parquet file atomically (see
+    atomic.py), so readers never see a half-written file."""
+
+    with atomic_path(filename) as temp_filename:
+        input_df.to_parquet(temp_filename, index=False)
+
+
+def upsert_books(input_df: pd.DataFrame, store_dir: str = STORE_DIR) -> dict:
+    """
+    Given a wrangled pd.DataFrame object, writes only the books that are
+    new to the store, or whose content has changed, as a new segment.
+    Returns the number of new, changed and unchanged books.
+    """
+
+    makedirs(store_dir, exist_ok=True)
+
+    books_df = apply_df_schema(input_df[BOOK_COLUMNS]).drop_duplicates(
+        subset=["unique_key"], keep="last").reset_index(drop=True)
+
+    content_hashes = hash_book_rows(books_df).to_numpy()
+
+    key_hashes = load_key_hashes(store_dir)
+
+    is_new = ~books_df["unique_key"].isin(key_hashes.index).to_numpy()
+
+    is_changed = np.zeros(len(books_df), dtype=bool)
+    is_changed[~is_new] = (key_hashes.loc[books_df["unique_key"][~is_new]].to_numpy()
+                           != content_hashes[~is_new])
+
+    is_delta = is_new | is_changed
+
+    stats = {"new": int(is_new.sum()),
+             "changed": int(is_changed.sum()),
+             "unchanged": int((~is_delta).sum())}
+
+    if not is_delta.any():
+        return stats
+
+    delta_df = books_df[is_delta].assign(content_hash=content_hashes[is_delta],
+                                         ingested_at=datetime.now().isoformat())
+
+    segment_filenames = get_segment_filenames(store_dir)
+
+    segment_number = (get_file_number(segment_filenames[-1]) + 1
+                      if segment_filenames else 0)
+
+    write_parquet_atomically(
+        delta_df, path.join(store_dir, f"segment_{segment_number:05d}.parquet"))
+
+    key_hashes = pd.concat([
+        key_hashes.drop(delta_df["unique_key"], errors="ignore"),
+        delta_df.set_index("unique_key")["content_hash"]])
+
+    write_parquet_atomically(key_hashes.reset_index(),
+                             get_key_hashes_filename(store_dir))
+
+    if len(segment_filenames) + 1 > MAX_SEGMENTS:
+        compact_store(store_dir)
+
+    return stats
+
+
+def materialise_books(store_dir: str = STORE_DIR,
+                      columns: list[str] | None = None) -> pd.DataFrame:
+    """
+    Returns the wrangled pd.DataFrame object of every book in the store,
+    using the latest version of each book, with only the given columns
+    (all of them if columns is None). Only the segments written since the
+    last materialised books are read, and applied on top of them; the
+    result is kept as the store's materialised books.
+    """
+
+    materialised_filenames = get_materialised_filenames(store_dir)
+
+    if materialised_filenames:
+        books_df = pd.read_parquet(materialised_filenames[-1])
+        last_number = get_file_number(materialised_filenames[-1])
+    else:
+        books_df = pd.DataFrame(columns=BOOK_COLUMNS)
+        last_number = -1
+
+    new_segment_filenames = [filename for filename in get_segment_filenames(store_dir)
+                             if get_file_number(filename) > last_number]
+
+    if new_segment_filenames:
+
+        books_df = pd.concat(
+            [books_df] + [pd.read_parquet(filename, columns=BOOK_COLUMNS)
+                          for filename in new_segment_filenames],
+            ignore_index=True).drop_duplicates(subset=["unique_key"], keep="last")
+
+        books_df = apply_df_schema(books_df[BOOK_COLUMNS].reset_index(drop=True))
+
+        write_parquet_atomically(books_df, path.join(
+            store_dir,
+            f"materialised_{get_file_number(new_segment_filenames[-1]):05d}.parquet"))
+
+        for filename in materialised_filenames:
+            remove(filename)
+
+    books_df = apply_df_schema(books_df)
+
+    if columns is not None:
+        books_df = books_df[columns]
+
+    return books_df
+
+
+def compact_store(store_dir: str = STORE_DIR) -> None:
+    """Rewrites every segment of the store as a single segment, numbered as
+    the last, keeping only the latest version of each book."""
+
+    segment_filenames = get_segment_filenames(store_dir)
+
+    if len(segment_filenames) <= 1:
+        return
+
+    books_df = pd.concat([pd.read_parquet(filename)
+                          for filename in segment_filenames],
+                         ignore_index=True).drop_duplicates(
+                             subset=["unique_key"], keep="last")
+
+    write_parquet_atomically(books_df, segment_filenames[-1])
+
+    for filename in segment_filenames[:-1]:
+        remove(filename)
+
+
+if __name__ == "__main__":
+
+    wrangle_workers = ENV.get("WRANGLE_WORKERS")
+
+    space_df = create_pd_df_parallel(
+        argv[1:], int(wrangle_workers) if wrangle_workers else None)
+
+    space_df = apply_df_schema(remove_duplicate_nan_values_format_cols_df(space_df))
+
+    print(json.dumps(upsert_books(space_df)))
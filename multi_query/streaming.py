@@ -0,0 +1,278 @@
+"""
+Python script to aggregate the books of a harvest online, as each page of
+the API responses arrives, so the dashboard can show its metrics and charts
+long before the last page lands (see AGGREGATION_MODE in main.py).
+
+The aggregates of a harvest are updated one book at a time, in constant
+memory per book (besides the work keys seen, so each book counts once):
+
+• The number of books, and a running mean and variance (Welford's method)
+  of their average ratings and numbers of languages;
+• The number of books first published in each year, and with each average
+  rating (in buckets of cube.RATING_BUCKET_WIDTH, as in the aggregate cube);
+• The authors with the most books, by a Space-Saving heavy-hitters sketch
+  of HEAVY_HITTERS_CAPACITY counters: any author with more than
+  1/HEAVY_HITTERS_CAPACITY of the books is always kept, and each count is
+  overestimated by at most the count of the author it replaced;
+• The number of distinct authors, by a HyperLogLog sketch of
+  2^HYPERLOGLOG_PRECISION registers (with a standard error of about
+  1.04 / sqrt(2^HYPERLOGLOG_PRECISION), ie. 1.6%).
+
+Books are counted as the wrangled pd.DataFrame object counts them (see
+wrangle.get_book_row), so once the harvest is done, every aggregate but the
+authors' matches the aggregate cube of its snapshot.
+"""
+
+from collections import Counter
+from hashlib import blake2b
+from math import log, sqrt
+
+import numpy as np
+import pandas as pd
+
+from cube import get_rating_bucket
+from extract import PAGE_SIZE
+from wrangle import get_book_row
+
+HEAVY_HITTERS_CAPACITY = 1024
+HYPERLOGLOG_PRECISION = 12
+
+
+def create_running_stats() -> dict:
+    """Returns empty running statistics (count, mean and sum of squared
+    differences from the mean) of a stream of values."""
+
+    return {"count": 0, "mean": 0.0, "m2": 0.0}
+
+
+def update_running_stats(stats: dict, value: float) -> None:
+    """Adds a value to running statistics, with Welford's method."""
+
+    stats["count"] += 1
+
+    delta = value - stats["mean"]
+
+    stats["mean"] += delta / stats["count"]
+    stats["m2"] += delta * (value - stats["mean"])
+
+
+def get_running_variance(stats: dict) -> float:
+    """Returns the (population) variance of the values of running
+    statistics, or 0 if there are none."""
+
+    return stats["m2"] / stats["count"] if stats["count"] else 0.0
+
+
+def create_heavy_hitters(capacity: int = HEAVY_HITTERS_CAPACITY) -> dict:
+    """Returns an empty Space-Saving sketch of up to capacity counters, with
+    its items grouped by count, so the item with the smallest count is
+    found at once."""
+
+    return {"capacity": capacity, "counts": {}, "errors": {},
+            "items_by_count": {}, "min_count": 0}
+
+
+def move_heavy_hitter(sketch: dict, item: str, count: int) -> None:
+    """Sets the count of an item in a Space-Saving sketch, regrouping it."""
+
+    items_by_count = sketch["items_by_count"]
+
+    old_count = sketch["counts"].get(item)
+
+    if old_count is not None:
+        del items_by_count[old_count][item]
+        if not items_by_count[old_count]:
+            del items_by_count[old_count]
+
+    sketch["counts"][item] = count
+    items_by_count.setdefault(count, {})[item] = None
+
+    if sketch["min_count"] in items_by_count:
+        sketch["min_count"] = min(sketch["min_count"], count)
+    else:
+        sketch["min_count"] = min(items_by_count)
+
+
+def update_heavy_hitters(sketch: dict, item: str) -> None:
+    """
+    Counts an item in a Space-Saving sketch: an item already counted is
+    incremented; otherwise, once every counter is taken, the item replaces
+    the (oldest) item with the smallest count, taking over its count
+    (recorded as the new item's maximum overestimate) plus one.
+    """
+
+    counts, errors = sketch["counts"], sketch["errors"]
+
+    if item in counts:
+        move_heavy_hitter(sketch, item, counts[item] + 1)
+
+    elif len(counts) < sketch["capacity"]:
+        errors[item] = 0
+        move_heavy_hitter(sketch, item, 1)
+
+    else:
+        min_count = sketch["min_count"]
+        evicted = next(iter(sketch["items_by_count"][min_count]))
+
+        del sketch["items_by_count"][min_count][evicted]
+        del counts[evicted], errors[evicted]
+
+        if not sketch["items_by_count"][min_count]:
+            del sketch["items_by_count"][min_count]
+
+        errors[item] = min_count
+        move_heavy_hitter(sketch, item, min_count + 1)
+
+
+def get_heavy_hitters(sketch: dict) -> pd.Series:
+    """Returns the (over)estimated count of each item in a Space-Saving
+    sketch, largest first."""
+
+    return pd.Series(sketch["counts"], dtype="int64").sort_values(
+        ascending=False, kind="stable")
+
+
+def create_hyperloglog(precision: int = HYPERLOGLOG_PRECISION) -> dict:
+    """Returns an empty HyperLogLog sketch of 2^precision registers."""
+
+    return {"precision": precision, "registers": bytearray(1 << precision)}
+
+
+def add_to_hyperloglog(sketch: dict, item: str) -> None:
+    """Adds an item to a HyperLogLog sketch: the first precision bits of
+    its 64-bit hash pick a register, which keeps the largest position of
+    the first 1 bit seen in the rest of the hash."""
+
+    precision, registers = sketch["precision"], sketch["registers"]
+
+    item_hash = int.from_bytes(blake2b(item.encode("utf-8"), digest_size=8).digest(),
+                               "big")
+
+    index = item_hash >> (64 - precision)
+    rest = item_hash & ((1 << (64 - precision)) - 1)
+
+    rank = (64 - precision) - rest.bit_length() + 1
+
+    if rank > registers[index]:
+        registers[index] = rank
+
+
+def estimate_hyperloglog(sketch: dict) -> int:
+    """Returns the estimated number of distinct items added to a HyperLogLog
+    sketch, counting empty registers instead (linear counting) for small
+    numbers of items."""
+
+    registers = sketch["registers"]
+
+    n_registers = len(registers)
+
+    alpha = 0.7213 / (1 + 1.079 / n_registers)
+
+    estimate = alpha * n_registers ** 2 / sum(2.0 ** -rank for rank in registers)
+
+    n_empty = registers.count(0)
+
+    if estimate <= 2.5 * n_registers and n_empty:
+        estimate = n_registers * log(n_registers / n_empty)
+
+    return round(estimate)
+
+
+def create_stream_aggregates(max_pages: int | None = None,
+                             page_size: int = PAGE_SIZE,
+                             capacity: int = HEAVY_HITTERS_CAPACITY,
+                             precision: int = HYPERLOGLOG_PRECISION) -> dict:
+    """Returns the empty aggregates of a harvest of every page (or up to
+    max_pages pages) per query."""
+
+    return {"max_pages": max_pages, "page_size": page_size, "queries": {},
+            "keys": set(), "n_books": 0,
+            "rating": create_running_stats(),
+            "languages": create_running_stats(),
+            "year_counts": Counter(), "rating_counts": Counter(),
+            "authors": create_heavy_hitters(capacity),
+            "distinct_authors": create_hyperloglog(precision)}
+
+
+def update_stream_aggregates(aggregates: dict, query: str, response: dict) -> None:
+    """Adds a page of a query's response to the aggregates of a harvest,
+    skipping books which are already counted, or would be removed when
+    wrangled. Ratings are aggregated as the wrangled data stores them (ie.
+    as float32 values), as in the aggregate cube."""
+
+    query_stats = aggregates["queries"].setdefault(
+        query, {"num_found": response.get("numFound", 0), "pages": 0})
+
+    query_stats["pages"] += 1
+
+    for doc in response["docs"]:
+
+        row = get_book_row(doc)
+
+        if row is None or row["unique_key"] in aggregates["keys"]:
+            continue
+
+        aggregates["keys"].add(row["unique_key"])
+        aggregates["n_books"] += 1
+
+        rating = float(np.float32(row["average_rating"]))
+
+        update_running_stats(aggregates["rating"], rating)
+        update_running_stats(aggregates["languages"], row["no_of_languages"])
+
+        aggregates["year_counts"][row["first_published"]] += 1
+        aggregates["rating_counts"][get_rating_bucket(rating)] += 1
+
+        update_heavy_hitters(aggregates["authors"], row["author_name"])
+        add_to_hyperloglog(aggregates["distinct_authors"], row["author_name"])
+
+
+def get_stream_progress(aggregates: dict) -> tuple[int, int]:
+    """Returns the number of docs harvested so far, and the number of docs
+    to harvest for the queries answered so far (ie. each query's
+    'numFound', up to max_pages pages)."""
+
+    max_docs = (None if aggregates["max_pages"] is None
+                else aggregates["max_pages"] * aggregates["page_size"])
+
+    n_docs, n_found = 0, 0
+
+    for query_stats in aggregates["queries"].values():
+
+        query_found = (query_stats["num_found"] if max_docs is None
+                       else min(query_stats["num_found"], max_docs))
+
+        n_found += query_found
+        n_docs += min(query_stats["pages"] * aggregates["page_size"], query_found)
+
+    return n_docs, n_found
+
+
+def get_stream_totals(aggregates: dict) -> dict:
+    """Returns the number of books aggregated so far, their aggregated average
+    rating (and its standard deviation) and number of languages published,
+    and their estimated number of distinct authors."""
+
+    if aggregates["n_books"] == 0:
+        return {"total_books": 0, "avg_rating": 0, "rating_std": 0,
+                "avg_languages": 0, "distinct_authors": 0}
+
+    return {"total_books": aggregates["n_books"],
+            "avg_rating": round(aggregates["rating"]["mean"], 2),
+            "rating_std": round(sqrt(get_running_variance(aggregates["rating"])), 2),
+            "avg_languages": round(aggregates["languages"]["mean"], 2),
+            "distinct_authors": estimate_hyperloglog(aggregates["distinct_authors"])}
+
+
+def get_stream_counts(aggregates: dict, dimension: str) -> pd.Series:
+    """Returns the number of books aggregated so far for each value of a
+    dimension: 'first_published' or 'rating_bucket' (exactly), or
+    'author_name' (for the heavy hitters only, overestimated)."""
+
+    if dimension == "author_name":
+        return get_heavy_hitters(aggregates["authors"])
+
+    counts = {"first_published": aggregates["year_counts"],
+              "rating_bucket": aggregates["rating_counts"]}[dimension]
+
+    return pd.Series(counts, dtype="int64").sort_index()
@@ -0,0 +1,58 @@
+"""
+Python script to warm up the dashboard before it serves its first session,
+so that session renders as fast as a later one.
+
+Warming up imports the modules the dashboard needs, loads the published
+snapshot into the dataset shared by every session (see dataset.py) or into
+the SQLite database (see database.py), and builds one chart, so Altair has
+loaded its schema. app.py runs it before the dashboard's health check
+passes; with no snapshot published yet, there is nothing to warm up, and
+the dashboard starts at once.
+
+To time a warm-up, input `python3 warmup.py` into the command-line interface.
+"""
+
+import json
+from time import perf_counter
+
+from dataset import load_shared_dataset
+from instrument import instrument_stage
+
+
+@instrument_stage(rows=lambda data_version: None)
+def warm_up() -> str | None:
+    """Warms up the dashboard's process-wide caches with the published
+    snapshot, returning its data version (or None if no snapshot has been
+    published yet)."""
+
+    import main
+    from diagrams import get_chart_spec
+
+    data_version = main.get_data_version()
+
+    if data_version is None:
+        print("No data has been published yet; skipping the warm-up.")
+        return None
+
+    if main.QUERY_BACKEND == "sqlite":
+
+        cube = (main.load_dashboard_database(data_version), {})
+
+    else:
+
+        cube = load_shared_dataset(data_version, main.build_dashboard_dataset)["cube"]
+
+    get_chart_spec(main.create_yearly_books_line_chart(cube))
+
+    # The version shown, if the data version's books could not be extracted.
+    return main.get_data_version()
+
+
+if __name__ == "__main__":
+
+    start = perf_counter()
+
+    warmed_version = warm_up()
+
+    print(json.dumps({"version": warmed_version,
+                      "seconds": round(perf_counter() - start, 4)}))
@@ -5,11 +5,29 @@ average rating of the book, and the year the book was first published.
 The data is then cleaned for duplicates and empty values.
 """
 
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 import json
+from os import path
+from typing import Iterable, Iterator
 
 import pandas as pd
+import pyarrow.feather as feather
 
+from instrument import instrument_stage
 
+NO_AUTHOR = [None]
+DOCS_CHUNK_SIZE = 10_000
+WRANGLE_CHUNK_BYTES = 64 * 1024 ** 2
+DF_SCHEMA = {"unique_key": "str",
+             "book_title": "str",
+             "author_name": "category",
+             "average_rating": "float32",
+             "no_of_languages": "int16",
+             "first_published": "int16"}
+
+
+@instrument_stage()
 def load_json_data(json_filename: str) -> list[dict]:
     """
     Given our JSON filename, we load the data, returning it as 
@@ -21,72 +39,175 @@ def load_json_data(json_filename: str) -> list[dict]:
     return result
 
 
+def load_ndjson_docs_range(ndjson_filename: str, start: int,
+                           end: int) -> Iterator[dict]:
+    """
+    Given a newline-delimited JSON filename, yields each doc whose line starts
+    at a byte offset in [start, end), so a file can be split between workers
+    without any line being read twice or missed.
+    """
+    with open(ndjson_filename, 'rb') as f:
+
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()
+
+        while f.tell() < end:
+            line = f.readline()
+
+            if not line:
+                break
+
+            if line.strip():
+                yield json.loads(line)
+
+
+def split_wrangle_tasks(filenames: list[str],
+                        chunk_bytes: int = WRANGLE_CHUNK_BYTES) -> list[tuple]:
+    """
+    Returns the tasks to wrangle a list of extracted files in parallel, in
+    a deterministic order: one (filename, start, end) task per chunk_bytes of
+    each newline-delimited JSON file, and one per JSON file.
+    """
+
+    tasks = []
+
+    for filename in filenames:
+
+        if not filename.endswith(".ndjson"):
+            tasks.append((filename, 0, None))
+            continue
+
+        file_size = path.getsize(filename)
+
+        for start in range(0, max(file_size, 1), chunk_bytes):
+            tasks.append((filename, start, min(start + chunk_bytes, file_size)))
+
+    return tasks
+
+
+def wrangle_task(task: tuple) -> pd.DataFrame:
+    """Returns the pd.DataFrame object of the books in one task from
+    split_wrangle_tasks; run in a worker process."""
+
+    filename, start, end = task
+
+    if end is None:
+        return create_pd_df(load_json_data(filename))
+
+    return create_pd_df_from_docs(load_ndjson_docs_range(filename, start, end))
+
+
+@instrument_stage()
+def create_pd_df_parallel(filenames: list[str], max_workers: int | None = None,
+                          chunk_bytes: int = WRANGLE_CHUNK_BYTES) -> pd.DataFrame:
+    """
+    Given a list of extracted JSON/newline-delimited JSON files, returns the
+    same pd.DataFrame object as create_pd_df would for all of their docs.
+    The files are split into chunks of chunk_bytes, which are wrangled by
+    up to max_workers worker processes (by default, one per CPU core); the
+    partial pd.DataFrame objects are merged in task order, so removing
+    duplicates afterwards keeps the same book as wrangling serially.
+    """
+
+    tasks = split_wrangle_tasks(filenames, chunk_bytes)
+
+    if max_workers == 1 or len(tasks) <= 1:
+        partial_dfs = [wrangle_task(task) for task in tasks]
+
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            partial_dfs = list(executor.map(wrangle_task, tasks))
+
+    if not partial_dfs:
+        return create_pd_df_from_docs([])
+
+    # A chunk missing a field in every doc has an object column of Nones, so
+    # the merged columns are re-inferred to match wrangling serially.
+    return pd.concat(partial_dfs, ignore_index=True).infer_objects()
+
+
+@instrument_stage()
 def create_pd_df(api_response: dict) -> pd.DataFrame:
     """
     Given our JSON data, we take all titles of books
     in the response, and input them into a pd.DataFrame object.
     """
 
-    unique_key = []
+    return create_pd_df_from_docs(doc for response_dict in api_response
+                                  for doc in response_dict["docs"])
+
+
+@instrument_stage()
+def create_pd_df_from_docs(docs: Iterable[dict],
+                           chunk_size: int = DOCS_CHUNK_SIZE) -> pd.DataFrame:
+    """
+    Given the docs of our JSON data (eg. streamed by load_ndjson_docs_range), we take
+    all titles of books, and input them into a pd.DataFrame object.
+
+    The docs are consumed chunk_size at a time, and each doc's values are
+    read by get_doc_values (so every row is formed as get_book_row forms
+    it), then split into the chunk's columns; so only the columns, and not
+    every doc, are held in memory.
+    """
 
-    book_titles = []
+    columns = {column: [] for column in DF_SCHEMA}
 
-    authors = []
+    docs = iter(docs)
 
-    avg_ratings = []
+    while chunk := list(islice(docs, chunk_size)):
 
-    language_count = []
+        for column, values in zip(columns.values(), zip(*map(get_doc_values, chunk))):
+            column.extend(values)
 
-    first_published = []
+    result_df = pd.DataFrame(columns)
 
-    for response_dict in api_response:
+    return result_df
 
-        for doc in response_dict["docs"]:
 
-            unique_key.append(doc["key"])
+def get_doc_values(doc: dict) -> tuple:
+    """
+    Given one doc of our JSON data, returns the values of its book's row, in
+    the order of the columns of DF_SCHEMA, with None for any missing field.
+    """
 
-            try:
-                book_titles.append(f"{doc['title']}: {doc['subtitle']}")
-            except KeyError:
-                book_titles.append(doc["title_suggest"])
+    return (doc.get("key"),
+            (f"{doc['title']}: {doc['subtitle']}"
+             if "title" in doc and "subtitle" in doc
+             else doc.get("title_suggest")),
+            (doc.get("author_name") or doc.get("author_alternative_name")
+             or NO_AUTHOR)[0],
+            doc.get("ratings_average"),
+            len(doc["language"]) if "language" in doc else None,
+            doc.get("first_publish_year"))
 
-            try:
-                authors.append(doc["author_name"][0])
-            except KeyError:
-                try:
-                    authors.append(doc["author_alternative_name"][0])
-                except KeyError:
-                    authors.append(None)
 
-            try:
-                avg_ratings.append(doc["ratings_average"])
-            except KeyError:
-                avg_ratings.append(None)
+def get_book_row(doc: dict) -> dict | None:
+    """
+    Given one doc of our JSON data, returns its row as create_pd_df_from_docs
+    forms it, with integer 'no_of_languages' and 'first_published' values;
+    or None if the row has any empty values (as such rows are removed by
+    remove_duplicate_nan_values_format_cols_df).
+    """
 
-            try:
-                language_count.append(len(doc["language"]))
-            except KeyError:
-                language_count.append(None)
+    row = dict(zip(DF_SCHEMA, get_doc_values(doc)))
 
-            try:
-                first_published.append(doc["first_publish_year"])
-            except KeyError:
-                first_published.append(None)
+    if any(value is None or value != value for value in row.values()):
+        return None
 
-    result_df = pd.DataFrame({"unique_key": unique_key,
-                              "book_title": book_titles,
-                              "author_name": authors,
-                              "average_rating": avg_ratings,
-                              "no_of_languages": language_count,
-                              "first_published": first_published})
+    row["no_of_languages"] = int(row["no_of_languages"])
+    row["first_published"] = int(row["first_published"])
 
-    return result_df
+    return row
 
 
+@instrument_stage()
 def remove_duplicate_nan_values_format_cols_df(input_df: pd.DataFrame) -> pd.DataFrame:
     """
     Given a pd.DataFrame object, returns the object such that all empty
     values are removed, and the 'no_of_languages' column stores integers.
+    The 'unique_key' column (the Open Library work key) is kept, so each
+    book can still be identified after cleaning.
     """
     result_df = input_df.dropna().drop_duplicates(subset=['unique_key']).reset_index()
 
@@ -94,11 +215,58 @@ def remove_duplicate_nan_values_format_cols_df(input_df: pd.DataFrame) -> pd.Dat
 
     result_df["no_of_languages"] = result_df["no_of_languages"].astype("int64")
 
-    result_df.drop(['unique_key', 'index'], axis=1, inplace=True)
+    result_df.drop(['index'], axis=1, inplace=True)
 
     return result_df
 
 
+def apply_df_schema(input_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Given a cleaned pd.DataFrame object, returns it with the compact dtypes
+    in DF_SCHEMA (eg. category for author names, int16 for years), for any
+    of those columns it has.
+    """
+
+    return input_df.astype({col: dtype for col, dtype in DF_SCHEMA.items()
+                            if col in input_df.columns})
+
+
+def save_df_cache(input_df: pd.DataFrame, filename: str) -> None:
+    """
+    Writes a cleaned pd.DataFrame object to a cache file, in the format given
+    by its extension: '.parquet', '.feather'/'.arrow' (Arrow IPC), or '.csv'.
+    """
+
+    if filename.endswith(".csv"):
+        input_df.to_csv(filename, index=False)
+
+    elif filename.endswith((".feather", ".arrow")):
+        input_df.to_feather(filename, compression="uncompressed")
+
+    else:
+        input_df.to_parquet(filename, index=False)
+
+
+@instrument_stage()
+def load_df_cache(filename: str, columns: list[str] | None = None) -> pd.DataFrame:
+    """
+    Reads a cleaned pd.DataFrame object from a cache file written by
+    save_df_cache. Only the given columns are loaded (all of them if columns
+    is None), and Parquet/Arrow files are memory-mapped rather than read
+    into memory up front.
+    """
+
+    if filename.endswith(".csv"):
+        result_df = pd.read_csv(filename, usecols=columns)
+        return apply_df_schema(result_df)
+
+    if filename.endswith((".feather", ".arrow")):
+        table = feather.read_table(filename, columns=columns, memory_map=True)
+        return table.to_pandas()
+
+    return pd.read_parquet(filename, columns=columns, memory_map=True)
+
+
 if __name__ == "__main__":
 
     space_data = load_json_data("2024-09-16_multi.json")
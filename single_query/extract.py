@@ -8,34 +8,159 @@ would be 'the+lord+of+the+rings').
 
 This data will be written into a JSON file, named after the date the response 
 was extracted, as well as the search query.
+
+Every request is sent through a rate-limit-aware scheduler (see
+scheduler.py), and retried on connection errors and retryable status codes.
+The response cache and scheduler are those of the multi_query scripts, whose
+directory is put on the path after this one (so this directory's scripts, eg.
+wrangle.py, are still imported first).
 """
 
 from datetime import datetime
 import json
+from math import ceil
 from os import environ as ENV, path
+import sys
+from time import sleep
+from typing import Iterator
 
 import requests
 from dotenv import load_dotenv
 
+sys.path.append(path.join(path.dirname(path.dirname(path.abspath(__file__))),
+                          "multi_query"))
+
+from cache import CACHE_DIR, cached_get
+from scheduler import (ScheduledAdapter, create_scheduler, get_retry_delay,
+                       record_query_page, get_scheduler_report,
+                       get_failed_queries)
+
 
 API_BASE_URL = "https://openlibrary.org/search"
+PAGE_SIZE = 100
+MAX_RETRIES = 3
+BACKOFF_SECONDS = 1.0
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+SEARCH_FIELDS = ['title', 'title_suggest', 'author_name',
+                 'author_alternative_name', 'ratings_average', 'language',
+                 'publish_date']
+
+
+def get_search_query_title_page(session: requests.Session, page: int = 1,
+                                page_size: int = PAGE_SIZE,
+                                fields: list[str] | None = SEARCH_FIELDS,
+                                cache_dir: str | None = CACHE_DIR,
+                                max_retries: int = MAX_RETRIES,
+                                backoff: float = BACKOFF_SECONDS,
+                                scheduler: dict | None = None) -> dict | None:
+    """Returns one page of books satisfying a given title search query,
+    with only the given fields requested (all of them if fields is None).
+    Responses go through the on-disk cache in cache_dir (see cache.py),
+    unless it is None. Connection errors and retryable status codes are
+    retried up to max_retries times, and whether the page was retrieved is
+    added to the scheduler's report, if one is given."""
+
+    url = (f"{API_BASE_URL}.json?title={ENV['SEARCH_QUERY_TITLE']}"
+           f"&page={page}&limit={page_size}")
+
+    if fields is not None:
+        url += f"&fields={','.join(fields)}"
+
+    for attempt in range(max_retries + 1):
+
+        response = None
+
+        try:
+            response = cached_get(session, url, 10, cache_dir)
+
+        except requests.RequestException as e:
+            print("Failed to retrieve data from the API:", e)
+
+        else:
+            if response.status_code == 200:
+
+                if scheduler is not None:
+                    record_query_page(scheduler, ENV['SEARCH_QUERY_TITLE'], page,
+                                      True, attempt + 1)
+
+                return response.json()
+
+            print("Failed to retrieve data from the API. Status code: ",
+                  response.status_code)
+
+            if response.status_code not in RETRY_STATUS_CODES:
+                break
+
+        if attempt < max_retries:
+            sleep(get_retry_delay(response, attempt, backoff))
 
+    if scheduler is not None:
+        record_query_page(scheduler, ENV['SEARCH_QUERY_TITLE'], page, False,
+                          attempt + 1)
 
-def get_search_query_title_books() -> list[dict]:
-    """Returns all books satisfying a given title search query."""
+    return None
+
+
+def get_search_query_title_pages(max_pages: int | None = None,
+                                 page_size: int = PAGE_SIZE,
+                                 fields: list[str] | None = SEARCH_FIELDS,
+                                 cache_dir: str | None = CACHE_DIR,
+                                 scheduler: dict | None = None) -> Iterator[dict]:
+    """
+    Yields each page of books satisfying a given title search query,
+    using 'numFound' from the first page to work out how many pages there
+    are (capped at max_pages, if given). Only one page is held at a time.
+    Requests go through the given scheduler (or a new one; see
+    scheduler.py), and failed pages are recorded in its report.
+    """
+
+    if scheduler is None:
+        scheduler = create_scheduler(1)
+
+    with requests.Session() as session:
+
+        session.mount("http://", ScheduledAdapter(scheduler))
+        session.mount("https://", ScheduledAdapter(scheduler))
+
+        first_page = get_search_query_title_page(session, 1, page_size,
+                                                 fields, cache_dir,
+                                                 scheduler=scheduler)
+
+        if first_page is None:
+            return
+
+        yield first_page
 
-    response = requests.get(
-        f"{API_BASE_URL}.json?title={ENV['SEARCH_QUERY_TITLE']}",
-        timeout=10)
+        last_page = ceil(first_page.get("numFound", 0) / page_size)
 
-    if response.status_code == 200:
+        if max_pages is not None:
+            last_page = min(last_page, max_pages)
 
-        result = response.json()
+        for page in range(2, last_page + 1):
 
-        return result
+            response = get_search_query_title_page(session, page, page_size,
+                                                   fields, cache_dir,
+                                                   scheduler=scheduler)
 
-    print("Failed to retrieve data from the API. Status code: ",
-          response.status_code)
+            if response is not None:
+                yield response
+
+
+def get_search_query_title_books(max_pages: int | None = None,
+                                 scheduler: dict | None = None) -> dict | None:
+    """Returns all books satisfying a given title search query, with the
+    docs of every page (up to max_pages) collected into one response."""
+
+    result = None
+
+    for response in get_search_query_title_pages(max_pages, scheduler=scheduler):
+
+        if result is None:
+            result = response
+        else:
+            result["docs"].extend(response["docs"])
+
+    return result
 
 
 def api_data_into_json(json_data: dict, json_file: str) -> None:
@@ -63,7 +188,12 @@ if __name__ == "__main__":
 
     json_filename = f"{today_date}_title={ENV['SEARCH_QUERY_TITLE']}.json"
 
-    extracted_data = get_search_query_title_books()
+    request_scheduler = create_scheduler(1)
+
+    extracted_data = get_search_query_title_books(scheduler=request_scheduler)
+
+    if get_failed_queries(get_scheduler_report(request_scheduler)):
+        print("Failed to retrieve every page of:", ENV['SEARCH_QUERY_TITLE'])
 
     if extracted_data is not None and not path.isfile(f"./{json_filename}"):
         api_data_into_json(extracted_data, json_filename)
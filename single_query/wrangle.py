@@ -16,6 +16,8 @@ import json
 
 import pandas as pd
 
+NO_AUTHOR = [None]
+
 
 def load_json_data(json_filename: str) -> list[dict]:
     """
@@ -32,53 +34,31 @@ def create_pd_df(api_response: dict) -> pd.DataFrame:
     """
     Given our JSON data, we take all titles of books
     in the response, and input them into a pd.DataFrame object.
-    """
-
-    book_titles = []
-
-    authors = []
-
-    avg_ratings = []
 
-    language_count = []
-
-    publish_dates = []
-
-    for doc in api_response["docs"]:
-
-        try:
-            book_titles.append(doc["title"])
-        except KeyError:
-            book_titles.append(doc["title_suggest"])
+    Each column is built in a single pass over the docs, with missing
+    fields handled by lookups rather than by raising KeyErrors.
+    """
 
-        try:
-            authors.append(doc["author_name"][0])
-        except KeyError:
-            try:
-                authors.append(doc["author_alternative_name"][0])
-            except KeyError:
-                authors.append(None)
+    docs = api_response["docs"]
 
-        try:
-            avg_ratings.append(doc["ratings_average"])
-        except KeyError:
-            avg_ratings.append(None)
+    book_titles = [doc["title"] if "title" in doc else doc.get("title_suggest")
+                   for doc in docs]
 
-        try:
-            language_count.append(len(doc["language"]))
-        except KeyError:
-            language_count.append(None)
+    authors = [(doc.get("author_name")
+                or doc.get("author_alternative_name")
+                or NO_AUTHOR)[0]
+               for doc in docs]
 
-        try:
-            publish_dates.append(doc["publish_date"])
-        except KeyError:
-            publish_dates.append(None)
+    language_count = [len(doc["language"]) if "language" in doc else None
+                      for doc in docs]
 
     result_df = pd.DataFrame({"book_title": book_titles,
                               "author_name": authors,
-                              "average_rating": avg_ratings,
+                              "average_rating": [doc.get("ratings_average")
+                                                 for doc in docs],
                               "no_of_languages": language_count,
-                              "publish_dates": publish_dates})
+                              "publish_dates": [doc.get("publish_date")
+                                                for doc in docs]})
 
     return result_df
 
@@ -0,0 +1,119 @@
+"""
+Shared fixtures for the tests of the multi_query scripts, which are imported
+by plain name (as they import each other), so their directory is put on the
+path first.
+
+The `stub_api` fixture serves a local stand-in for the Open Library search
+API, so extraction can be tested without the network.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from os import path
+import sys
+from threading import Thread
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))),
+                             "multi_query"))
+
+
+def create_stub_docs(query: str, n_docs: int) -> list[dict]:
+    """Returns n_docs docs for a query, with every search field set."""
+
+    return [{"key": f"/works/OL{query.replace('+', '')}{i}W",
+             "title": f"{query} {i}", "subtitle": "a subtitle",
+             "title_suggest": f"{query} {i}",
+             "author_name": [f"Author {i % 7}"],
+             "author_alternative_name": [f"A. {i % 7}"],
+             "ratings_average": 1 + (i % 40) / 10,
+             "language": ["eng", "fre"][:1 + i % 2],
+             "first_publish_year": 1950 + i % 70}
+            for i in range(n_docs)]
+
+
+def match_stub_docs(corpus: dict, query: str) -> list[dict]:
+    """Returns the docs of a corpus (query -> docs) which a query matches, as
+    the API would: a doc has the terms of each query it is listed under, a
+    query matches the docs having all of its terms, and an OR-query (eg.
+    '(space+flight)+OR+moon') those any of its queries matches."""
+
+    matched = {}
+
+    for or_query in query.split("+OR+"):
+
+        terms = set(or_query.strip("()").split("+"))
+
+        for corpus_query, docs in corpus.items():
+            if terms <= set(corpus_query.split("+")):
+                matched.update((doc["key"], doc) for doc in docs)
+
+    return list(matched.values())
+
+
+class StubAPIHandler(BaseHTTPRequestHandler):
+    """Answers '/search.json' requests from the server's corpus: each query
+    finds the docs it matches (see match_stub_docs), which are paged by
+    'page' and 'limit', and projected onto 'fields' (if given). Statuses
+    queued in the server's failures for a (query, page) are answered first,
+    with a 'Retry-After: 0' header."""
+
+    def do_GET(self):
+
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+
+        query = params["q"][0].replace(" ", "+")
+        page = int(params.get("page", ["1"])[0])
+        limit = int(params.get("limit", ["100"])[0])
+        fields = params["fields"][0].split(",") if "fields" in params else None
+
+        self.server.requests.append({"query": query, "page": page,
+                                     "limit": limit, "fields": fields})
+
+        failures = self.server.failures.get((query, page))
+
+        if failures:
+            self.send_response(failures.pop(0))
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            return
+
+        docs = match_stub_docs(self.server.corpus, query)
+
+        page_docs = [{key: value for key, value in doc.items()
+                      if fields is None or key in fields}
+                     for doc in docs[(page - 1) * limit:page * limit]]
+
+        body = json.dumps({"numFound": len(docs), "start": (page - 1) * limit,
+                           "docs": page_docs}).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_api():
+    """Yields a running stub API server; set its corpus (query -> docs) and
+    failures ((query, page) -> statuses), and read the requests it answered.
+    Its base URL (to pass as base_url) is its 'base_url' attribute."""
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubAPIHandler)
+    server.corpus, server.failures, server.requests = {}, {}, []
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}/search"
+
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,103 @@
+"""Tests of cache.py's on-disk response cache."""
+
+from os import path, utime
+
+import requests
+
+import cache
+from cache import cached_get, get_cache_paths
+
+
+class FakeSession:
+    """A stand-in for a requests.Session, answering every GET with a body
+    of body_size bytes (or 304 if sent the ETag it answers with)."""
+
+    def __init__(self, body_size: int = 100):
+        self.body_size = body_size
+        self.requests = []
+
+    def get(self, url: str, headers: dict | None = None, timeout: float = None):
+        self.requests.append((url, headers or {}))
+
+        response = requests.Response()
+        response.url = url
+        response.headers["ETag"] = '"v1"'
+
+        if (headers or {}).get("If-None-Match") == '"v1"':
+            response.status_code = 304
+            response._content = b""
+        else:
+            response.status_code = 200
+            response._content = b"x" * self.body_size
+
+        return response
+
+
+def test_fresh_entries_are_served_from_disk(tmp_path):
+
+    session = FakeSession()
+
+    first = cached_get(session, "http://stub/a", 1, str(tmp_path))
+    second = cached_get(session, "http://stub/a", 1, str(tmp_path))
+
+    assert len(session.requests) == 1
+    assert second.headers["X-Cache"] == "HIT"
+    assert second.content == first.content
+
+
+def test_stale_entries_are_revalidated(tmp_path):
+
+    session = FakeSession()
+
+    cached_get(session, "http://stub/a", 1, str(tmp_path))
+    revalidated = cached_get(session, "http://stub/a", 1, str(tmp_path), ttl=0)
+
+    assert session.requests[1][1]["If-None-Match"] == '"v1"'
+    assert revalidated.status_code == 200
+    assert revalidated.content == b"x" * 100
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+
+    session = FakeSession(body_size=1000)
+    cache_dir = str(tmp_path)
+
+    for i in range(5):
+        cached_get(session, f"http://stub/{i}", 1, cache_dir)
+        body_path, _ = get_cache_paths(f"http://stub/{i}", cache_dir)
+        utime(body_path, (i, i))
+
+    cached_get(session, "http://stub/0", 1, cache_dir)
+
+    cached_get(session, "http://stub/5", 1, cache_dir, max_bytes=4500)
+
+    kept = {i for i in range(6)
+            if path.exists(get_cache_paths(f"http://stub/{i}", cache_dir)[0])}
+
+    assert 0 in kept and 5 in kept
+    assert 1 not in kept
+    assert sum(entry.stat().st_size for entry in tmp_path.iterdir()) <= 4500 * cache.CACHE_EVICTION_RATIO
+
+
+def test_writes_do_not_scan_the_cache(tmp_path, monkeypatch):
+
+    scans = []
+    scan_cache_entries = cache.scan_cache_entries
+
+    def count_scans(cache_dir):
+        scans.append(cache_dir)
+        return scan_cache_entries(cache_dir)
+
+    monkeypatch.setattr(cache, "scan_cache_entries", count_scans)
+
+    session = FakeSession(body_size=1000)
+
+    for i in range(50):
+        cached_get(session, f"http://stub/{i}", 1, str(tmp_path), max_bytes=100_000)
+
+    assert len(scans) == 1
+
+    cached_get(session, "http://stub/50", 1, str(tmp_path), max_bytes=20_000)
+
+    assert len(scans) == 2
+    assert sum(entry.stat().st_size for entry in tmp_path.iterdir()) <= 20_000
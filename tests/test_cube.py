@@ -0,0 +1,104 @@
+"""Tests of cube.py's aggregate cube, and of the rating buckets shared by the
+charts, the database and the streaming aggregates."""
+
+import numpy as np
+import pandas as pd
+
+from cube import (build_aggregate_cube, build_author_counts, get_cube_counts,
+                  get_cube_totals, get_rating_bucket, get_rating_buckets,
+                  slice_aggregate_cube)
+from database import load_books_into_database, query_counts, query_scatter_bins
+from diagrams import get_scatter_bins
+from wrangle import apply_df_schema
+
+EXACT_RATINGS = [1.0, 2.7, 3.0, 3.3, 4.1, 4.2, 4.9, 5.0]
+
+
+def create_books_df(n_books: int, seed: int = 0) -> pd.DataFrame:
+    """Returns n_books random wrangled books, with ratings to 2 decimal
+    places, most books in a few languages, and many authors."""
+
+    rng = np.random.default_rng(seed)
+
+    return apply_df_schema(pd.DataFrame({
+        "unique_key": [f"/works/OL{i}W" for i in range(n_books)],
+        "book_title": [f"Book {i}" for i in range(n_books)],
+        "author_name": [f"Author {i}" for i in rng.integers(0, n_books // 4, n_books)],
+        "average_rating": rng.integers(100, 501, n_books) / 100,
+        "no_of_languages": np.minimum(rng.geometric(0.5, n_books), 30),
+        "first_published": rng.integers(1900, 2025, n_books)}))
+
+
+def test_exact_ratings_fall_in_their_own_bucket():
+
+    ratings = np.array(EXACT_RATINGS, dtype=np.float32)
+
+    buckets = get_rating_buckets(ratings)
+
+    assert buckets.dtype == np.float64
+    assert buckets.tolist() == EXACT_RATINGS
+    assert [get_rating_bucket(float(rating)) for rating in ratings] == EXACT_RATINGS
+    assert get_rating_buckets(np.array([4.19, 4.25], dtype=np.float32), 0.25).tolist() == [4.0, 4.25]
+
+
+def test_rating_buckets_match_across_the_cube_charts_and_database(tmp_path):
+
+    books_df = create_books_df(2_000)
+    books_df.loc[:len(EXACT_RATINGS) - 1, "average_rating"] = EXACT_RATINGS
+
+    cube = build_aggregate_cube(books_df)
+
+    assert cube["rating_bucket"].dtype == np.float64
+
+    database_filename = str(tmp_path / "books.sqlite")
+    load_books_into_database(books_df, "v1", database_filename)
+
+    cube_counts = get_cube_counts(cube, "rating_bucket")
+    database_counts = query_counts(database_filename, "rating_bucket", {})
+
+    assert cube_counts.to_dict() == database_counts.to_dict()
+
+    bins = get_scatter_bins(books_df)
+    database_bins = query_scatter_bins(database_filename, {}, 0.1)
+
+    assert bins.groupby("rating_bin")["Number of Books"].sum().to_dict() == cube_counts.to_dict()
+    assert (bins[["no_of_languages", "rating_bin", "Number of Books"]].to_dict("records")
+            == database_bins[["no_of_languages", "rating_bin",
+                              "Number of Books"]].to_dict("records"))
+
+
+def test_the_cube_is_much_smaller_than_the_books():
+
+    books_df = create_books_df(100_000)
+
+    cube = build_aggregate_cube(books_df)
+
+    assert "author_name" not in cube.columns
+    assert len(cube) <= len(books_df) / 4
+    assert get_cube_totals(cube)["total_books"] == len(books_df)
+
+
+def test_cube_slices_match_rebuilt_cubes():
+
+    books_df = create_books_df(10_000)
+    cube = build_aggregate_cube(books_df)
+
+    ranges = {"first_published": (1950, 1999), "no_of_languages": (2, 4)}
+
+    cube_slice = slice_aggregate_cube(cube, ranges)
+    filtered_df = books_df[books_df["first_published"].between(1950, 1999)
+                           & books_df["no_of_languages"].between(2, 4)]
+
+    assert get_cube_totals(cube_slice) == get_cube_totals(build_aggregate_cube(filtered_df))
+    assert slice_aggregate_cube(cube, {"average_rating": (2, 3)}) is None
+
+
+def test_author_counts_are_largest_first():
+
+    books_df = create_books_df(5_000)
+
+    author_counts = build_author_counts(books_df)
+
+    assert author_counts.sum() == len(books_df)
+    assert author_counts.is_monotonic_decreasing
+    assert author_counts.to_dict() == books_df["author_name"].astype(str).value_counts().to_dict()
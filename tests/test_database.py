@@ -0,0 +1,79 @@
+"""Tests of database.py's SQL queries of the books."""
+
+import pytest
+
+from database import (load_books_into_database, query_books, query_top_k_books,
+                      query_totals)
+from diagrams import get_top_k_books
+from filters import build_book_index, filter_book_positions
+from test_cube import EXACT_RATINGS, create_books_df
+from wrangle import DF_SCHEMA
+
+
+@pytest.fixture
+def database_filename(tmp_path):
+    """Returns the filename of a database of 1,000 random books."""
+
+    database_filename = str(tmp_path / "books.sqlite")
+
+    load_books_into_database(create_books_df(1_000), "v1", database_filename)
+
+    return database_filename
+
+
+def test_books_matching_nothing_keep_their_schema(database_filename):
+
+    filter_state = {"search": "zzzqqq"}
+
+    books_df = query_books(database_filename, filter_state)
+    top_books_df = query_top_k_books(database_filename, "no_of_languages", 10,
+                                     filter_state)
+
+    assert books_df.empty and top_books_df.empty
+    assert books_df.dtypes.astype(str).to_dict() == {
+        col: str(query_books(database_filename, {})[col].dtype) for col in DF_SCHEMA}
+    assert str(top_books_df["no_of_languages"].dtype) == DF_SCHEMA["no_of_languages"]
+
+    assert get_top_k_books(top_books_df, "no_of_languages").empty
+
+
+def test_top_books_match_the_pandas_backend(database_filename):
+
+    books_df = query_books(database_filename, {})
+
+    top_books_df = query_top_k_books(database_filename, "no_of_languages", 10, {})
+
+    assert top_books_df.dtypes.astype(str).to_dict() == books_df[
+        ["book_title", "no_of_languages", "author_name"]].dtypes.astype(str).to_dict()
+    assert (top_books_df["book_title"].tolist()
+            == get_top_k_books(books_df, "no_of_languages")["book_title"].tolist())
+
+
+def test_no_columns_only_counts_the_books(database_filename):
+
+    assert query_books(database_filename, {}, []).shape == (1_000, 0)
+    assert query_books(database_filename, {}, [], limit=10).shape == (10, 0)
+    assert list(query_books(database_filename, {}, None).columns) == list(DF_SCHEMA)
+    assert query_totals(database_filename, {})["total_books"] == 1_000
+
+
+def test_ratings_on_a_bound_match_the_pandas_backend(tmp_path):
+
+    books_df = create_books_df(1_000)
+    books_df.loc[:len(EXACT_RATINGS) - 1, "average_rating"] = EXACT_RATINGS
+
+    database_filename = str(tmp_path / "books.sqlite")
+    load_books_into_database(books_df, "v1", database_filename)
+
+    book_index = build_book_index(books_df)
+
+    for low, high in [(4.1, 5.0), (1.0, 4.1), (4.2, 4.2), (2.7, 3.3)]:
+
+        filter_state = {"ranges": {"average_rating": (low, high)}}
+
+        positions = filter_book_positions(book_index, filter_state)
+
+        assert 0 < len(positions)
+        assert query_totals(database_filename, filter_state)["total_books"] == len(positions)
+        assert (query_books(database_filename, filter_state)["unique_key"].tolist()
+                == books_df["unique_key"].iloc[positions].tolist())
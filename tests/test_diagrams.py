@@ -0,0 +1,41 @@
+"""Tests of diagrams.py's rating-vs-languages scatter graph modes."""
+
+import pytest
+
+from diagrams import SCATTER_MAX_POINTS, create_rating_languages_scatter, get_chart_spec
+from test_cube import create_books_df
+
+
+def get_scatter_rows(spec: dict) -> int:
+    """Returns the number of rows of the largest dataset in a chart's spec."""
+
+    return max(len(values) for values in spec["datasets"].values())
+
+
+@pytest.mark.parametrize("n_books", [SCATTER_MAX_POINTS, SCATTER_MAX_POINTS + 1])
+def test_every_book_is_plotted_in_points_mode(n_books):
+
+    spec = get_chart_spec(create_rating_languages_scatter(create_books_df(n_books),
+                                                          mode="points"))
+
+    assert get_scatter_rows(spec) == n_books
+
+
+def test_auto_mode_bins_books_past_max_points():
+
+    books_df = create_books_df(SCATTER_MAX_POINTS + 1)
+
+    points_spec = get_chart_spec(create_rating_languages_scatter(
+        books_df.head(SCATTER_MAX_POINTS)))
+    binned_spec = get_chart_spec(create_rating_languages_scatter(books_df))
+
+    assert get_scatter_rows(points_spec) == SCATTER_MAX_POINTS
+    assert get_scatter_rows(binned_spec) < SCATTER_MAX_POINTS
+
+
+def test_sampled_mode_plots_max_points_books():
+
+    spec = get_chart_spec(create_rating_languages_scatter(
+        create_books_df(3 * SCATTER_MAX_POINTS), mode="sampled"))
+
+    assert get_scatter_rows(spec) == SCATTER_MAX_POINTS
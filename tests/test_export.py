@@ -0,0 +1,57 @@
+"""Tests of export.py's rendering of the dashboard's charts to files."""
+
+import json
+from os import listdir, path
+
+import export
+from export import INDEX_FILENAME, export_charts
+from test_cube import create_books_df
+from wrangle import save_df_cache
+
+
+def load_export_index(snapshot_dir: str) -> dict:
+    """Returns the index of a snapshot's exported charts."""
+
+    with open(path.join(snapshot_dir, INDEX_FILENAME), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_only_changed_charts_are_rendered(tmp_path, monkeypatch):
+
+    books_filename = str(tmp_path / "2024-01-01_multi.parquet")
+    output_dir = str(tmp_path / "exports")
+    snapshot_dir = path.join(output_dir, "2024-01-01_multi")
+
+    atomic_filenames = []
+    write_atomically = export.write_atomically
+
+    def record_write_atomically(filename, content, sync=True):
+        atomic_filenames.append(filename)
+        write_atomically(filename, content, sync)
+
+    monkeypatch.setattr(export, "write_atomically", record_write_atomically)
+
+    save_df_cache(create_books_df(500), books_filename)
+
+    assert export_charts([books_filename], output_dir, ["svg"], 1) == {
+        "rendered": 5, "skipped": 0}
+
+    index = load_export_index(snapshot_dir)
+
+    assert index["books"] == books_filename
+    assert sorted(listdir(snapshot_dir)) == sorted(
+        [INDEX_FILENAME] + [files["svg"] for files in index["charts"].values()])
+    assert path.join(snapshot_dir, INDEX_FILENAME) in atomic_filenames
+
+    assert export_charts([books_filename], output_dir, ["svg"], 1) == {
+        "rendered": 0, "skipped": 5}
+
+    save_df_cache(create_books_df(500, seed=1), books_filename)
+
+    export_charts([books_filename], output_dir, ["svg"], 1)
+
+    new_index = load_export_index(snapshot_dir)
+
+    assert new_index["charts"] != index["charts"]
+    assert sorted(listdir(snapshot_dir)) == sorted(
+        [INDEX_FILENAME] + [files["svg"] for files in new_index["charts"].values()])
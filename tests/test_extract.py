@@ -0,0 +1,124 @@
+"""Tests of extract.py's paged harvest, against the stub API."""
+
+from conftest import create_stub_docs
+from extract import (PAGE_SIZE, SEARCH_FIELDS, create_session, get_search_page,
+                     iter_all_queries_pages, iter_query_pages)
+from scheduler import create_scheduler, get_failed_queries, get_scheduler_report
+
+
+def create_fast_scheduler() -> dict:
+    """Returns a scheduler which never waits for its rate limit."""
+
+    return create_scheduler(4, rate=10_000, burst=10_000)
+
+
+def test_pages_are_stitched_up_to_num_found(stub_api):
+
+    stub_api.corpus = {"space": create_stub_docs("space", 2 * PAGE_SIZE + 50),
+                       "moon": create_stub_docs("moon", 30)}
+
+    query_pages = list(iter_query_pages(["space", "moon"], base_url=stub_api.base_url,
+                                        max_pages=None, cache_dir=None,
+                                        scheduler=create_fast_scheduler()))
+
+    pages_by_query = {}
+    for query, response in query_pages:
+        pages_by_query.setdefault(query, []).append(response)
+
+    assert [len(page["docs"]) for page in pages_by_query["space"]] == [100, 100, 50]
+    assert [len(page["docs"]) for page in pages_by_query["moon"]] == [30]
+
+    keys = [doc["key"] for _, response in query_pages for doc in response["docs"]]
+
+    assert sorted(keys) == sorted(doc["key"] for docs in stub_api.corpus.values()
+                                  for doc in docs)
+    assert sorted((request["query"], request["page"]) for request in stub_api.requests) == [
+        ("moon", 1), ("space", 1), ("space", 2), ("space", 3)]
+
+
+def test_every_page_is_harvested_by_default(stub_api):
+
+    stub_api.corpus = {"space": create_stub_docs("space", 5 * PAGE_SIZE)}
+
+    pages = list(iter_all_queries_pages(["space"], base_url=stub_api.base_url,
+                                        cache_dir=None,
+                                        scheduler=create_fast_scheduler()))
+
+    assert len(pages) == 5
+
+
+def test_pages_are_capped_at_max_pages_with_a_warning(stub_api, capsys):
+
+    stub_api.corpus = {"space": create_stub_docs("space", 5 * PAGE_SIZE)}
+
+    pages = list(iter_all_queries_pages(["space"], base_url=stub_api.base_url,
+                                        max_pages=2, cache_dir=None,
+                                        scheduler=create_fast_scheduler()))
+
+    assert len(pages) == 2
+    assert len(stub_api.requests) == 2
+    assert "Only harvesting 2 of the 5 pages of 'space'" in capsys.readouterr().out
+
+
+def test_retryable_statuses_are_retried(stub_api):
+
+    stub_api.corpus = {"space": create_stub_docs("space", 10)}
+    stub_api.failures = {("space", 1): [503, 429]}
+
+    scheduler = create_fast_scheduler()
+
+    with create_session(1) as session:
+        response = get_search_page(session, "space", base_url=stub_api.base_url,
+                                   backoff=0, cache_dir=None, scheduler=scheduler)
+
+    assert len(response["docs"]) == 10
+    assert len(stub_api.requests) == 3
+
+    report = get_scheduler_report(scheduler)
+
+    assert report["queries"]["space"]["pages_retrieved"] == 1
+    assert get_failed_queries(report) == []
+
+
+def test_pages_failing_every_attempt_are_reported(stub_api):
+
+    stub_api.corpus = {"space": create_stub_docs("space", 2 * PAGE_SIZE)}
+    stub_api.failures = {("space", 2): [503] * 3}
+
+    scheduler = create_fast_scheduler()
+
+    pages = list(iter_all_queries_pages(["space"], base_url=stub_api.base_url,
+                                        max_retries=2, backoff=0, max_pages=None,
+                                        cache_dir=None, scheduler=scheduler))
+
+    assert len(pages) == 1
+    assert get_failed_queries(get_scheduler_report(scheduler)) == ["space"]
+
+
+def test_non_retryable_statuses_are_not_retried(stub_api):
+
+    stub_api.failures = {("space", 1): [404]}
+
+    with create_session(1) as session:
+        response = get_search_page(session, "space", base_url=stub_api.base_url,
+                                   backoff=0, cache_dir=None)
+
+    assert response is None
+    assert len(stub_api.requests) == 1
+
+
+def test_only_the_search_fields_are_requested(stub_api):
+
+    stub_api.corpus = {"space": create_stub_docs("space", 3)}
+
+    with create_session(1) as session:
+        projected = get_search_page(session, "space", base_url=stub_api.base_url,
+                                    cache_dir=None)
+        unprojected = get_search_page(session, "space", fields=None,
+                                      base_url=stub_api.base_url, cache_dir=None)
+
+    assert stub_api.requests[0]["fields"] == SEARCH_FIELDS
+    assert stub_api.requests[1]["fields"] is None
+
+    assert all(set(doc) <= set(SEARCH_FIELDS) for doc in projected["docs"])
+    assert projected["docs"] == unprojected["docs"]
@@ -0,0 +1,42 @@
+"""Tests of filters.py's search index and range filters."""
+
+from filters import build_book_index, filter_book_positions, search_books
+from test_cube import EXACT_RATINGS, create_books_df
+
+
+def test_ratings_on_a_bound_are_kept():
+
+    books_df = create_books_df(1_000)
+    books_df.loc[:len(EXACT_RATINGS) - 1, "average_rating"] = EXACT_RATINGS
+
+    book_index = build_book_index(books_df)
+
+    for low, high in [(4.1, 5.0), (1.0, 4.1), (4.2, 4.2), (2.7, 3.3)]:
+
+        positions = filter_book_positions(
+            book_index, {"ranges": {"average_rating": (low, high)}})
+
+        ratings = (books_df["average_rating"].astype("float64") * 100).round()
+        expected = books_df.index[ratings.between(round(low * 100), round(high * 100))]
+
+        assert positions.tolist() == expected.tolist()
+
+    assert 3 in filter_book_positions(
+        book_index, {"ranges": {"average_rating": (3.3, 3.3)}})
+
+
+def test_searches_and_ranges_combine():
+
+    books_df = create_books_df(1_000)
+
+    book_index = build_book_index(books_df)
+
+    positions = filter_book_positions(
+        book_index, {"search": "book 1", "ranges": {"first_published": (1950, 1999)}})
+
+    expected = books_df.index[
+        books_df["book_title"].str.lower().str.contains("book 1")
+        & books_df["first_published"].between(1950, 1999)]
+
+    assert positions.tolist() == expected.tolist()
+    assert search_books(book_index, "").tolist() == list(range(len(books_df)))
@@ -0,0 +1,45 @@
+"""Tests of instrument.py's stage records."""
+
+import sys
+
+import numpy as np
+import pytest
+
+from instrument import instrument_stage, record_stage, start_stage_collection
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"),
+                    reason="RSS is read from /proc/self/statm")
+def test_stages_record_their_own_memory():
+
+    stage_records = start_stage_collection()
+
+    with record_stage("allocate"):
+        values = np.ones(25_000_000)
+        values[::512] = 2
+
+    with record_stage("release"):
+        del values
+
+    allocate, release = stage_records
+
+    assert allocate["rss_delta_mb"] >= 150
+    assert release["rss_delta_mb"] <= -150
+    assert release["peak_rss_delta_mb"] == 0
+
+
+def test_nested_stages_are_collected_with_their_rows():
+
+    @instrument_stage()
+    def load_rows():
+        return list(range(10))
+
+    stage_records = start_stage_collection()
+
+    with record_stage("outer", cache="miss"):
+        load_rows()
+
+    inner, outer = stage_records
+
+    assert (inner["stage"], inner["rows"], inner["depth"]) == ("load_rows", 10, 1)
+    assert (outer["stage"], outer["cache"], outer["depth"]) == ("outer", "miss", 0)
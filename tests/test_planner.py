@@ -0,0 +1,124 @@
+"""Tests of planner.py's query plans, against the stub API."""
+
+from conftest import create_stub_docs
+from extract import iter_query_pages
+from planner import (create_query_tracker, iter_planned_pages, plan_queries,
+                     update_query_ledger)
+from scheduler import create_scheduler
+
+QUERIES = ["space", "space+flight", "space+station", "moon", "mars", "venus"]
+
+
+def create_stub_corpus(n_space: int = 40) -> dict:
+    """Returns a corpus in which 'space' finds n_space books of its own, as
+    well as those of 'space+flight' and 'space+station'."""
+
+    return {"space": create_stub_docs("space", n_space),
+            "space+flight": create_stub_docs("space+flight", 20),
+            "space+station": create_stub_docs("space+station", 10),
+            "moon": create_stub_docs("moon", 30),
+            "mars": create_stub_docs("mars", 25),
+            "venus": create_stub_docs("venus", 60)}
+
+
+def harvest_keys(query_pages) -> set[str]:
+    """Returns the work keys of the books on the pages of a harvest."""
+
+    return {doc["key"] for _, response in query_pages for doc in response["docs"]}
+
+
+def harvest(stub_api, queries: list[str], max_pages: int | None,
+            ledger: dict | None = None) -> tuple[set[str], dict, dict]:
+    """Returns the work keys of a planned harvest of the queries from the
+    stub API, with its plan and tracker."""
+
+    plan = plan_queries(queries, max_pages, ledger)
+    tracker = create_query_tracker()
+
+    keys = harvest_keys(iter_planned_pages(
+        plan, tracker, base_url=stub_api.base_url, cache_dir=None, backoff=0,
+        scheduler=create_scheduler(4, rate=10_000, burst=10_000)))
+
+    return keys, plan, tracker
+
+
+def harvest_naively(stub_api, queries: list[str], max_pages: int | None) -> set[str]:
+    """Returns the work keys of a harvest of every query as it is."""
+
+    return harvest_keys(iter_query_pages(
+        queries, base_url=stub_api.base_url, max_pages=max_pages, cache_dir=None,
+        backoff=0, scheduler=create_scheduler(4, rate=10_000, burst=10_000)))
+
+
+def test_subsumed_queries_are_pruned_and_small_queries_combined():
+
+    ledger = {"space": {"num_found": 70}, "space+flight": {"num_found": 20},
+              "space+station": {"num_found": 10}, "moon": {"num_found": 30},
+              "mars": {"num_found": 25}, "venus": {"num_found": 60}}
+
+    plan = plan_queries(QUERIES, 1, {query: dict(entry, docs=0, bytes=0)
+                                     for query, entry in ledger.items()})
+
+    assert plan["pruned"] == {"space+flight": "space", "space+station": "space"}
+
+    for members in plan["combined"].values():
+        assert sum(ledger[member]["num_found"] for member in members) <= 100
+
+    planned = {member for query in plan["queries"]
+               for member in plan["combined"].get(query, [query])}
+
+    assert planned == {"space", "moon", "mars", "venus"}
+    assert plan["estimate"]["planned"]["requests"] < plan["estimate"]["naive"]["requests"]
+
+
+def test_queries_are_only_pruned_without_a_ledger_when_harvested_in_full():
+
+    assert plan_queries(QUERIES, 1)["pruned"] == {}
+    assert set(plan_queries(QUERIES, None)["pruned"]) == {"space+flight", "space+station"}
+
+
+def test_planned_harvests_find_every_book(stub_api):
+
+    stub_api.corpus = create_stub_corpus()
+
+    naive_keys = harvest_naively(stub_api, QUERIES, 1)
+
+    keys, _, tracker = harvest(stub_api, QUERIES, 1)
+    ledger = update_query_ledger({}, tracker, "v1")
+
+    stub_api.requests.clear()
+
+    planned_keys, plan, _ = harvest(stub_api, QUERIES, 1, ledger)
+
+    assert keys == naive_keys
+    assert planned_keys == naive_keys
+    assert plan["pruned"] and plan["combined"]
+    assert len(stub_api.requests) < len(QUERIES)
+
+
+def test_stale_ledgers_fall_back_to_the_queries_they_pruned(stub_api):
+
+    stub_api.corpus = create_stub_corpus()
+
+    _, _, tracker = harvest(stub_api, QUERIES, 1)
+    ledger = update_query_ledger({}, tracker, "v1")
+
+    stub_api.corpus = create_stub_corpus(n_space=150)
+
+    planned_keys, plan, tracker = harvest(stub_api, QUERIES, 1, ledger)
+
+    assert plan["pruned"]
+    assert set(plan["pruned"]) <= set(tracker["queries"])
+    assert planned_keys == harvest_naively(stub_api, QUERIES, 1)
+
+
+def test_books_are_only_kept_once(stub_api):
+
+    stub_api.corpus = create_stub_corpus()
+
+    _, _, tracker = harvest(stub_api, ["space", "space+flight"], 1)
+
+    stats = tracker["queries"]
+
+    assert stats["space+flight"]["duplicate_docs"] == 20
+    assert len(tracker["keys"]) == 70
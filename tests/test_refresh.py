@@ -0,0 +1,137 @@
+"""Tests of refresh.py's publishing of snapshots, against the stub API."""
+
+from glob import glob
+from os import path, remove
+
+import pytest
+
+from conftest import create_stub_docs
+from database import get_database_version
+import extract
+from extract import SEARCH_QUERIES_LIST
+from planner import load_query_ledger, plan_queries
+import refresh
+
+
+@pytest.fixture
+def stub_refresh(stub_api, tmp_path, monkeypatch):
+    """Yields the stub API, with every search query finding a few books, and
+    refreshes publishing into a temporary directory from it."""
+
+    get_search_page = extract.get_search_page
+
+    def get_stub_search_page(session, query, page, page_size, fields, base_url,
+                             max_retries, backoff, cache_dir, scheduler):
+        return get_search_page(session, query, page, page_size, fields,
+                               stub_api.base_url, max_retries, 0, None, scheduler)
+
+    monkeypatch.setattr(extract, "get_search_page", get_stub_search_page)
+    monkeypatch.chdir(tmp_path)
+
+    stub_api.corpus = {query: create_stub_docs(query, 5) for query in SEARCH_QUERIES_LIST}
+
+    yield stub_api
+
+
+def test_complete_refreshes_are_published(stub_refresh):
+
+    manifest = refresh.refresh_snapshot("2024-01-01")
+
+    assert manifest["version"] == "2024-01-01"
+    assert manifest["n_books"] == 5 * len(SEARCH_QUERIES_LIST)
+    assert "partial" not in manifest
+
+
+def test_incomplete_refreshes_keep_the_last_snapshot(stub_refresh):
+
+    refresh.refresh_snapshot("2024-01-01")
+
+    query_plan = plan_queries(max_pages=refresh.get_harvest_max_pages(),
+                              ledger=load_query_ledger())
+
+    stub_refresh.failures = {(query_plan["queries"][0], 1): [404]}
+
+    manifest = refresh.refresh_snapshot("2024-01-02")
+
+    assert manifest["version"] == "2024-01-01"
+    assert refresh.load_manifest()["version"] == "2024-01-01"
+    assert refresh.load_manifest()["kept_for"] == "2024-01-02"
+    assert not path.isfile("2024-01-02_multi.ndjson")
+
+
+def test_incomplete_first_refreshes_are_published_as_partial(stub_refresh):
+
+    stub_refresh.failures = {("moon", 1): [404]}
+
+    manifest = refresh.refresh_snapshot("2024-01-01")
+
+    assert manifest["partial"] is True
+    assert manifest["failed_queries"] == ["moon"]
+    assert manifest["n_books"] == 5 * (len(SEARCH_QUERIES_LIST) - 1)
+
+    manifest = refresh.refresh_snapshot("2024-01-01")
+
+    assert "partial" not in manifest
+    assert manifest["n_books"] == 5 * len(SEARCH_QUERIES_LIST)
+
+
+def test_kept_snapshots_are_shown_under_their_own_version(stub_refresh, monkeypatch):
+
+    import main
+
+    refresh.refresh_snapshot("2024-01-01")
+
+    query_plan = plan_queries(max_pages=refresh.get_harvest_max_pages(),
+                              ledger=load_query_ledger())
+
+    stub_refresh.failures = {(query_plan["queries"][0], 1): [404]}
+
+    monkeypatch.setattr(main, "get_today_version", lambda: "2024-01-02")
+
+    books_df = main.extract_wrangle_pd_df(backend="sqlite")
+
+    assert len(books_df) == 5 * len(SEARCH_QUERIES_LIST)
+    assert get_database_version(main.DATABASE_FILENAME) == "2024-01-01"
+    assert main.get_data_version() == "2024-01-01"
+
+    n_requests = len(stub_refresh.requests)
+
+    cube_filename = refresh.load_manifest()["cube"]
+    remove(cube_filename)
+
+    dataset = main.build_dashboard_dataset("2024-01-02")
+
+    assert dataset["version"] == "2024-01-01"
+    assert len(stub_refresh.requests) == n_requests
+    assert glob("2024-01-02*") == []
+    assert path.isfile(cube_filename)
+
+
+def test_replaced_snapshots_are_removed(stub_refresh):
+
+    first_manifest = refresh.refresh_snapshot("2024-01-01")
+
+    manifest = refresh.refresh_snapshot("2024-01-02")
+
+    assert manifest["version"] == "2024-01-02"
+    assert path.isfile(manifest["books"]) and path.isfile(manifest["cube"])
+    assert not path.isfile(first_manifest["books"])
+    assert not path.isfile(first_manifest["cube"])
+
+
+def test_extracts_are_written_into_the_snapshot_directory(stub_refresh, tmp_path,
+                                                          monkeypatch):
+
+    snapshot_dir = str(tmp_path / "snapshots")
+
+    monkeypatch.setattr(refresh, "SNAPSHOT_DIR", snapshot_dir)
+
+    refresh.refresh_snapshot("2024-01-01")
+
+    assert path.isfile(path.join(snapshot_dir, "2024-01-01_multi.ndjson"))
+    assert glob("*.ndjson") == []
+
+    refresh.refresh_snapshot("2024-01-02")
+
+    assert glob(path.join(snapshot_dir, "*.ndjson")) == [
+        path.join(snapshot_dir, "2024-01-02_multi.ndjson")]
@@ -0,0 +1,139 @@
+"""Tests of scheduler.py's rate limiting, throttling and circuit breaker."""
+
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+from time import monotonic, sleep
+
+import pytest
+import requests
+
+from scheduler import (create_scheduler, finish_request, get_failed_queries,
+                       get_retry_after, get_scheduler_report, record_query_page,
+                       wait_for_turn)
+
+
+def create_response(status_code: int, headers: dict | None = None) -> requests.Response:
+    """Returns an empty response with a status code and headers."""
+
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+
+    return response
+
+
+def send(scheduler: dict, status_code: int | None, latency: float = 0.01,
+         headers: dict | None = None) -> None:
+    """Sends a request through the scheduler, answered with status_code (or
+    with a connection error, if None)."""
+
+    wait_for_turn(scheduler)
+    finish_request(scheduler, latency,
+                   None if status_code is None else create_response(status_code, headers))
+
+
+def test_requests_are_spaced_out_past_the_burst():
+
+    scheduler = create_scheduler(4, rate=20, burst=2)
+
+    start = monotonic()
+
+    for _ in range(6):
+        send(scheduler, 200)
+
+    assert monotonic() - start >= (6 - 2) / 20 * 0.9
+
+
+def test_retry_after_is_read_as_seconds_or_a_date():
+
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+
+    assert get_retry_after(create_response(429, {"Retry-After": "7"})) == 7
+    assert 25 < get_retry_after(create_response(
+        429, {"Retry-After": format_datetime(retry_at, usegmt=True)})) <= 30
+    assert get_retry_after(create_response(429)) is None
+    assert get_retry_after(create_response(429, {"Retry-After": "soon"})) is None
+
+
+def test_throttling_pauses_requests_and_halves_concurrency():
+
+    scheduler = create_scheduler(8, rate=1000, burst=1000)
+
+    send(scheduler, 429, headers={"Retry-After": "0.2"})
+
+    report = get_scheduler_report(scheduler)
+
+    assert report["throttled"] == 1
+    assert report["concurrency_limit"] == 4
+
+    start = monotonic()
+    send(scheduler, 200)
+
+    assert monotonic() - start >= 0.15
+
+
+def test_concurrency_grows_back_after_fast_responses():
+
+    scheduler = create_scheduler(4, rate=1000, burst=1000)
+
+    send(scheduler, 429, headers={"Retry-After": "0"})
+    assert scheduler["concurrency_limit"] == 2
+
+    for _ in range(2 + 3):
+        send(scheduler, 200)
+
+    assert scheduler["concurrency_limit"] == 4
+
+
+def test_slow_responses_shrink_concurrency():
+
+    scheduler = create_scheduler(8, rate=1000, burst=1000, latency_tolerance=2)
+
+    send(scheduler, 200, latency=0.01)
+
+    for _ in range(20):
+        send(scheduler, 200, latency=0.1)
+
+    assert scheduler["concurrency_limit"] < 8
+
+
+def test_circuit_opens_after_repeated_failures_and_probes_to_close():
+
+    scheduler = create_scheduler(4, rate=1000, burst=1000,
+                                 failure_threshold=3, reset_seconds=0.2)
+
+    for _ in range(3):
+        send(scheduler, None)
+
+    assert get_scheduler_report(scheduler)["circuit"] == "open"
+
+    with pytest.raises(requests.ConnectionError):
+        wait_for_turn(scheduler)
+
+    sleep(0.25)
+
+    wait_for_turn(scheduler)
+
+    assert scheduler["circuit"] == "half-open"
+
+    with pytest.raises(requests.ConnectionError):
+        wait_for_turn(scheduler)
+
+    finish_request(scheduler, 0.01, create_response(200))
+
+    assert get_scheduler_report(scheduler)["circuit"] == "closed"
+
+
+def test_failed_pages_are_reported_per_query():
+
+    scheduler = create_scheduler(4)
+
+    record_query_page(scheduler, "space", 1, True, 1)
+    record_query_page(scheduler, "space", 2, False, 4)
+    record_query_page(scheduler, "moon", 1, True, 2)
+
+    report = get_scheduler_report(scheduler)
+
+    assert report["queries"]["space"] == {"pages_retrieved": 1, "pages_failed": 1,
+                                          "failed_pages": [2], "retries": 3}
+    assert get_failed_queries(report) == ["space"]
@@ -0,0 +1,136 @@
+"""Tests of store.py's incremental book store."""
+
+from os import path, remove
+
+import pandas as pd
+import pytest
+
+import store
+from store import (compact_store, get_segment_filenames, materialise_books,
+                   upsert_books)
+from test_cube import create_books_df
+
+
+@pytest.fixture
+def store_dir(tmp_path):
+    """Returns the directory of an empty book store."""
+
+    return str(tmp_path / "books_store")
+
+
+def rebuild_books(ingested_dfs: list[pd.DataFrame]) -> pd.DataFrame:
+    """Returns the books a store should hold after ingesting each of
+    ingested_dfs in turn, with the latest version of each book winning,
+    sorted by work key."""
+
+    return sort_books(pd.concat(ingested_dfs, ignore_index=True).drop_duplicates(
+        subset=["unique_key"], keep="last"))
+
+
+def sort_books(books_df: pd.DataFrame) -> pd.DataFrame:
+    """Returns books sorted by work key (the store keeps them in the order
+    they were last written), with author names as strings (as the categories
+    of books merged from several frames differ)."""
+
+    return books_df.sort_values("unique_key", ignore_index=True).astype(
+        {col: "str" for col in ["author_name"] if col in books_df.columns})
+
+
+def change_ratings(books_df: pd.DataFrame, n_books: int,
+                   rating: float = 1.23) -> pd.DataFrame:
+    """Returns books_df with the ratings of its first n_books changed."""
+
+    changed_df = books_df.copy()
+    changed_df.loc[:n_books - 1, "average_rating"] = rating
+
+    return changed_df
+
+
+def test_only_new_and_changed_books_are_written(store_dir):
+
+    books_df = create_books_df(1_000)
+
+    assert upsert_books(books_df, store_dir) == {"new": 1_000, "changed": 0,
+                                                 "unchanged": 0}
+    assert upsert_books(books_df, store_dir) == {"new": 0, "changed": 0,
+                                                 "unchanged": 1_000}
+
+    changed_df = pd.concat([change_ratings(books_df, 10),
+                            create_books_df(1_005).tail(5)], ignore_index=True)
+
+    assert upsert_books(changed_df, store_dir) == {"new": 5, "changed": 10,
+                                                   "unchanged": 990}
+
+    segment_filenames = get_segment_filenames(store_dir)
+
+    assert len(segment_filenames) == 2
+    assert len(pd.read_parquet(segment_filenames[-1])) == 15
+
+    pd.testing.assert_frame_equal(sort_books(materialise_books(store_dir)),
+                                  rebuild_books([books_df, changed_df]))
+
+
+def test_materialising_only_reads_new_segments(store_dir):
+
+    first_df = create_books_df(500)
+    upsert_books(first_df, store_dir)
+
+    materialise_books(store_dir)
+
+    second_df = change_ratings(first_df, 50)
+    upsert_books(second_df, store_dir)
+
+    # The first segment is already materialised, so is never read again.
+    remove(get_segment_filenames(store_dir)[0])
+
+    pd.testing.assert_frame_equal(sort_books(materialise_books(store_dir)),
+                                  rebuild_books([first_df, second_df]))
+    pd.testing.assert_frame_equal(sort_books(materialise_books(store_dir, ["unique_key"])),
+                                  rebuild_books([first_df, second_df])[["unique_key"]])
+
+
+def test_segment_numbers_are_never_reused(store_dir):
+
+    books_df = create_books_df(300)
+
+    for n_books in [100, 200, 300]:
+        upsert_books(books_df.head(n_books), store_dir)
+
+    remove(get_segment_filenames(store_dir)[1])
+
+    upsert_books(change_ratings(books_df, 5), store_dir)
+
+    assert [path.basename(filename) for filename in get_segment_filenames(store_dir)] == [
+        "segment_00000.parquet", "segment_00002.parquet", "segment_00003.parquet"]
+    assert len(pd.read_parquet(get_segment_filenames(store_dir)[1])) == 100
+
+
+def test_compaction_keeps_the_latest_books(store_dir, monkeypatch):
+
+    monkeypatch.setattr(store, "MAX_SEGMENTS", 3)
+
+    books_df = create_books_df(400)
+    ingested_dfs = [books_df.head(100)]
+
+    upsert_books(ingested_dfs[0], store_dir)
+    materialise_books(store_dir)
+
+    for n_books in [200, 300, 400]:
+        ingested_dfs.append(change_ratings(books_df.head(n_books), n_books // 10))
+        upsert_books(ingested_dfs[-1], store_dir)
+
+    assert [path.basename(filename) for filename in get_segment_filenames(store_dir)] == [
+        "segment_00003.parquet"]
+
+    pd.testing.assert_frame_equal(sort_books(materialise_books(store_dir)),
+                                  rebuild_books(ingested_dfs))
+
+    ingested_dfs.append(change_ratings(books_df, 1, rating=2.34))
+    upsert_books(ingested_dfs[-1], store_dir)
+    compact_store(store_dir)
+
+    assert [path.basename(filename) for filename in get_segment_filenames(store_dir)] == [
+        "segment_00004.parquet"]
+
+    pd.testing.assert_frame_equal(sort_books(materialise_books(store_dir)),
+                                  rebuild_books(ingested_dfs))
@@ -0,0 +1,115 @@
+"""Tests of streaming.py's online aggregates and sketches."""
+
+from collections import Counter
+import random
+
+import numpy as np
+
+from benchmark import generate_search_responses
+from cube import build_aggregate_cube, get_cube_counts, get_cube_totals
+from streaming import (add_to_hyperloglog, create_heavy_hitters,
+                       create_hyperloglog, create_running_stats,
+                       create_stream_aggregates, estimate_hyperloglog,
+                       get_heavy_hitters, get_running_variance,
+                       get_stream_counts, get_stream_progress,
+                       get_stream_totals, update_heavy_hitters,
+                       update_running_stats, update_stream_aggregates)
+from wrangle import (apply_df_schema, create_pd_df, get_book_row,
+                     remove_duplicate_nan_values_format_cols_df)
+
+
+def test_running_stats_match_numpy():
+
+    values = [random.Random(0).gauss(3, 1) for _ in range(1000)]
+
+    stats = create_running_stats()
+    for value in values:
+        update_running_stats(stats, value)
+
+    assert np.isclose(stats["mean"], np.mean(values))
+    assert np.isclose(get_running_variance(stats), np.var(values))
+
+
+def test_heavy_hitters_stay_within_their_error_bound():
+
+    rng = random.Random(0)
+    stream = [f"author {int(rng.paretovariate(1.2))}" for _ in range(20_000)]
+    true_counts = Counter(stream)
+
+    capacity = 64
+    sketch = create_heavy_hitters(capacity)
+    for item in stream:
+        update_heavy_hitters(sketch, item)
+
+    counts = get_heavy_hitters(sketch)
+
+    assert len(counts) == capacity
+    assert counts.is_monotonic_decreasing
+
+    for item, count in counts.items():
+        assert count - sketch["errors"][item] <= true_counts[item] <= count
+
+    for item, true_count in true_counts.items():
+        if true_count > len(stream) / capacity:
+            assert item in sketch["counts"]
+
+    assert counts.index[0] == true_counts.most_common(1)[0][0]
+
+
+def test_hyperloglog_estimates_distinct_items():
+
+    for n_items in [100, 5_000, 100_000]:
+
+        sketch = create_hyperloglog()
+        for i in range(n_items):
+            add_to_hyperloglog(sketch, f"author {i}")
+            add_to_hyperloglog(sketch, f"author {i // 2}")
+
+        assert abs(estimate_hyperloglog(sketch) - n_items) <= 0.05 * n_items
+
+
+def test_stream_aggregates_match_the_aggregate_cube():
+
+    responses = generate_search_responses(5_000, n_responses=50)
+
+    aggregates = create_stream_aggregates(max_pages=None)
+    for response in responses:
+        update_stream_aggregates(aggregates, "space", response)
+
+    books_df = apply_df_schema(remove_duplicate_nan_values_format_cols_df(
+        create_pd_df(responses)))
+    cube = build_aggregate_cube(books_df)
+
+    stream_totals = get_stream_totals(aggregates)
+    cube_totals = get_cube_totals(cube)
+
+    assert stream_totals["total_books"] == cube_totals["total_books"] == len(books_df)
+    assert stream_totals["avg_rating"] == cube_totals["avg_rating"]
+    assert stream_totals["avg_languages"] == cube_totals["avg_languages"]
+    assert (abs(stream_totals["distinct_authors"] - books_df["author_name"].nunique())
+            <= 0.05 * books_df["author_name"].nunique())
+
+    for dimension in ["first_published", "rating_bucket"]:
+
+        stream_counts = get_stream_counts(aggregates, dimension)
+        cube_counts = get_cube_counts(cube, dimension)
+
+        assert stream_counts.to_dict() == cube_counts.to_dict()
+
+    assert get_stream_progress(aggregates) == (5_000, 5_000)
+
+
+def test_book_rows_match_the_wrangled_books():
+
+    responses = generate_search_responses(2_000)
+    docs = [doc for response in responses for doc in response["docs"]]
+
+    books_df = remove_duplicate_nan_values_format_cols_df(create_pd_df(responses))
+
+    rows = {}
+    for doc in docs:
+        row = get_book_row(doc)
+        if row is not None:
+            rows.setdefault(row["unique_key"], row)
+
+    assert list(rows.values()) == books_df.to_dict("records")
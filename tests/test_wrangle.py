@@ -0,0 +1,142 @@
+"""Tests of wrangle.py's reading of extracted files into pd.DataFrame objects."""
+
+import json
+from os import path
+
+import pandas as pd
+import pytest
+
+from benchmark import create_pd_df_per_doc, generate_search_responses
+from wrangle import (create_pd_df, create_pd_df_from_docs, create_pd_df_parallel,
+                     load_ndjson_docs_range)
+
+
+FIELD_CASE_DOCS = [
+    {"key": "/works/OL1W", "title_suggest": "Only suggested"},
+    {"key": "/works/OL2W", "title": "Title", "title_suggest": "Suggested"},
+    {"key": "/works/OL3W", "subtitle": "Subtitle", "title_suggest": "Suggested"},
+    {"key": "/works/OL4W", "title": "Title", "subtitle": "Subtitle",
+     "title_suggest": "Suggested", "author_name": ["Author"],
+     "author_alternative_name": ["A."], "ratings_average": 4.1,
+     "language": ["eng", "fre"], "first_publish_year": 1969},
+    {"key": "/works/OL5W", "title_suggest": "Suggested",
+     "author_alternative_name": ["A."], "language": []},
+    {"key": "/works/OL6W", "title_suggest": "Suggested", "ratings_average": 3,
+     "first_publish_year": 2001}]
+
+
+def write_ndjson(docs: list[dict], filename: str) -> str:
+    """Writes docs to a newline-delimited JSON file, returning its filename."""
+
+    with open(filename, "w", encoding="utf-8") as f:
+        for doc in docs:
+            f.write(json.dumps(doc, separators=(",", ":")) + "\n")
+
+    return filename
+
+
+@pytest.fixture
+def ndjson_docs(tmp_path) -> tuple[str, list[dict]]:
+    """Returns the filename of a newline-delimited JSON file of 40 docs of
+    varying lengths, and its docs."""
+
+    docs = [doc for response in generate_search_responses(40)
+            for doc in response["docs"]]
+
+    return write_ndjson(docs, str(tmp_path / "extract.ndjson")), docs
+
+
+def load_ndjson_docs_chunks(ndjson_filename: str, boundaries: list[int]) -> list[dict]:
+    """Returns the docs of a newline-delimited JSON file, read in the ranges
+    between consecutive byte offsets in boundaries."""
+
+    return [doc for start, end in zip(boundaries, boundaries[1:])
+            for doc in load_ndjson_docs_range(ndjson_filename, start, end)]
+
+
+def test_every_doc_is_read_once_at_any_chunk_size(ndjson_docs):
+
+    ndjson_filename, docs = ndjson_docs
+    file_size = path.getsize(ndjson_filename)
+
+    with open(ndjson_filename, "rb") as f:
+        line_size = len(f.readline())
+
+    for chunk_bytes in [1, 2, 7, line_size, line_size + 1, 1_000, file_size,
+                        file_size + 1]:
+
+        boundaries = list(range(0, file_size, chunk_bytes)) + [file_size]
+
+        assert load_ndjson_docs_chunks(ndjson_filename, boundaries) == docs
+
+
+def test_every_doc_is_read_once_at_any_split(ndjson_docs):
+
+    ndjson_filename, docs = ndjson_docs
+    file_size = path.getsize(ndjson_filename)
+
+    with open(ndjson_filename, "rb") as f:
+        line_starts = [0]
+        for line in f:
+            line_starts.append(line_starts[-1] + len(line))
+
+    for split in range(1, file_size):
+        assert load_ndjson_docs_chunks(ndjson_filename, [0, split, file_size]) == docs
+
+    assert load_ndjson_docs_chunks(ndjson_filename, line_starts) == docs
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+@pytest.mark.parametrize("chunk_bytes", [64, 512, 64 * 1024 ** 2])
+def test_parallel_wrangling_matches_serial_wrangling(tmp_path, max_workers, chunk_bytes):
+
+    json_responses = generate_search_responses(60, n_responses=3, seed=1)
+    # No doc in this file has any languages, so neither do its chunks.
+    no_language_docs = [doc for response in generate_search_responses(
+        30, missing_rates={"language": 1.0}, seed=2) for doc in response["docs"]]
+    ndjson_docs = [doc for response in generate_search_responses(50, seed=3)
+                   for doc in response["docs"]]
+
+    json_filename = str(tmp_path / "extract.json")
+    with open(json_filename, "w", encoding="utf-8") as f:
+        json.dump(json_responses, f)
+
+    filenames = [write_ndjson([], str(tmp_path / "empty.ndjson")),
+                 write_ndjson(no_language_docs, str(tmp_path / "no_language.ndjson")),
+                 json_filename,
+                 write_ndjson(ndjson_docs, str(tmp_path / "extract.ndjson"))]
+
+    expected = create_pd_df([{"docs": no_language_docs}, *json_responses,
+                             {"docs": ndjson_docs}])
+
+    result_df = create_pd_df_parallel(filenames, max_workers, chunk_bytes)
+
+    pd.testing.assert_frame_equal(result_df, expected)
+    assert result_df.dtypes.to_dict() == expected.dtypes.to_dict()
+
+
+def test_parallel_wrangling_of_empty_files_matches_serial_wrangling(tmp_path):
+
+    filenames = [write_ndjson([], str(tmp_path / f"empty_{i}.ndjson")) for i in range(2)]
+
+    pd.testing.assert_frame_equal(create_pd_df_parallel(filenames, 2, 64),
+                                  create_pd_df([]))
+    pd.testing.assert_frame_equal(create_pd_df_parallel([], 2), create_pd_df([]))
+
+
+def test_docs_missing_fields_match_the_per_doc_baseline():
+
+    responses = [{"docs": FIELD_CASE_DOCS}]
+
+    pd.testing.assert_frame_equal(create_pd_df(responses),
+                                  create_pd_df_per_doc(responses))
+    pd.testing.assert_frame_equal(create_pd_df_from_docs(FIELD_CASE_DOCS, chunk_size=4),
+                                  create_pd_df_per_doc(responses))
+
+    for field in ["title", "subtitle", "author_name", "language"]:
+
+        responses = generate_search_responses(
+            2_000, missing_rates={field: 0.5, "author_alternative_name": 0.5})
+
+        pd.testing.assert_frame_equal(create_pd_df(responses),
+                                      create_pd_df_per_doc(responses))